@@ -0,0 +1,430 @@
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from bulk_writer import LAYOUTS, BulkWriter
+from convert_to_alphafold_input import ABCChains, convert_folder, convert_to_alphafold_input_one_fasta
+from extract_chains_pdb import extract_chains
+from extract_chains_seq import main as extract_sequences, read_sequences
+from interface_residues import find_interface_residues_pairs
+from pipeline import build_design_pipeline, iter_candidates
+from read_confidences import read_high_confidences
+from screen_parallel import screen_files
+from synthetic_data import SyntheticConfig, generate_af3_outputs, generate_designs
+
+
+def time_call(fn, *args, repeat=3, **kwargs) -> float:
+    """Best wall-clock time of `repeat` calls, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_sequence_backends(pdb_paths, chain_ids=None, repeat=3) -> dict:
+    """
+    Compare the Bio.PDB and the streaming backends of extract_chains_seq.read_sequences.
+
+    Returns:
+        dict: Total seconds per backend over all files, the speedup, and whether
+              both backends returned the same sequences for every file.
+    """
+    totals = {}
+    for backend in ("biopython", "stream"):
+        totals[backend] = sum(time_call(read_sequences, path, chain_ids, backend, repeat=repeat)
+                              for path in pdb_paths)
+    same = all(read_sequences(path, chain_ids, "biopython") == read_sequences(path, chain_ids, "stream")
+               for path in pdb_paths)
+    return {
+        "files": len(pdb_paths),
+        "seconds": totals,
+        "speedup": totals["biopython"] / totals["stream"],
+        "same_sequences": same,
+    }
+
+
+def bench_interface_engines(pdb_paths, cutoffs=(3.5, 4.0, 5.0, 8.0), repeat=3) -> dict:
+    """
+    Compare the PyMOL and the k-d tree engines of interface_residues.find_interface_residues_pairs
+    on every chain pair of each file.
+
+    Returns:
+        dict: Total seconds per engine at 5 Å, the speedup, and for every cutoff whether both
+              engines returned the same interface residues for every file and chain pair.
+    """
+    try:
+        import pymol  # noqa: F401
+    except ImportError:
+        return {"skipped": "the pymol engine needs PyMOL"}
+
+    chain_pairs = {path: list(itertools.combinations(sorted(read_sequences(path, None, "stream")), 2))
+                   for path in pdb_paths}
+    totals = {}
+    for engine in ("pymol", "kdtree"):
+        totals[engine] = sum(time_call(find_interface_residues_pairs, path, chain_pairs[path], 5.0, engine,
+                                       repeat=repeat)
+                             for path in pdb_paths)
+    same = {str(cutoff): all(find_interface_residues_pairs(path, chain_pairs[path], cutoff, "pymol")
+                             == find_interface_residues_pairs(path, chain_pairs[path], cutoff, "kdtree")
+                             for path in pdb_paths)
+            for cutoff in cutoffs}
+    return {
+        "files": len(pdb_paths),
+        "seconds": totals,
+        "speedup": totals["pymol"] / totals["kdtree"],
+        "same_residues": same,
+    }
+
+
+def _random_sequence(rng, length) -> str:
+    return "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(length))
+
+
+def bench_writers(n_records=2000, output_dir=None, kind="af3", seed=0) -> dict:
+    """
+    Files/sec for writing `n_records` outputs one file at a time, the way convert_folder and
+    extract_chains_seq do without a writer ("direct"), against BulkWriter with each layout.
+
+    Args:
+        n_records (int): Records written per layout.
+        output_dir (str): Scratch directory on the file system to measure (e.g. the shared
+            one). Defaults to a temporary directory, removed afterwards.
+        kind (str): "af3" for AlphaFold3 input JSON or "fasta" for H/L FASTA records.
+
+    Returns:
+        dict: {"records": n, "direct": {...}, layout: {...}} with seconds, records/sec and bytes.
+    """
+    rng = random.Random(seed)
+    chains = ABCChains(name="", chainA=_random_sequence(rng, 275), chainB=_random_sequence(rng, 99),
+                       chainC=_random_sequence(rng, 9))
+    pairs = [(_random_sequence(rng, 220), _random_sequence(rng, 215)) for _ in range(n_records)]
+    layouts = [layout for layout in LAYOUTS if kind == "fasta" or layout != "fasta"]
+    scratch = tempfile.mkdtemp(dir=output_dir)
+
+    def write_fasta(path, H_seq, L_seq, writer):
+        text = f">{os.path.basename(path)}_H\n{H_seq}\n>{os.path.basename(path)}_L\n{L_seq}\n"
+        if writer is not None:
+            writer.write(path, text)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def run(name, writer):
+        base = os.path.join(scratch, name)
+        start = time.perf_counter()
+        for i, (H_seq, L_seq) in enumerate(pairs):
+            output = f"{i % 100:02d}/design_{i:06d}.{'json' if kind == 'af3' else 'fasta'}"
+            output = output if writer is not None else os.path.join(base, output)
+            if kind == "af3":
+                job = ABCChains(name=f"design_{i:06d}", chainA=chains.chainA, chainB=chains.chainB,
+                                chainC=chains.chainC)
+                convert_to_alphafold_input_one_fasta(output, job, H_seq, L_seq, writer=writer)
+            else:
+                write_fasta(output, H_seq, L_seq, writer)
+        if writer is not None:
+            writer.close()
+        seconds = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(base) for file in files)
+        return {"seconds": seconds, "records_per_second": n_records / seconds, "bytes": size}
+
+    try:
+        report = {"records": n_records, "direct": run("direct", None)}
+        for layout in layouts:
+            report[layout] = run(layout, BulkWriter(os.path.join(scratch, layout), layout))
+    finally:
+        shutil.rmtree(scratch)
+    return report
+
+
+def _peak_rss_mb(who) -> float:
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return resource.getrusage(who).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _run_measured(queue, fn, args, kwargs):
+    # Body of the child process of measure_stage
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result, error = fn(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    queue.put({"seconds": seconds,
+               "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+               "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+               "result": result, "error": error})
+
+
+def measure_stage(fn, *args, **kwargs) -> dict:
+    """
+    Run `fn(*args, **kwargs)` in a fresh (spawned) process, so that its peak RSS is not
+    hidden by what earlier stages allocated, and discard what it prints.
+
+    If the process dies without reporting (killed for memory, a crash in a C extension), the
+    stage gets an error instead of blocking the suite.
+
+    Returns:
+        dict: seconds, peak_rss_mb of the stage process, children_peak_rss_mb (largest worker
+              process it started, if any), the picklable return value of `fn` and the error.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_measured, args=(queue, fn, args, kwargs))
+    start = time.perf_counter()
+    process.start()
+    measured = None
+    while measured is None:
+        try:
+            measured = queue.get(timeout=1.0)
+        except queue_module.Empty:
+            if not process.is_alive():
+                # Give a result put just before exiting the time to arrive
+                try:
+                    measured = queue.get(timeout=1.0)
+                except queue_module.Empty:
+                    measured = {"seconds": time.perf_counter() - start, "peak_rss_mb": None,
+                                "children_peak_rss_mb": None, "result": None,
+                                "error": f"Stage process exited with code {process.exitcode} without a result"}
+    process.join()
+    return measured
+
+
+def _stage_chain_extraction(paths, output_base, chains):
+    os.makedirs(output_base, exist_ok=True)
+    for i, path in enumerate(paths):
+        extract_chains(path, os.path.join(output_base, f"{i:06d}.pdb"), chains)
+    return len(paths)
+
+
+def _stage_sequence_extraction(input_base, output_base, backend):
+    extract_sequences(input_base, output_base, backend=backend)
+    return sum(len(files) for _, _, files in os.walk(output_base))
+
+
+def _stage_screening(paths, chain_pairs, workers, engine):
+    results = list(screen_files(paths, chain_pairs, engine=engine, workers=workers))
+    return {"hits": [result.path for result in results if result.is_hit],
+            "errors": sum(result.error is not None for result in results)}
+
+
+def _stage_af3_json(input_base, work_dir, chains):
+    # convert_folder flattens `{output_base}/{relative path}` into one file name in the working directory
+    os.chdir(work_dir)
+    convert_folder(os.path.abspath(input_base), "af_input", chains["A"], chains["B"], chains["C"], 1)
+    return sum(file.startswith("af_input__") for file in os.listdir(work_dir))
+
+
+def _stage_confidence_reading(base_path):
+    return sorted(read_high_confidences(base_path))
+
+
+def _stage_pipeline(input_base, output_base, chains, workers):
+    pipeline = build_design_pipeline(output_base, chains["A"], chains["B"], chains["C"],
+                                     screen_workers=workers, sequence_workers=workers, json_workers=0)
+    errors = sum(result.error is not None for result in pipeline.run(iter_candidates(input_base)))
+    return {"jobs": len(os.listdir(output_base)), "errors": errors}
+
+
+def _throughput(measured, items) -> dict:
+    ok = measured["seconds"] and measured["error"] is None
+    return {"items": items, "items_per_second": items / measured["seconds"] if ok else None,
+            **{key: value for key, value in measured.items() if key != "result"}}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_pipeline(n_designs=200, n_af3_jobs=100, workers=(1, 2, 4), config: SyntheticConfig = None, fmt="pdb",
+                   work_dir=None, keep=False) -> dict:
+    """
+    End-to-end benchmark of the pipeline stages on synthetic data (see synthetic_data.py):
+    chain extraction, sequence extraction, interface screening, AlphaFold3 JSON generation,
+    confidence reading, and the streaming pipeline (screen -> sequences -> AF3 JSON).
+
+    Every stage runs in its own process (see `measure_stage`). Screening and the streaming
+    pipeline are repeated for each worker count; `scaling` is the speedup over the first one.
+    Results are checked against what the generator planted (`valid`).
+
+    Args:
+        n_designs (int): Synthetic design structures.
+        n_af3_jobs (int): Synthetic AlphaFold3 output folders.
+        workers (tuple): Worker counts for the parallel stages.
+        config (SyntheticConfig): Shape of the complexes (chain lengths, scale, hit fraction, seed).
+        fmt (str): "pdb" or "cif" designs.
+        work_dir (str): Where the data and outputs go. Defaults to a temporary directory.
+        keep (bool): Keep `work_dir` afterwards.
+
+    Returns:
+        dict: Machine-readable report: {"meta", "config", "stages"}. Compare two reports with
+              `compare_reports`.
+    """
+    config = config or SyntheticConfig()
+    work_dir = work_dir or tempfile.mkdtemp(prefix="benchmark_")
+    designs_base = os.path.join(work_dir, "designs")
+    af_output = os.path.join(work_dir, "af_output")
+    chain_pairs = [("C", "H"), ("C", "L")]
+    try:
+        start = time.perf_counter()
+        designs = generate_designs(designs_base, n_designs, config, fmt)
+        expected_selected = generate_af3_outputs(af_output, n_af3_jobs, config)
+        generation_seconds = time.perf_counter() - start
+        paths = [path for path, _ in designs]
+        expected_hits = sorted(path for path, hit in designs if hit)
+        with open(paths[0], 'r') as f:
+            n_atoms = sum(line.startswith("ATOM") for line in f)
+
+        # The antigen chains of the AF3 jobs, as they would come from the target's FASTA
+        chains = read_sequences(paths[0], ["A", "B", "C"], "stream")
+        stages = {}
+
+        measured = measure_stage(_stage_chain_extraction, paths, os.path.join(work_dir, "chains"), ["A", "B", "C"])
+        stages["chain_extraction"] = dict(_throughput(measured, n_designs), valid=measured["result"] == n_designs)
+
+        fasta_base = os.path.join(work_dir, "fasta")
+        measured = measure_stage(_stage_sequence_extraction, designs_base, fasta_base, "stream")
+        stages["sequence_extraction"] = dict(_throughput(measured, n_designs),
+                                             valid=measured["result"] == n_designs)
+
+        screening = {}
+        for n in workers:
+            measured = measure_stage(_stage_screening, paths, chain_pairs, n, "kdtree")
+            result = measured["result"] or {}
+            screening[str(n)] = dict(_throughput(measured, n_designs),
+                                     valid=sorted(result.get("hits", [])) == expected_hits)
+        stages["interface_screening"] = {"workers": screening}
+
+        # Cleared first: a rerun with the same --work-dir would otherwise count the old JSON files
+        shutil.rmtree(os.path.join(work_dir, "af_input"), ignore_errors=True)
+        os.makedirs(os.path.join(work_dir, "af_input"), exist_ok=True)
+        measured = measure_stage(_stage_af3_json, fasta_base, os.path.join(work_dir, "af_input"), chains)
+        stages["af3_json"] = dict(_throughput(measured, n_designs), valid=measured["result"] == n_designs)
+
+        measured = measure_stage(_stage_confidence_reading, af_output)
+        stages["confidence_reading"] = dict(_throughput(measured, n_af3_jobs),
+                                            valid=measured["result"] == sorted(expected_selected))
+
+        streaming = {}
+        for n in workers:
+            measured = measure_stage(_stage_pipeline, designs_base, os.path.join(work_dir, f"pipeline_{n}"), chains, n)
+            result = measured["result"] or {}
+            streaming[str(n)] = dict(_throughput(measured, n_designs), valid=result.get("jobs") == len(expected_hits))
+        stages["pipeline"] = {"workers": streaming}
+
+        for stage in ("interface_screening", "pipeline"):
+            runs = stages[stage]["workers"]
+            base = runs[str(workers[0])]["seconds"]
+            stages[stage]["scaling"] = {n: base / run["seconds"] for n, run in runs.items()}
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "meta": {"git_commit": _git_commit(), "python": sys.version.split()[0], "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "generation_seconds": generation_seconds},
+        "config": {"designs": n_designs, "af3_jobs": n_af3_jobs, "workers": list(workers), "format": fmt,
+                   "atoms_per_design": n_atoms, "hits": len(expected_hits),
+                   "high_confidence": len(expected_selected), "scale": config.scale,
+                   "hit_fraction": config.hit_fraction, "seed": config.seed},
+        "stages": stages,
+    }
+
+
+def _stage_runs(report):
+    # (stage, workers or None) -> run, for the stages of a bench_pipeline report
+    for stage, value in report["stages"].items():
+        if "workers" in value:
+            for n, run in value["workers"].items():
+                yield f"{stage}[{n}]", run
+        else:
+            yield stage, value
+
+
+def compare_reports(old, new, tolerance=0.1) -> dict:
+    """
+    Compare two `bench_pipeline` reports of the same configuration.
+
+    Returns:
+        dict: Per stage, the throughput and peak RSS ratios new/old, and the list of
+              `regressions`: stages whose throughput dropped by more than `tolerance`.
+    """
+    old_runs = dict(_stage_runs(old))
+    comparison = {"old_commit": old["meta"].get("git_commit"), "new_commit": new["meta"].get("git_commit"),
+                  "stages": {}, "regressions": []}
+    if old["config"] != new["config"]:
+        comparison["warning"] = "The reports were made with different configurations"
+    for name, run in _stage_runs(new):
+        before = old_runs.get(name)
+        if before is None or before.get("error") or run.get("error"):
+            continue
+        ratio = run["items_per_second"] / before["items_per_second"]
+        comparison["stages"][name] = {"throughput_ratio": ratio,
+                                      "peak_rss_ratio": run["peak_rss_mb"] / before["peak_rss_mb"]}
+        if ratio < 1 - tolerance:
+            comparison["regressions"].append(name)
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages.")
+    parser.add_argument("pdb_paths", nargs="*", default=["results/model.pdb", "af_output/0.87.pdb"])
+    parser.add_argument("--chains", nargs="+", default=None, help="Chain IDs to read (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--writer-records", type=int, default=2000, help="Records written per output layout")
+    parser.add_argument("--writer-dir", default=None, help="Scratch directory for the writer benchmark")
+    parser.add_argument("--suite", action="store_true",
+                        help="Run the end-to-end stage benchmark on synthetic data instead")
+    parser.add_argument("--designs", type=int, default=200, help="Suite: synthetic design structures")
+    parser.add_argument("--af3-jobs", type=int, default=100, help="Suite: synthetic AlphaFold3 output folders")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="Suite: worker counts")
+    parser.add_argument("--format", choices=["pdb", "cif"], default="pdb", help="Suite: design file format")
+    parser.add_argument("--scale", type=float, default=1.0, help="Suite: multiply every chain length")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None, help="Suite: directory for the synthetic data")
+    parser.add_argument("--keep", action="store_true", help="Suite: keep the synthetic data")
+    parser.add_argument("--output", default=None, help="Also write the report to this JSON file")
+    parser.add_argument("--compare", default=None, help="Suite: earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Suite: throughput drop (fraction) reported as a regression by --compare")
+    args = parser.parse_args()
+
+    if args.suite:
+        config = SyntheticConfig(scale=args.scale, seed=args.seed)
+        report = bench_pipeline(args.designs, args.af3_jobs, args.workers, config, args.format, args.work_dir,
+                                args.keep)
+        if args.compare is not None:
+            with open(args.compare, 'r') as f:
+                report["comparison"] = compare_reports(json.load(f), report, args.tolerance)
+    else:
+        report = {"sequence_backends": bench_sequence_backends(args.pdb_paths, args.chains, args.repeat),
+                  "interface_engines": bench_interface_engines(args.pdb_paths, repeat=args.repeat),
+                  "writers": {kind: bench_writers(args.writer_records, args.writer_dir, kind)
+                              for kind in ("af3", "fasta")}}
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
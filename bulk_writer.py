@@ -0,0 +1,235 @@
+import io
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+from fasta_to_dict import parse_fasta
+from instrumentation import timer
+
+# Layouts of BulkWriter and the file extension of their shards
+LAYOUTS = {"files": None, "fasta": ".fasta", "jsonl": ".jsonl", "tar": ".tar"}
+
+_DONE = object()
+
+
+def _dumps(data) -> str:
+    # Compact JSON: no indentation, no spaces after separators
+    return json.dumps(data, separators=(',', ':'))
+
+
+class BulkWriter:
+    """
+    Writes many small outputs (FASTA files, AlphaFold3 input JSON) from a background thread.
+
+    `write` only puts the record on a bounded queue; a single thread does the file system
+    work. With layout="files" every record still becomes its own file under `output_base`.
+    The other layouts pack records into a few large shard files to avoid the metadata cost
+    of tens of thousands of tiny files:
+
+    - "fasta": multi-record FASTA. Each header is prefixed with the record name
+      (`>{name}|{header}`), so records from different candidates stay apart.
+    - "jsonl": one `{"name": ..., "json": ...}` or `{"name": ..., "text": ...}` line per record.
+    - "tar": one tar member per record, named like the file it stands for.
+
+    Every writer starts new shards named `{prefix}{session}_{n:05d}`, so later runs add shards
+    next to the old ones instead of overwriting them. Use `iter_records` to read any layout.
+
+    Args:
+        output_base (str): Output directory.
+        layout (str): "files", "fasta", "jsonl" or "tar".
+        shard_size (int): Records per shard file.
+        queue_size (int): Records that may wait for the writer thread before `write` blocks.
+        prefix (str): Shard file name prefix.
+    """
+
+    def __init__(self, output_base, layout="files", shard_size=10000, queue_size=1024, prefix="shard_"):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout: {layout}")
+        self.output_base = output_base
+        self.layout = layout
+        self.shard_size = shard_size
+        self.prefix = f"{prefix}{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.n_written = 0
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._shard = None
+        self._n_shards = 0
+        self._in_shard = 0
+        self._dirs = set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, name, data):
+        """
+        Queue one record.
+
+        Args:
+            name (str): Path of the record relative to `output_base`, e.g. "a/model.fasta".
+            data (str or dict): File content; dicts are written as compact JSON.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((name, data))
+
+    def close(self):
+        """Wait until every queued record is written and close the shard files."""
+        if self._thread.is_alive():
+            self._queue.put(_DONE)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    break
+                with timer(f"write.{self.layout}"):
+                    self._write_record(*item)
+                self.n_written += 1
+        except Exception as e:
+            self._error = e
+            # Keep draining so producers blocked on a full queue wake up and see the error
+            while self._queue.get() is not _DONE:
+                pass
+        finally:
+            self._close_shard()
+
+    def _write_record(self, name, data):
+        if self.layout == "fasta" and isinstance(data, dict):
+            raise ValueError(f"The fasta layout only takes FASTA text, not JSON ({name})")
+        text = _dumps(data) if isinstance(data, dict) else data
+        if self.layout == "files":
+            path = os.path.join(self.output_base, name)
+            directory = os.path.dirname(path)
+            if directory and directory not in self._dirs:
+                os.makedirs(directory, exist_ok=True)
+                self._dirs.add(directory)
+            with open(path, 'w') as f:
+                f.write(text)
+            return
+
+        if self._shard is None or self._in_shard >= self.shard_size:
+            self._open_shard()
+        self._in_shard += 1
+        if self.layout == "fasta":
+            for line in text.splitlines():
+                self._shard.write(f">{name}|{line[1:]}\n" if line.startswith('>') else f"{line}\n")
+        elif self.layout == "jsonl":
+            key = "json" if isinstance(data, dict) else "text"
+            self._shard.write(_dumps({"name": name, key: data}) + "\n")
+        else:
+            content = text.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = int(time.time())
+            self._shard.addfile(info, io.BytesIO(content))
+
+    def _open_shard(self):
+        self._close_shard()
+        os.makedirs(self.output_base, exist_ok=True)
+        path = os.path.join(self.output_base, f"{self.prefix}_{self._n_shards:05d}{LAYOUTS[self.layout]}")
+        self._n_shards += 1
+        self._in_shard = 0
+        if self.layout == "tar":
+            self._shard = tarfile.open(path, 'w')
+        else:
+            self._shard = open(path, 'w', buffering=1 << 20)
+
+    def _close_shard(self):
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+
+
+def _shard_files(output_base, extension):
+    return sorted(os.path.join(output_base, file) for file in os.listdir(output_base) if file.endswith(extension))
+
+
+def _iter_fasta_shard(path):
+    # Records are runs of lines whose headers share the same "{name}|" prefix
+    name, lines = None, []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                record, _, header = line[1:].rstrip('\n').partition('|')
+                if record != name:
+                    if name is not None:
+                        yield name, "".join(lines)
+                    name, lines = record, []
+                line = f">{header}\n"
+            lines.append(line)
+    if name is not None:
+        yield name, "".join(lines)
+
+
+def iter_records(output_base, layout=None):
+    """
+    Read back the records written by a BulkWriter, in any layout.
+
+    Args:
+        output_base (str): Output directory of the writer.
+        layout (str): Layout to read. Detected from the shard files if not given.
+
+    Yields:
+        tuple: (name, content) with the content as text. For the same name in several
+               shards the later record is yielded last, so building a dict keeps the newest.
+    """
+    if layout is None:
+        layout = next((name for name, extension in LAYOUTS.items()
+                       if extension is not None and _shard_files(output_base, extension)), "files")
+
+    if layout == "files":
+        for root, dirs, files in os.walk(output_base):
+            dirs.sort()
+            for file in sorted(files):
+                path = os.path.join(root, file)
+                with open(path, 'r') as f:
+                    yield os.path.relpath(path, output_base), f.read()
+    elif layout == "fasta":
+        for path in _shard_files(output_base, ".fasta"):
+            yield from _iter_fasta_shard(path)
+    elif layout == "jsonl":
+        for path in _shard_files(output_base, ".jsonl"):
+            with open(path, 'r') as f:
+                for line in f:
+                    record = json.loads(line)
+                    yield record["name"], _dumps(record["json"]) if "json" in record else record["text"]
+    elif layout == "tar":
+        for path in _shard_files(output_base, ".tar"):
+            with tarfile.open(path, 'r') as tar:
+                for member in tar:
+                    if member.isfile():
+                        yield member.name, tar.extractfile(member).read().decode()
+    else:
+        raise ValueError(f"Unknown layout: {layout}")
+
+
+def iter_fasta_records(output_base, layout=None):
+    """Yield (name, {header: sequence}) for every FASTA record, like `fasta_to_dict` per file."""
+    for name, text in iter_records(output_base, layout):
+        yield name, parse_fasta(text.splitlines())
+
+
+def unpack_af3_inputs(output_base, af_input_dir, layout=None) -> int:
+    """
+    Write the AlphaFold3 jobs stored by a BulkWriter as the one-JSON-per-job directory that
+    `run_alphafold.py --input_dir` reads. Record names keep their directories, so jobs sharded
+    by `convert_folder(..., shards=N)` end up in one input directory per GPU.
+
+    Returns:
+        int: Number of job files written.
+    """
+    with BulkWriter(af_input_dir, layout="files") as writer:
+        for name, text in iter_records(output_base, layout):
+            writer.write(name, text)
+    return writer.n_written
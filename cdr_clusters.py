@@ -0,0 +1,377 @@
+import argparse
+import json
+import math
+from dataclasses import dataclass
+from multiprocessing import Pool
+import numpy as np
+from scipy.spatial import cKDTree
+from instrumentation import file_timer, timer
+from interface_kdtree import parse_residue_id
+from structure_arrays import StructureArrays
+
+# Chothia CDR ranges (residue numbers, inclusive, insertion codes included), as DiffAb numbers its designs
+CHOTHIA_CDRS = {"H": [(26, 32), (52, 56), (95, 102)], "L": [(24, 34), (50, 56), (89, 97)]}
+
+# Set once per worker process by _init_worker
+_worker_config = {}
+
+
+@dataclass
+class DesignCoords:
+    """CA atoms of one design that the clustering needs: the antigen chains and the CDR loops."""
+    name: str
+    antigen_keys: tuple  # ((chain, resi), ...) of the antigen CAs
+    antigen: np.ndarray  # (M, 3) float32
+    cdr_keys: tuple      # ((chain, resi), ...) of the CDR CAs
+    cdr: np.ndarray      # (K, 3) float32
+    loops: np.ndarray    # (K,) int8, the CDR loop (0 = H1, ..., 5 = L3) of every CDR CA
+
+    @property
+    def layout(self) -> tuple:
+        """Designs can only be compared if they have the same residues."""
+        return self.antigen_keys, self.cdr_keys
+
+
+def _ca_atoms(structure: StructureArrays, chain) -> tuple:
+    # (resi list, (n, 3) coords) of the CA atoms of a chain, first alternate location only
+    mask = (structure.chain_ids == chain) & (structure.atom_names == "CA") & ~structure.hetero
+    _, first = np.unique(structure.resi[mask], return_index=True)
+    first = np.sort(first)
+    return structure.resi[mask][first].tolist(), structure.coords[mask][first]
+
+
+def design_coords(name, structure: StructureArrays, antigen=("C",), heavy="H", light="L",
+                  cdrs=CHOTHIA_CDRS) -> DesignCoords:
+    """
+    Pick the antigen CAs and the CDR CAs of a design.
+
+    Args:
+        name (str): Design name.
+        structure (StructureArrays): The design.
+        antigen (tuple): Chains the designs are superposed on.
+        heavy (str): Heavy chain ID.
+        light (str): Light chain ID.
+        cdrs (dict): "H"/"L" -> [(first, last)] CDR residue numbers.
+
+    Returns:
+        DesignCoords: The CA atoms of the design.
+    """
+    antigen_keys, antigen_ca = [], []
+    for chain in antigen:
+        resi, ca = _ca_atoms(structure, chain)
+        if not resi:
+            raise ValueError(f"No CA atoms in antigen chain {chain}")
+        antigen_keys.extend((chain, r) for r in resi)
+        antigen_ca.append(ca)
+    cdr_keys, cdr_ca, loops = [], [], []
+    loop = 0
+    for role, chain in (("H", heavy), ("L", light)):
+        resi, ca = _ca_atoms(structure, chain)
+        if not resi:
+            raise ValueError(f"No CA atoms in chain {chain}")
+        numbers = np.array([parse_residue_id(r)[0] for r in resi])
+        for first, last in cdrs[role]:
+            in_loop = np.flatnonzero((numbers >= first) & (numbers <= last))
+            if not len(in_loop):
+                raise ValueError(f"No residues {first}-{last} in chain {chain}")
+            cdr_keys.extend((chain, resi[i]) for i in in_loop)
+            cdr_ca.append(ca[in_loop])
+            loops.extend([loop] * len(in_loop))
+            loop += 1
+    return DesignCoords(name, tuple(antigen_keys), np.concatenate(antigen_ca).astype(np.float32),
+                        tuple(cdr_keys), np.concatenate(cdr_ca).astype(np.float32), np.array(loops, dtype=np.int8))
+
+
+def kabsch(mobile, reference) -> tuple:
+    """
+    Superpose many coordinate sets on one reference at once (Kabsch algorithm).
+
+    Args:
+        mobile (np.ndarray): (N, M, 3) coordinates, M points per set.
+        reference (np.ndarray): (M, 3) coordinates of the same points.
+
+    Returns:
+        tuple: (rotations, translations) of shape (N, 3, 3) and (N, 3); set i is superposed by
+               `mobile[i] @ rotations[i] + translations[i]`.
+    """
+    mobile = np.asarray(mobile, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    mobile_center = mobile.mean(axis=1)
+    reference_center = reference.mean(axis=0)
+    covariance = np.einsum("nmi,mj->nij", mobile - mobile_center[:, None], reference - reference_center)
+    u, _, vt = np.linalg.svd(covariance)
+    # Flip the smallest axis where the best orthogonal matrix is a reflection
+    u[:, :, -1] *= np.sign(np.linalg.det(u @ vt))[:, None]
+    rotations = u @ vt
+    translations = reference_center - np.einsum("ni,nij->nj", mobile_center, rotations)
+    return rotations, translations
+
+
+def superpose_cdrs(designs) -> np.ndarray:
+    """
+    CDR coordinates of designs with the same layout, after superposing every antigen on the
+    antigen of the first design.
+
+    Returns:
+        np.ndarray: (N, K, 3) float64 CDR CA coordinates in the frame of the first design.
+    """
+    antigen = np.stack([design.antigen for design in designs])
+    cdr = np.stack([design.cdr for design in designs]).astype(np.float64)
+    rotations, translations = kabsch(antigen, antigen[0])
+    return np.einsum("nki,nij->nkj", cdr, rotations) + translations[:, None]
+
+
+def tm_d0(n_residues) -> float:
+    """Distance scale of the TM-score for `n_residues` residues (at least 0.5 Å, as in TM-align)."""
+    return max(0.5, 1.24 * float(np.cbrt(n_residues - 15)) - 1.8)
+
+
+def leader_cluster(cdr, loops, threshold=2.0, order=None) -> tuple:
+    """
+    Leader clustering of superposed CDRs by CA RMSD.
+
+    Designs are visited in `order`; a design not yet in a cluster becomes the leader of a new
+    cluster, which takes every unassigned design within `threshold` RMSD of it. Neighbors are
+    looked up in a KD-tree of the CDR loop centroids (scaled by the square root of the loop
+    length), whose distances never exceed sqrt(K) * RMSD, so no design within the threshold
+    is missed and only the few candidates the tree returns are compared atom by atom.
+
+    Args:
+        cdr (np.ndarray): (N, K, 3) superposed CDR CA coordinates (see `superpose_cdrs`).
+        loops (np.ndarray): (K,) loop of every CDR CA.
+        threshold (float): RMSD (in Ångstroms) within which a design joins a leader.
+        order (np.ndarray): Order in which designs are considered as leaders, e.g. by a
+            score; defaults to the input order.
+
+    Returns:
+        tuple: (labels, leaders, rmsd, tm). labels[i] is the cluster of design i,
+               leaders[k] the design leading cluster k, and rmsd[i] / tm[i] the CDR RMSD
+               and TM-like score of design i against its leader.
+    """
+    n, k, _ = cdr.shape
+    flat = cdr.reshape(n, -1)
+    sketch = np.concatenate([math.sqrt(np.sum(loops == loop)) * cdr[:, loops == loop].mean(axis=1)
+                             for loop in np.unique(loops)], axis=1)
+    radius = threshold * math.sqrt(k) * (1 + 1e-9)
+    d0 = tm_d0(k)
+
+    labels = np.full(n, -1, dtype=np.int64)
+    rmsd = np.zeros(n, dtype=np.float32)
+    tm = np.zeros(n, dtype=np.float32)
+    leaders = []
+    indexed = np.arange(n)
+    tree = cKDTree(sketch)
+    for i in (range(n) if order is None else order):
+        if labels[i] != -1:
+            continue
+        # Once half the designs in the tree are taken, index only the ones left
+        unassigned = np.flatnonzero(labels[indexed] == -1)
+        if 2 * len(unassigned) < len(indexed):
+            indexed = indexed[unassigned]
+            tree = cKDTree(sketch[indexed])
+        candidates = indexed[np.asarray(tree.query_ball_point(sketch[i], radius), dtype=np.int64)]
+        candidates = candidates[labels[candidates] == -1]
+        candidate_rmsd = np.sqrt(np.sum((flat[candidates] - flat[i]) ** 2, axis=1) / k)
+        within = candidate_rmsd <= threshold
+        members = candidates[within]
+        distances = np.linalg.norm(cdr[members] - cdr[i], axis=2)
+        labels[members] = len(leaders)
+        rmsd[members] = candidate_rmsd[within]
+        tm[members] = np.mean(1 / (1 + (distances / d0) ** 2), axis=1)
+        labels[i], rmsd[i], tm[i] = len(leaders), 0.0, 1.0
+        leaders.append(i)
+    return labels, leaders, rmsd, tm
+
+
+@dataclass
+class CdrClusters:
+    """
+    Clusters of near-identical design poses: one row per design and one representative
+    (the cluster leader) per cluster. Clusters are numbered by size, largest first.
+    """
+    names: list
+    labels: np.ndarray  # (N,) int64
+    representatives: list  # [design index] of every cluster
+    rmsd: np.ndarray    # (N,) float32, CDR RMSD to the representative
+    tm: np.ndarray      # (N,) float32, TM-like CDR score against the representative
+
+    def __len__(self):
+        return len(self.names)
+
+    def sizes(self) -> np.ndarray:
+        return np.bincount(self.labels, minlength=len(self.representatives))
+
+    def members(self) -> list:
+        """The membership table: one dict per design."""
+        return [{"name": name, "cluster": int(label), "representative": self.names[self.representatives[label]],
+                 "rmsd": round(float(rmsd), 3), "tm": round(float(tm), 3)}
+                for name, label, rmsd, tm in zip(self.names, self.labels, self.rmsd, self.tm)]
+
+    def save(self, path):
+        """Write the representatives and the membership table to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump({"representatives": [self.names[i] for i in self.representatives],
+                       "members": self.members()}, f, indent=4)
+
+
+def cluster_designs(designs, threshold=2.0, order=None) -> CdrClusters:
+    """
+    Cluster designs by CDR CA RMSD after superposition on the antigen.
+
+    Designs are grouped by layout (same antigen and CDR residues) and each group is
+    superposed and clustered on its own; designs of different layouts never share a cluster.
+
+    Args:
+        designs (list): DesignCoords of every design.
+        threshold (float): CDR RMSD (in Ångstroms) within which designs share a cluster.
+        order (list): Design indices in the order they are considered as leaders.
+
+    Returns:
+        CdrClusters: Clusters of all the designs.
+    """
+    rank = np.empty(len(designs), dtype=np.int64)
+    rank[np.asarray(range(len(designs)) if order is None else order, dtype=np.int64)] = np.arange(len(designs))
+    groups = {}
+    for i, design in enumerate(designs):
+        groups.setdefault(design.layout, []).append(i)
+
+    labels = np.zeros(len(designs), dtype=np.int64)
+    rmsd = np.zeros(len(designs), dtype=np.float32)
+    tm = np.zeros(len(designs), dtype=np.float32)
+    leaders = []
+    for indices in groups.values():
+        indices = np.asarray(indices, dtype=np.int64)
+        group = [designs[i] for i in indices]
+        with timer("cluster.superpose"):
+            cdr = superpose_cdrs(group)
+        with timer("cluster.leader"):
+            group_labels, group_leaders, rmsd[indices], tm[indices] = leader_cluster(
+                cdr, group[0].loops, threshold, np.argsort(rank[indices], kind="stable"))
+        labels[indices] = group_labels + len(leaders)
+        leaders.extend(indices[group_leaders].tolist())
+
+    # Renumber the clusters by size, largest first
+    sizes = np.bincount(labels, minlength=len(leaders))
+    by_size = np.argsort(-sizes, kind="stable")
+    renumber = np.empty(len(leaders), dtype=np.int64)
+    renumber[by_size] = np.arange(len(leaders))
+    return CdrClusters([design.name for design in designs], renumber[labels],
+                       [leaders[k] for k in by_size], rmsd, tm)
+
+
+def _init_worker(antigen, heavy, light):
+    _worker_config.update(antigen=antigen, heavy=heavy, light=light)
+
+
+def _read_one(path):
+    from structure_arrays import read_structure_arrays
+    try:
+        with file_timer("cdr_clusters", path):
+            return design_coords(path, read_structure_arrays(path), **_worker_config), None
+    except Exception as e:
+        return None, f"Error processing {path}: {type(e).__name__}: {e}"
+
+
+def _read_store_item(item):
+    from structure_store import StructureStore
+    store_dir, i = item
+    stores = _worker_config.setdefault("stores", {})
+    if store_dir not in stores:
+        stores[store_dir] = StructureStore(store_dir)
+    store = stores[store_dir]
+    name = store.names[i]
+    try:
+        with file_timer("cdr_clusters", name):
+            return design_coords(name, store[i], _worker_config["antigen"], _worker_config["heavy"],
+                                 _worker_config["light"]), None
+    except Exception as e:
+        return None, f"Error processing {name}: {type(e).__name__}: {e}"
+
+
+def read_designs(paths=None, store_base=None, antigen=("C",), heavy="H", light="L", workers=None, chunksize=16) -> list:
+    """
+    DesignCoords of structure files, or of every structure of a structure_store, read in a
+    process pool. Each worker sends back only the CA atoms, a few kB per design. Designs
+    that cannot be read or lack a chain or CDR are reported and left out.
+
+    Args:
+        paths (list): Structure files.
+        store_base (str): Structure store built with structure_store.py, instead of `paths`.
+        antigen (tuple): Antigen chain IDs.
+        heavy (str): Heavy chain ID.
+        light (str): Light chain ID.
+        workers (int): Worker processes. Defaults to all CPUs; 1 reads in this process.
+        chunksize (int): Designs sent to a worker at a time.
+
+    Returns:
+        list: DesignCoords, in input order.
+    """
+    if store_base is not None:
+        from structure_store import iter_store_batches
+        items = [(store.store_dir, i) for store in iter_store_batches(store_base) for i in range(len(store))]
+        read = _read_store_item
+    else:
+        items = list(paths)
+        read = _read_one
+    config = (tuple(antigen), heavy, light)
+
+    if workers == 1:
+        _init_worker(*config)
+        designs = _collect(map(read, items))
+    else:
+        with Pool(workers, initializer=_init_worker, initargs=config) as pool:
+            designs = _collect(pool.imap(read, items, chunksize=chunksize))
+            pool.close()
+            pool.join()
+    return designs
+
+
+def _collect(results) -> list:
+    designs = []
+    for design, error in results:
+        if error is not None:
+            print(error)
+        else:
+            designs.append(design)
+    return designs
+
+
+def main():
+    from screen_parallel import find_structure_files
+    parser = argparse.ArgumentParser(description="Cluster designs by CDR RMSD after superposition on the antigen.")
+    parser.add_argument("input_base", nargs="?", default="results")
+    parser.add_argument("--paths", default=None,
+                        help="File with the designs to cluster, one path per line (e.g. the screen hits)")
+    parser.add_argument("--store", action="store_true",
+                        help="input_base is a structure store built with structure_store.py")
+    parser.add_argument("--antigen", nargs="+", default=["C"], help="Chains the designs are superposed on")
+    parser.add_argument("--heavy", default="H", help="Heavy chain ID in the designs")
+    parser.add_argument("--light", default="L", help="Light chain ID in the designs")
+    parser.add_argument("--threshold", type=float, default=2.0, help="CDR CA RMSD (Å) for the same cluster")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument("--extensions", nargs="+", default=[".pdb", ".cif"], help="Structure file extensions")
+    parser.add_argument("--output", default=None, help="Write the representatives and membership table to this JSON")
+    args = parser.parse_args()
+
+    if args.store:
+        designs = read_designs(store_base=args.input_base, antigen=args.antigen, heavy=args.heavy,
+                               light=args.light, workers=args.workers)
+    else:
+        if args.paths is not None:
+            with open(args.paths, 'r') as f:
+                paths = [line.strip() for line in f if line.strip()]
+        else:
+            paths = find_structure_files(args.input_base, args.extensions)
+        designs = read_designs(paths, antigen=args.antigen, heavy=args.heavy, light=args.light,
+                               workers=args.workers)
+
+    clusters = cluster_designs(designs, args.threshold)
+    if args.output is not None:
+        clusters.save(args.output)
+    print(f"{len(clusters)} designs, {len(clusters.representatives)} clusters at CDR RMSD <= {args.threshold} Å")
+    for size, i in zip(clusters.sizes(), clusters.representatives):
+        print(f"{size}\t{clusters.names[i]}")
+
+
+if __name__ == "__main__":
+    main()
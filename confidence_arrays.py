@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+from dataclasses import dataclass
+import numpy as np
+from read_confidences import ConfidenceIndex, top_level_json_files, expand_chain_ids
+
+
+@dataclass
+class ConfidenceArrays:
+    """
+    AlphaFold3 summary confidences of a whole run stacked into NumPy arrays.
+
+    Runs can mix layouts (e.g. `copies > 1`), so the chain_pair_* matrices are padded with NaN
+    to the largest number of chains and `chain_ids` holds the chain ID of every row/column
+    of every folder ("" for padding). Chains are looked up by ID, never by position.
+    """
+    folders: np.ndarray             # (N,) str
+    chain_ids: np.ndarray           # (N, K) str
+    chain_pair_iptm: np.ndarray     # (N, K, K) float32
+    chain_pair_pae_min: np.ndarray  # (N, K, K) float32
+    ptm: np.ndarray                 # (N,) float32
+    iptm: np.ndarray                # (N,) float32
+    ranking_score: np.ndarray       # (N,) float32
+
+    def __len__(self):
+        return len(self.folders)
+
+    @classmethod
+    def from_records(cls, records) -> "ConfidenceArrays":
+        """Build from dicts with keys folder, chain_ids, chain_pair_iptm, chain_pair_pae_min, ptm, iptm, ranking_score."""
+        records = list(records)
+        n = len(records)
+        k = max((len(r["chain_ids"]) for r in records), default=0)
+        chain_ids = np.full((n, k), "", dtype=object)
+        matrices = {name: np.full((n, k, k), np.nan, dtype=np.float32)
+                    for name in ("chain_pair_iptm", "chain_pair_pae_min")}
+        for i, r in enumerate(records):
+            chain_ids[i, :len(r["chain_ids"])] = r["chain_ids"]
+            for name, stacked in matrices.items():
+                matrix = np.array(r.get(name) or [], dtype=np.float32)
+                if matrix.ndim == 2:
+                    stacked[i, :matrix.shape[0], :matrix.shape[1]] = matrix
+        scalars = {name: np.array([np.nan if r.get(name) is None else r[name] for r in records], dtype=np.float32)
+                   for name in ("ptm", "iptm", "ranking_score")}
+        return cls(folders=np.array([r["folder"] for r in records], dtype=str),
+                   chain_ids=chain_ids.astype(str), **matrices, **scalars)
+
+    @classmethod
+    def from_index(cls, index: ConfidenceIndex, base_path=None) -> "ConfidenceArrays":
+        """The folders of `base_path` in the index (of every indexed output root if None)."""
+        roots = [] if base_path is None else [os.path.abspath(base_path)]
+        rows = index.conn.execute(f"""SELECT folder, chain_ids, chain_pair_iptm, chain_pair_pae_min,
+                                      ptm, iptm, ranking_score FROM folders
+                                      {"" if base_path is None else "WHERE base_path = ?"}
+                                      ORDER BY base_path, folder""", roots)
+        return cls.from_records({
+            "folder": folder, "chain_ids": json.loads(chain_ids), "chain_pair_iptm": json.loads(iptm_matrix),
+            "chain_pair_pae_min": json.loads(pae_matrix), "ptm": ptm, "iptm": iptm, "ranking_score": ranking_score,
+        } for folder, chain_ids, iptm_matrix, pae_matrix, ptm, iptm, ranking_score in rows)
+
+    @classmethod
+    def from_folders(cls, base_path) -> "ConfidenceArrays":
+        """Read every output folder under `base_path` directly, without an index."""
+        records = []
+        for folder in sorted(os.listdir(base_path)):
+            folder_path = os.path.join(base_path, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            summary_path, data_path = top_level_json_files(folder_path)
+            if summary_path is None or data_path is None:
+                continue
+            try:
+                with open(summary_path, 'r') as f:
+                    summary = json.load(f)
+                with open(data_path, 'r') as f:
+                    chain_ids = expand_chain_ids(json.load(f)["sequences"])
+            except (json.JSONDecodeError, KeyError, TypeError, IOError) as e:
+                print(f"Error reading folder {folder_path}: {e}")
+                continue
+            records.append({"folder": folder, "chain_ids": chain_ids, **summary})
+        return cls.from_records(records)
+
+    def chain_index(self, chains) -> np.ndarray:
+        """(N, K) mask of the columns whose chain ID is in `chains` (a chain ID or a list of them)."""
+        chains = [chains] if isinstance(chains, str) else list(chains)
+        return np.isin(self.chain_ids, chains)
+
+    def pair(self, chains1, chains2, metric="chain_pair_iptm", reduce="max") -> np.ndarray:
+        """
+        Value of a chain_pair_* metric between two chains (or chain groups) for every folder.
+
+        With chain groups (e.g. ["CA", "CB"] and ["HA", "HB"] for copies=2) the values over all
+        combinations are reduced with "max" or "min". Folders missing a chain get NaN.
+
+        Returns:
+            np.ndarray: (N,) float32.
+        """
+        matrix = getattr(self, metric)
+        mask = self.chain_index(chains1)[:, :, None] & self.chain_index(chains2)[:, None, :]
+        if reduce == "max":
+            values = np.where(mask, matrix, -np.inf).max(axis=(1, 2), initial=-np.inf)
+            return np.where(np.isneginf(values), np.nan, values).astype(np.float32)
+        elif reduce == "min":
+            values = np.where(mask, matrix, np.inf).min(axis=(1, 2), initial=np.inf)
+            return np.where(np.isposinf(values), np.nan, values).astype(np.float32)
+        raise ValueError(f"Unknown reduce: {reduce}")
+
+    def high_confidence_mask(self, pairs=(("C", "L"), ("C", "H")), min_iptm=0.8, require_all=False) -> np.ndarray:
+        """Folders whose ipTM for any (or every) pair is >= min_iptm, like `read_high_confidences`."""
+        passed = np.stack([self.pair(chain1, chain2) >= min_iptm for chain1, chain2 in pairs])
+        return passed.all(axis=0) if require_all else passed.any(axis=0)
+
+    def select(self, mask) -> "ConfidenceArrays":
+        return ConfidenceArrays(**{name: getattr(self, name)[mask] for name in self.__dataclass_fields__})
+
+    def top_k(self, scores, k) -> np.ndarray:
+        """Indices of the k highest scores (NaN last), best first."""
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=int)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def percentiles(self, values, q=(5, 25, 50, 75, 95)) -> dict:
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return {str(p): None for p in q}
+        return {str(p): float(v) for p, v in zip(q, np.percentile(values, q))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank and summarize the AlphaFold3 confidences of a run.")
+    parser.add_argument("base_path", nargs="?", default="af_output/")
+    parser.add_argument("--index", default=None, help="ConfidenceIndex SQLite file (updated before loading)")
+    parser.add_argument("--pair", nargs=2, action="append", metavar=("CHAIN1", "CHAIN2"),
+                        help="Chain pair to filter on; repeat for several (default: C L and C H)")
+    parser.add_argument("--min-iptm", type=float, default=0.8)
+    parser.add_argument("--all", action="store_true", help="Require every pair to pass, not just one")
+    parser.add_argument("--top-k", type=int, default=20, help="Rank passing folders by ranking_score")
+    args = parser.parse_args()
+
+    pairs = [tuple(pair) for pair in args.pair] if args.pair else [("C", "L"), ("C", "H")]
+    if args.index is not None:
+        with ConfidenceIndex(args.index) as index:
+            index.update(args.base_path)
+            run = ConfidenceArrays.from_index(index, args.base_path)
+    else:
+        run = ConfidenceArrays.from_folders(args.base_path)
+
+    passed = run.select(run.high_confidence_mask(pairs, args.min_iptm, args.all))
+    top = passed.top_k(passed.ranking_score, args.top_k)
+    passed_pairs = {f"{chain1}-{chain2}": passed.pair(chain1, chain2) for chain1, chain2 in pairs}
+    report = {
+        "folders": len(run),
+        "passed": len(passed),
+        "percentiles": {f"{chain1}-{chain2}": run.percentiles(run.pair(chain1, chain2)) for chain1, chain2 in pairs},
+        "ranking_score_percentiles": run.percentiles(run.ranking_score),
+        "top": [{"folder": str(passed.folders[i]), "ranking_score": float(passed.ranking_score[i]),
+                 **{name: float(values[i]) for name, values in passed_pairs.items()}}
+                for i in top],
+    }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
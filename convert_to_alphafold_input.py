@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from fasta_to_dict import fasta_to_dict
+from indexed_fasta import IndexedFasta
 import json
 import os
+import string
+from instrumentation import count, file_timer, timer
 
 @dataclass
 class ABCChains:
@@ -12,31 +15,85 @@ class ABCChains:
 
 
 
-def convert_to_sequences_json(H_seq: str, L_seq: str, chains: ABCChains, copies=1) -> list:
-    def convert_to_entry(id: str, sequence: str) -> dict:
+def convert_to_sequences_json(H_seq: str, L_seq: str, chains: ABCChains, copies=1, precomputed=None) -> list:
+    """
+    Build the "sequences" list of an AlphaFold3 job.
+
+    `precomputed` maps a sequence to its "unpairedMsa"/"pairedMsa"/"templates" fields (see
+    `load_precomputed_msas`). They are copied into the A, B and C entries so AlphaFold3 only
+    runs the MSA and template search for H and L.
+    """
+    def convert_to_entry(id: str, sequence: str, reuse=False) -> dict:
+        entry = {
+            "id": id,
+            "sequence": sequence
+        }
+        if reuse and precomputed is not None and sequence in precomputed:
+            entry.update(precomputed[sequence])
         return {
-            "protein": {
-                "id": id,
-                "sequence": sequence
-            }
+            "protein": entry
         }
     
     letter_mapping = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     ret = []
     for i in range(copies):
         letter = letter_mapping[i] if copies > 1 else ""
-        ret.append(convert_to_entry(f"A{letter}", chains.chainA))
-        ret.append(convert_to_entry(f"B{letter}", chains.chainB))
-        ret.append(convert_to_entry(f"C{letter}", chains.chainC))
+        ret.append(convert_to_entry(f"A{letter}", chains.chainA, reuse=True))
+        ret.append(convert_to_entry(f"B{letter}", chains.chainB, reuse=True))
+        ret.append(convert_to_entry(f"C{letter}", chains.chainC, reuse=True))
         ret.append(convert_to_entry(f"L{letter}", L_seq))
         ret.append(convert_to_entry(f"H{letter}", H_seq))
     return ret
 
 
-def convert_to_alphafold_input_one_fasta(output_filename: str, chains: ABCChains, H_seq, L_seq, copies=1) -> None:
+def convert_to_alphafold_input_one_fasta(output_filename: str, chains: ABCChains, H_seq, L_seq, copies=1,
+                                         precomputed=None, writer=None) -> None:
+    """
+    Write the AlphaFold3 input JSON of one candidate to `output_filename`.
+
+    If `writer` (a bulk_writer.BulkWriter) is given, the job is handed to it as compact JSON
+    under the name `output_filename` instead of being written here.
+    """
+    json_output = {
+        "name": chains.name,
+        "sequences": convert_to_sequences_json(H_seq, L_seq, chains, copies, precomputed),
+        "modelSeeds": [1],
+        "dialect": "alphafold3",
+        "version": 1
+    }
+
+    if writer is not None:
+        writer.write(output_filename, json_output)
+        return
+
+    output_dir = os.path.dirname(output_filename)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    with timer("serialize.af3_json"):
+        text = json.dumps(json_output, indent=4)
+    # Written under a temporary name and renamed, so a queue watching the directory never reads half a job
+    with timer("write.af3_json"):
+        with open(f"{output_filename}.tmp", 'w') as f:
+            f.write(text)
+        os.replace(f"{output_filename}.tmp", output_filename)
+
+
+def write_abc_msa_job(output_filename: str, chains: ABCChains) -> None:
+    """
+    Write an AlphaFold3 job that holds only the fixed chains A, B and C.
+
+    Run it once with `run_alphafold.py --norun_inference`. The `<name>_data.json` it writes
+    contains the MSAs and templates of A, B and C and can be passed to `convert_folder` as
+    `precomputed_path`.
+    """
     json_output = {
         "name": chains.name,
-        "sequences": convert_to_sequences_json(H_seq, L_seq, chains, copies),
+        "sequences": [
+            {"protein": {"id": "A", "sequence": chains.chainA}},
+            {"protein": {"id": "B", "sequence": chains.chainB}},
+            {"protein": {"id": "C", "sequence": chains.chainC}},
+        ],
         "modelSeeds": [1],
         "dialect": "alphafold3",
         "version": 1
@@ -50,33 +107,164 @@ def convert_to_alphafold_input_one_fasta(output_filename: str, chains: ABCChains
         json.dump(json_output, f, indent=4)
 
 
-def convert_folder(input_base, output_base, chainA, chainB, chainC, copies):
-    # Find all PDB files recursively
+def load_precomputed_msas(data_json_path) -> dict:
+    """
+    Read the MSAs and templates of every protein chain from an AlphaFold3 `*_data.json`.
+
+    Returns:
+        dict: Maps each sequence to its "unpairedMsa", "pairedMsa" and "templates" fields.
+    """
+    with open(data_json_path, 'r') as f:
+        data = json.load(f)
+
+    precomputed = {}
+    for entry in data["sequences"]:
+        protein = entry.get("protein")
+        if protein is None:
+            continue
+        precomputed[protein["sequence"]] = {
+            "unpairedMsa": protein.get("unpairedMsa", ""),
+            "pairedMsa": protein.get("pairedMsa", ""),
+            "templates": protein.get("templates", []),
+        }
+    return precomputed
+
+
+def _iter_fasta_candidates(input_base):
+    """
+    Yield (source file, candidate name, relative path, {header: sequence}) for every candidate:
+    every FASTA file under the directory `input_base`, or every record group of `input_base`
+    if it is one consolidated FASTA file (see IndexedFasta.groups). Sequences of a consolidated
+    file are lazy FastaRecords.
+    """
+    if os.path.isfile(input_base):
+        with IndexedFasta(input_base) as fasta:
+            for candidate, records in fasta.groups():
+                yield input_base, f"{input_base}:{candidate}", candidate, records
+        return
+
+    # Find all FASTA files recursively
     for root, dirs, files in os.walk(input_base):
-        for file in files:
+        dirs.sort()
+        for file in sorted(files):
             if file.endswith('.fasta'):
-                # Get input file path
                 input_path = os.path.join(root, file)
-                
-                # Create corresponding output path
-                relative_path = os.path.relpath(input_path, input_base)
-                output_path = os.path.join(output_base, relative_path)
-                output_path = os.path.splitext(output_path)[0] + '.json'  # Remove .pdb extension
-                output_path = str(output_path).replace('/', '__')
-                
-                chains = ABCChains(name=output_path.split('.')[0], chainA=chainA, chainB=chainB, chainC=chainC)
-                HL_dict = fasta_to_dict(input_path)
-                for chain_id, sequence in HL_dict.items():
-                    if chain_id.endswith('H'):
-                        H_seq = sequence
-                    elif chain_id.endswith('L'):
-                        L_seq = sequence
-
-                try:
-                    convert_to_alphafold_input_one_fasta(output_path, chains, H_seq, L_seq, copies)
-                    print(f"Processed: {input_path}")
-                except Exception as e:
-                    print(f"Error processing {input_path}: {str(e)}")
+                yield input_path, input_path, os.path.relpath(input_path, input_base), fasta_to_dict(input_path)
+
+
+def convert_folder(input_base, output_base, chainA, chainB, chainC, copies, cache=None, manifest_path=None,
+                   precomputed_path=None, shards=None, writer=None):
+    """
+    Convert every FASTA under `input_base` to an AlphaFold3 input JSON.
+
+    `input_base` may also be a single consolidated multi-record FASTA (e.g. written by a
+    bulk_writer.BulkWriter with layout="fasta"). It is then read through its `.fai` index with
+    IndexedFasta, and each record group is one candidate.
+
+    If `cache` (a stage_cache.StageCache) is given, FASTA files whose content, chains,
+    copies and output path are unchanged since the last run are skipped.
+
+    If `manifest_path` is given, candidates with the same (A, B, C, H, L) sequences are
+    folded only once: the first one in path order gets a job, and the manifest written to
+    `manifest_path` maps every candidate to the job that covers it (see `load_manifest`).
+
+    If `precomputed_path` (an AlphaFold3 `*_data.json`, see `write_abc_msa_job`) is given,
+    the MSAs and templates of A, B and C are embedded in every job.
+
+    If `shards` is given, jobs are distributed round-robin over the input directories
+    `{output_base}_gpu0` ... `{output_base}_gpu{shards - 1}`, one per AlphaFold3 process.
+
+    If `writer` (a bulk_writer.BulkWriter) is given, the jobs are written through it, named by
+    the output paths above; `bulk_writer.unpack_af3_inputs` turns sharded layouts back into
+    AlphaFold3 input directories.
+    """
+    dedup = {} if manifest_path is not None else None
+    precomputed = load_precomputed_msas(precomputed_path) if precomputed_path is not None else None
+    n_jobs = 0
+    manifest = {"candidates": {}, "jobs": {}}
+    job_folders = {}  # Sanitised job name -> job, so two jobs never share an output folder
+
+    for source_path, input_path, relative_path, HL_dict in _iter_fasta_candidates(input_base):
+        # Create corresponding output path
+        output_path = os.path.join(output_base, relative_path)
+        output_path = os.path.splitext(output_path)[0] + '.json'  # Remove .pdb extension
+        output_path = str(output_path).replace('/', '__')
+        # DiffAb run directories contain a '.' (`<input>.pdb_<timestamp>`), so deduplicated runs,
+        # whose manifest needs one name per candidate, name the job after the whole path
+        job_name = os.path.splitext(output_path)[0] if dedup is not None else output_path.split('.')[0]
+
+        chains = ABCChains(name=job_name, chainA=chainA, chainB=chainB, chainC=chainC)
+        H_seq, L_seq = None, None
+        for chain_id, sequence in HL_dict.items():
+            if chain_id.endswith('H'):
+                H_seq = str(sequence)
+            elif chain_id.endswith('L'):
+                L_seq = str(sequence)
+        if H_seq is None or L_seq is None:
+            print(f"Error processing {input_path}: missing H or L chain")
+            continue
+
+        if dedup is not None:
+            canonical = dedup.setdefault((chainA, chainB, chainC, H_seq, L_seq), chains.name)
+            manifest["candidates"][input_path] = canonical
+            if canonical != chains.name:
+                manifest["jobs"][canonical]["aliases"].append(chains.name)
+                count("af3_jobs.deduplicated")
+                continue
+
+        if shards is not None:
+            output_path = os.path.join(f"{output_base}_gpu{n_jobs % shards}", output_path)
+        n_jobs += 1
+        if dedup is not None:
+            sanitised = sanitised_job_name(canonical)
+            if sanitised in job_folders:
+                raise ValueError(f"Jobs {job_folders[sanitised]} and {canonical} share the AlphaFold3 name {sanitised}")
+            job_folders[sanitised] = canonical
+            manifest["jobs"][canonical] = {"output": output_path, "aliases": [chains.name]}
+
+        params = {"output": output_path, "chainA": chainA, "chainB": chainB, "chainC": chainC, "copies": copies,
+                  "precomputed": precomputed_path}
+        if cache is not None and cache.get("convert_to_alphafold_input", source_path, params) is not None \
+                and (writer is not None or os.path.exists(output_path)):
+            count("af3_jobs.cached")
+            continue
+
+        try:
+            with file_timer("af3_json", input_path):
+                convert_to_alphafold_input_one_fasta(output_path, chains, H_seq, L_seq, copies, precomputed, writer)
+            count("af3_jobs.written")
+            if cache is not None:
+                cache.put("convert_to_alphafold_input", source_path, params, {"written": True})
+            print(f"Processed: {input_path}")
+        except Exception as e:
+            print(f"Error processing {input_path}: {str(e)}")
+
+    if manifest_path is not None:
+        manifest_dir = os.path.dirname(manifest_path)
+        if manifest_dir:
+            os.makedirs(manifest_dir, exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        print(f"{len(manifest['candidates'])} candidates, {len(manifest['jobs'])} unique jobs")
+
+
+def load_manifest(manifest_path) -> dict:
+    """
+    Load a dedup manifest written by `convert_folder`.
+
+    Returns:
+        dict: {"candidates": {fasta path: job name},
+               "jobs": {job name: {"output": json path, "aliases": [job names it stands for]}}}.
+              Every job's aliases include the job itself.
+    """
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def sanitised_job_name(name: str) -> str:
+    """The name AlphaFold3 uses for the output folder of a job."""
+    allowed_chars = set(string.ascii_lowercase + string.digits + '_-.')
+    return ''.join(c for c in name.lower().replace(' ', '_') if c in allowed_chars)
 
 
 if __name__ == "__main__":
@@ -88,7 +276,8 @@ if __name__ == "__main__":
     chainB = "MIQRTPKIQVYSRHPAENGKSNFLNCYVSGFHPSDIEVDLLKNGERIEKVEHSDLSFSKDWSFYLLYYTEFTPTEKDEYACRVNHVTLSQPKIVKWDRDM"
     chainC = "YVLDHLIVV"
     copies = 1
-    convert_folder(input_base, output_base, chainA, chainB, chainC, copies)
+    convert_folder(input_base, output_base, chainA, chainB, chainC, copies,
+                   manifest_path=f"{output_base}_manifest.json")
 
 
     # ### 5grd
@@ -0,0 +1,246 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+
+DEFAULT_CHECKPOINT_PATH = ".watch_checkpoint.sqlite"
+
+# inotify event bits (linux/inotify.h)
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    # Minimal inotify binding through libc, so watching needs no extra package
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}  # watch descriptor -> directory
+
+    def add(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"Cannot watch {directory}: {os.strerror(errno)}")
+        self.directories[wd] = directory
+
+    def read(self, timeout):
+        """(directory, mask, name) of the events within `timeout` seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events, i = [], 0
+        while i < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, i)
+            name = os.fsdecode(data[i + _EVENT.size:i + _EVENT.size + length].rstrip(b"\0"))
+            i += _EVENT.size + length
+            events.append((self.directories.get(wd), mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DesignWatcher:
+    """
+    Yields structure files under `input_base` once they are completely written, while
+    DiffAb is still adding more.
+
+    New and modified files are found with inotify (on Linux) or by walking the tree every
+    `poll_interval` seconds. A file counts as complete once its size and modification time
+    have not changed for `settle` seconds and, with inotify, once the writer has closed it,
+    so partially written PDBs are not yielded.
+    Files already in the tree when watching starts are yielded too, unless `skip` says so.
+
+    Args:
+        input_base (str): DiffAb results tree.
+        extensions (tuple): Structure file extensions.
+        settle (float): Seconds a file must stay unchanged.
+        poll_interval (float): Seconds between checks (and between tree walks when polling).
+        mode (str): "auto" (inotify, else polling), "inotify" or "poll".
+        idle_timeout (float): Stop after this many seconds without a new complete file.
+            None watches until interrupted.
+        once (bool): Only yield the files present now (once they settle), then stop.
+        skip (callable): skip(path, stat) -> True for files that were already processed.
+    """
+
+    def __init__(self, input_base, extensions=(".pdb", ".cif"), settle=5.0, poll_interval=2.0, mode="auto",
+                 idle_timeout=None, once=False, skip=None):
+        if mode not in ("auto", "inotify", "poll"):
+            raise ValueError(f"Unknown watch mode: {mode}")
+        self.input_base = input_base
+        self.extensions = tuple(extensions)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.mode = mode
+        self.idle_timeout = idle_timeout
+        self.once = once
+        self.skip = skip
+        self._pending = {}  # path -> (os.stat_result, time of the last change)
+        self._seen = {}  # path -> (size, mtime_ns) when yielded or skipped
+        self._open = set()  # Files written to and not closed yet (inotify only)
+        self._inotify = None
+
+    def _start_inotify(self):
+        try:
+            self._inotify = _Inotify()
+        except (OSError, AttributeError) as e:
+            if self.mode == "inotify":
+                raise
+            print(f"inotify unavailable ({e}), polling {self.input_base} every {self.poll_interval} s")
+            self.mode = "poll"
+
+    def _scan(self, directory):
+        # Adds every file under `directory` to the pending set, watching its directories
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            if self._inotify is not None:
+                self._inotify.add(root)
+            for file in sorted(files):
+                self._touch(os.path.join(root, file))
+
+    def _touch(self, path):
+        if not path.endswith(self.extensions):
+            return
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._pending.pop(path, None)
+            return
+        key = (st.st_size, st.st_mtime_ns)
+        if self._seen.get(path) == key:
+            return
+        if path not in self._pending and self.skip is not None and self.skip(path, st):
+            self._seen[path] = key
+            return
+        previous = self._pending.get(path)
+        if previous is None or (previous[0].st_size, previous[0].st_mtime_ns) != key:
+            self._pending[path] = (st, time.monotonic())
+
+    def _settled(self) -> list:
+        ready = []
+        for path, (st, _) in list(self._pending.items()):
+            self._touch(path)  # Picks up writes inotify may have merged or polling has not seen
+            entry = self._pending.get(path)
+            if entry is not None and entry[0] is st and path not in self._open \
+                    and time.monotonic() - entry[1] >= self.settle:
+                del self._pending[path]
+                self._seen[path] = (st.st_size, st.st_mtime_ns)
+                ready.append((path, st))
+        return sorted(ready)
+
+    def _wait(self):
+        # Waits for file system activity, or one poll interval
+        if self._inotify is None:
+            time.sleep(self.poll_interval)
+            if not self.once:
+                self._scan(self.input_base)
+            return
+        for directory, mask, name in self._inotify.read(self.poll_interval):
+            if mask & _IN_Q_OVERFLOW:
+                self._scan(self.input_base)
+            elif directory is None:
+                continue
+            elif mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Files may have been written before the new directory was watched
+                    self._scan(os.path.join(directory, name))
+            else:
+                path = os.path.join(directory, name)
+                if mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                    self._open.discard(path)
+                elif path.endswith(self.extensions):
+                    self._open.add(path)
+                self._touch(path)
+
+    def __iter__(self):
+        """Yield (path, os.stat_result) of every completed file."""
+        if not os.path.isdir(self.input_base):
+            raise FileNotFoundError(f"{self.input_base} is not a directory")
+        if self.mode != "poll" and not self.once:
+            self._start_inotify()
+        try:
+            self._scan(self.input_base)
+            last_yield = time.monotonic()
+            while True:
+                for path, st in self._settled():
+                    last_yield = time.monotonic()
+                    yield path, st
+                if self.once and not self._pending:
+                    return
+                if self.idle_timeout is not None and time.monotonic() - last_yield >= self.idle_timeout:
+                    return
+                self._wait()
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+
+
+class WatchCheckpoint:
+    """
+    Persistent SQLite record of the files a watch run has finished, so a restart neither
+    processes them again nor loses the ones that were still in flight.
+
+    A file is only recorded once its result is in (an AF3 job written, screened out, or an
+    error), together with the size and modification time it had when it was read. Files that
+    change afterwards are processed again.
+
+    Args:
+        path (str): SQLite database file.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH):
+        self.path = path
+        # The watcher asks from the pipeline's feeder thread while results are recorded in the main thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, status TEXT, detail TEXT,
+                finished REAL);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def is_done(self, path, st, retry_errors=False) -> bool:
+        with self._lock:
+            row = self.conn.execute("SELECT size, mtime_ns, status FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return False
+        return not (retry_errors and row[2] == "error")
+
+    def mark(self, path, size, mtime_ns, status, detail=None):
+        """Record a finished file; committed at once, since results arrive at DiffAb's pace."""
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                              (path, size, mtime_ns, status, detail, time.time()))
+            self.conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
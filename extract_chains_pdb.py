@@ -1,4 +1,11 @@
-from Bio.PDB import PDBParser, PDBIO, Select
+import argparse
+import json
+import os
+from multiprocessing import Pool
+import numpy as np
+from Bio.PDB import PDBParser, MMCIFParser, PDBIO, Select
+from instrumentation import file_timer
+from structure_arrays import _split_cif_row, read_structure_arrays, write_cif_arrays, write_pdb_arrays
 
 class ChainSelector(Select):
     def __init__(self, chains_to_keep):
@@ -10,15 +17,15 @@ class ChainSelector(Select):
 
 def extract_chains(input_pdb, output_pdb, chains):
     """
-    Extract specified chains from a PDB file and save to a new PDB file.
+    Extract specified chains from a PDB (or mmCIF) file and save to a new PDB file.
 
     Args:
-        input_pdb (str): Path to the input PDB file.
+        input_pdb (str): Path to the input PDB or mmCIF file.
         output_pdb (str): Path to save the new PDB file.
         chains (list): List of chain IDs to extract.
     """
     # Parse the structure
-    parser = PDBParser(QUIET=True)
+    parser = MMCIFParser(QUIET=True) if input_pdb.endswith(".cif") else PDBParser(QUIET=True)
     structure = parser.get_structure("structure", input_pdb)
 
     # Set up the PDB writer and selector
@@ -29,10 +36,225 @@ def extract_chains(input_pdb, output_pdb, chains):
 
 def extract_chains_auto_filename(input_pdb, chains):
     chains_str = ''.join(chains)
-    output_pdb = input_pdb[:-len('.pdb')] + f'_{chains_str}.pdb'
+    output_pdb = os.path.splitext(input_pdb)[0] + f'_{chains_str}.pdb'
     extract_chains(input_pdb, output_pdb, chains)
 
+def _is_cif(path) -> bool:
+    return path.endswith((".cif", ".mmcif"))
+
+
+def subset_filename(input_pdb, chains, output_dir=None, extension=None) -> str:
+    """`{input}_{chains}.pdb` like extract_chains_auto_filename, optionally in `output_dir`."""
+    stem = os.path.splitext(input_pdb)[0]
+    if output_dir is not None:
+        stem = os.path.join(output_dir, os.path.basename(stem))
+    return f"{stem}_{''.join(chains)}{extension or '.pdb'}"
+
+
+def _filter_pdb_lines(input_pdb, outputs):
+    # outputs: list of (file, set of chains). Coordinate records go to every output keeping
+    # their chain, MODEL/ENDMDL to all of them; headers and CONECT are dropped like PDBIO does.
+    chain = None
+    with open(input_pdb, 'r') as f:
+        for line in f:
+            record = line[:6]
+            if record == "ATOM  " or record == "HETATM" or record == "ANISOU":
+                chain = line[21:22].strip()
+            elif record.startswith("TER"):
+                # A bare TER line belongs to the chain of the atoms before it
+                chain = line[21:22].strip() if len(line.rstrip("\n")) > 21 else chain
+            elif record == "MODEL " or record == "ENDMDL":
+                for output, _ in outputs:
+                    output.write(line)
+                continue
+            else:
+                continue
+            for output, chains in outputs:
+                if chain in chains:
+                    output.write(line)
+    for output, _ in outputs:
+        output.write("END\n")
+
+
+def _filter_cif_lines(input_cif, outputs):
+    # Copies the data block name and the _atom_site loop header, then the rows of the kept chains
+    header, names, chain_col = [], None, None
+    with open(input_cif, 'r') as f:
+        for line in f:
+            if chain_col is None:
+                if line.startswith("data_") and not header:
+                    header.append(line)
+                elif line.startswith("loop_"):
+                    names = [line]
+                elif names is not None and line.startswith("_atom_site."):
+                    names.append(line)
+                elif names is not None and len(names) > 1:
+                    columns = [name.strip()[len("_atom_site."):] for name in names[1:]]
+                    chain_col = columns.index("auth_asym_id") if "auth_asym_id" in columns \
+                        else columns.index("label_asym_id")
+                    for output, _ in outputs:
+                        output.writelines(header + ["#\n"] + names)
+                else:
+                    names = None
+                if chain_col is None:
+                    continue
+            if not line.strip() or line.startswith(('#', 'loop_', '_', 'data_')):
+                break
+            tokens = _split_cif_row(line)
+            if len(tokens) != len(columns):
+                raise ValueError(f"{input_cif}: _atom_site rows spanning several lines are not supported")
+            for output, chains in outputs:
+                if tokens[chain_col] in chains:
+                    output.write(line)
+    if chain_col is None:
+        raise ValueError(f"No _atom_site loop in {input_cif}")
+    for output, _ in outputs:
+        output.write("#\n")
+
+
+def extract_chain_subsets(input_pdb, subsets, output_dir=None, extension=None) -> list:
+    """
+    Write several chain subsets of one PDB or mmCIF file, reading it once.
+
+    When the outputs have the same format as the input, the atom records are copied line by line
+    into every output that keeps their chain, so no structure object is built and all models
+    are kept. Otherwise the file is parsed once into StructureArrays (first model only) and each
+    subset is written from it.
+
+    Args:
+        input_pdb (str): Path to the input PDB or mmCIF file.
+        subsets (list or dict): Lists of chain IDs, named with `subset_filename`, or a dict
+                                mapping output paths to lists of chain IDs.
+        output_dir (str): Directory for the generated file names. Defaults to the input's.
+        extension (str): Extension of the generated file names, ".pdb" (default) or ".cif".
+
+    Returns:
+        list: Output paths, in the order of `subsets`.
+    """
+    if not isinstance(subsets, dict):
+        subsets = {subset_filename(input_pdb, chains, output_dir, extension): chains for chains in subsets}
+    for output_pdb in subsets:
+        os.makedirs(os.path.dirname(output_pdb) or ".", exist_ok=True)
+
+    if all(_is_cif(output_pdb) == _is_cif(input_pdb) for output_pdb in subsets):
+        files = [open(output_pdb, 'w') for output_pdb in subsets]
+        try:
+            outputs = [(f, set(chains)) for f, chains in zip(files, subsets.values())]
+            (_filter_cif_lines if _is_cif(input_pdb) else _filter_pdb_lines)(input_pdb, outputs)
+        finally:
+            for f in files:
+                f.close()
+    else:
+        structure = read_structure_arrays(input_pdb)
+        for output_pdb, chains in subsets.items():
+            subset = structure.select(np.isin(structure.chain_ids, list(chains)))
+            if _is_cif(output_pdb):
+                write_cif_arrays(subset, output_pdb, name=os.path.splitext(os.path.basename(output_pdb))[0])
+            else:
+                write_pdb_arrays(subset, output_pdb)
+    return list(subsets)
+
+
+def _extract_one(job):
+    input_pdb, subsets, output_dir, extension = job
+    try:
+        with file_timer("extract_chains_pdb", input_pdb):
+            return input_pdb, extract_chain_subsets(input_pdb, subsets, output_dir, extension), None
+    except Exception as e:
+        return input_pdb, [], f"{type(e).__name__}: {e}"
+
+
+def extract_chain_subsets_batch(jobs, output_dir=None, extension=None, workers=None, chunksize=1):
+    """
+    Run `extract_chain_subsets` over many input files with a process pool.
+
+    All output paths are resolved before anything is written: inputs that would write the
+    same output file (e.g. `a/0000.pdb` and `b/0000.pdb` with `output_dir`) raise ValueError
+    right away.
+
+    Args:
+        jobs (dict): {input path: subsets}, with subsets as in `extract_chain_subsets`.
+        output_dir (str): Directory for the generated file names.
+        extension (str): Extension of the generated file names.
+        workers (int): Worker processes. Defaults to all CPUs; 1 runs in this process.
+        chunksize (int): Files handed to a worker at a time.
+
+    Returns:
+        iterator: (input path, output paths, error message or None), in the order of `jobs`.
+    """
+    items = []
+    writers = {}  # Output path -> input path
+    for input_pdb, subsets in jobs.items():
+        if not isinstance(subsets, dict):
+            subsets = {subset_filename(input_pdb, chains, output_dir, extension): chains for chains in subsets}
+        for output_pdb in subsets:
+            key = os.path.abspath(output_pdb)
+            if key in writers:
+                raise ValueError(f"{writers[key]} and {input_pdb} would both write {output_pdb}")
+            writers[key] = input_pdb
+        items.append((input_pdb, subsets, output_dir, extension))
+    return _run_batch(items, workers, chunksize)
+
+
+def _run_batch(items, workers, chunksize):
+    if workers == 1 or len(items) <= 1:
+        yield from map(_extract_one, items)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap(_extract_one, items, chunksize=chunksize)
+        pool.close()
+        pool.join()
+
+
+def _parse_chains(spec) -> list:
+    # "AC" -> ["A", "C"]; commas separate multi-character chain IDs ("AA,BB")
+    return spec.split(',') if ',' in spec else list(spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write chain subsets of PDB/mmCIF files, reading each file once.")
+    parser.add_argument("inputs", nargs="*", help="Input PDB or mmCIF files")
+    parser.add_argument("--chains", nargs="+", default=[],
+                        help="Chain subsets to write from every input, e.g. AC HL (commas for long IDs: AA,BB)")
+    parser.add_argument("--jobs", default=None,
+                        help='JSON file with subsets per input: {"5grd.pdb": [["A", "C"]], "7re7.pdb": [["H", "L"]]}')
+    parser.add_argument("--output-dir", default=None, help="Output directory (default: next to each input)")
+    parser.add_argument("--format", choices=["pdb", "cif"], default="pdb", help="Output format")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    jobs = {}
+    if args.jobs is not None:
+        with open(args.jobs, 'r') as f:
+            jobs.update(json.load(f))
+    subsets = [_parse_chains(spec) for spec in args.chains]
+    if args.inputs and not subsets:
+        parser.error("--chains is required with input files")
+    for input_pdb in args.inputs:
+        jobs[input_pdb] = jobs.get(input_pdb, []) + subsets
+    if not jobs:
+        parser.error("give input files with --chains, or --jobs")
+
+    try:
+        results = extract_chain_subsets_batch(jobs, args.output_dir, f".{args.format}", args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    n_written, n_errors = 0, 0
+    for input_pdb, output_paths, error in results:
+        if error is not None:
+            n_errors += 1
+            print(f"Error processing {input_pdb}: {error}")
+            continue
+        n_written += len(output_paths)
+        for output_path in output_paths:
+            print(output_path)
+    print(f"{n_written} files written, {n_errors} errors")
+
+
 # Example usage:
 # Extract chains A, B, and C from 'input.pdb' and save to 'output.pdb'
 # extract_chains("7re7.pdb", "7re7_HL.pdb", ["H", "L"])
-extract_chains_auto_filename("6nca.pdb", ["Y", "I"])
\ No newline at end of file
+# Several subsets of many files in one pass per file:
+# python extract_chains_pdb.py 5grd.pdb 7re7.pdb --chains AC HL --workers 4
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,10 @@ import os
 from Bio import PDB
 from Bio.PDB.Polypeptide import PPBuilder
 import pathlib
+from instrumentation import count, file_timer, timer
+from pdb_seq_stream import read_chain_sequences, sequences_from_arrays
+from structure_store import iter_store_batches
+from structure_arrays import read_cif_arrays
 
 def extract_sequence_from_chain(chain):
     """Extract amino acid sequence from a chain using PPBuilder."""
@@ -11,60 +15,156 @@ def extract_sequence_from_chain(chain):
         seq += str(pp.get_sequence())
     return seq
 
-def process_pdb_file(input_path, output_base_path, H_name='H', L_name='L'):
-    """Process a single PDB file and save H and L chains."""
+def read_sequences_biopython(input_path, chain_ids=None):
+    """Read the sequences of `chain_ids` (all chains if None) by building a full Bio.PDB structure."""
     # Create parser
-    parser = PDB.PDBParser(QUIET=True)
+    if input_path.endswith(".cif"):
+        parser = PDB.MMCIFParser(QUIET=True)
+    else:
+        parser = PDB.PDBParser(QUIET=True)
     
     # Parse structure
-    structure = parser.get_structure('structure', input_path)
+    with timer("parse.biopython"):
+        structure = parser.get_structure('structure', input_path)
     
-    # Create output directory if it doesn't exist
-    output_dir = os.path.dirname(output_base_path)
-    os.makedirs(output_dir, exist_ok=True)
+    # Dictionary to store sequences
+    sequences = {}
     
+    # Extract sequences for the requested chains
+    with timer("sequence.ppbuilder"):
+        for model in structure:
+            for chain in model:
+                chain_id = chain.get_id()
+                if chain_ids is None or chain_id in chain_ids:
+                    sequence = extract_sequence_from_chain(chain)
+                    if sequence:
+                        sequences[chain_id] = sequence
+    return sequences
+
+
+def read_sequences(input_path, chain_ids=None, backend="stream"):
+    """
+    Read the sequences of `chain_ids` from a PDB file.
+
+    backend is "stream" (single-pass reader in pdb_seq_stream, the default) or "biopython"
+    (PDBParser + PPBuilder); both give the same sequences, but "stream" does not build the structure.
+    """
+    if backend == "biopython":
+        return read_sequences_biopython(input_path, chain_ids)
+    elif backend == "stream":
+        if input_path.endswith(".cif"):
+            structure = read_cif_arrays(input_path)
+            with timer("sequence.arrays"):
+                return sequences_from_arrays(structure, chain_ids)
+        # Parsing and sequence building are one pass here
+        with timer("sequence.stream"):
+            return read_chain_sequences(input_path, chain_ids)
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def process_pdb_file(input_path, output_base_path, H_name='H', L_name='L', backend="stream", writer=None):
+    """
+    Process a single PDB file and save H and L chains.
+
+    If `writer` (a bulk_writer.BulkWriter) is given, the FASTA is handed to it instead of
+    being written here.
+    """
     # Dictionary to store H and L sequences
-    sequences = {}
+    sequences = read_sequences(input_path, [H_name, L_name], backend)
+
+    if writer is not None:
+        if H_name in sequences and L_name in sequences:
+            count("fasta.written")
+            writer.write(f"{output_base_path}.fasta",
+                         f">{os.path.basename(input_path)}_H\n{sequences[H_name]}\n"
+                         f">{os.path.basename(input_path)}_L\n{sequences[L_name]}\n")
+            return True
+        return False
     
-    # Extract sequences for H and L chains
-    for model in structure:
-        for chain in model:
-            chain_id = chain.get_id()
-            if chain_id in [H_name, L_name]:
-                sequence = extract_sequence_from_chain(chain)
-                if sequence:
-                    sequences[chain_id] = sequence
+    # Create output directory if it doesn't exist
+    output_dir = os.path.dirname(output_base_path)
+    os.makedirs(output_dir, exist_ok=True)
     
     # Only save if both H and L chains are present
     if H_name in sequences and L_name in sequences:
         output_file = f"{output_base_path}.fasta"
-        with open(output_file, 'w') as f:
+        count("fasta.written")
+        with timer("write.fasta"), open(output_file, 'w') as f:
             f.write(f">{os.path.basename(input_path)}_H\n")
             f.write(f"{sequences[H_name]}\n")
             f.write(f">{os.path.basename(input_path)}_L\n")
             f.write(f"{sequences[L_name]}\n")
+        return True
+    return False
 
-def main():
-    input_base = "20241106_merged3"
-    output_base = "20241106_merged3_seq"
+def main(input_base="20241106_merged3", output_base="20241106_merged3_seq", backend="stream", cache=None,
+         writer=None):
+    """
+    Extract the H and L sequences of every PDB under `input_base` into FASTA files.
+
+    If `cache` (a stage_cache.StageCache) is given, files whose content and output path
+    are unchanged since the last run are skipped.
+
+    If `writer` (a bulk_writer.BulkWriter) is given, the FASTA records go through it, named
+    by their path relative to the writer's output directory.
+    """
     
     # Find all PDB files recursively
     for root, dirs, files in os.walk(input_base):
         for file in files:
-            if file.endswith('.pdb'):
+            if file.endswith(('.pdb', '.cif')):
                 # Get input file path
                 input_path = os.path.join(root, file)
+
+                # A .pdb converted with obabel next to its .cif would write the same FASTA; the .cif
+                # is the original and keeps the H/L chain names that obabel renames to D/E
+                if file.endswith('.pdb') and f"{os.path.splitext(file)[0]}.cif" in files:
+                    print(f"Skipping {input_path}: {os.path.splitext(file)[0]}.cif writes the same FASTA")
+                    continue
                 
                 # Create corresponding output path
                 relative_path = os.path.relpath(input_path, input_base)
                 output_path = os.path.join(output_base, relative_path)
-                output_path = os.path.splitext(output_path)[0]  # Remove .pdb extension
+                output_path = os.path.splitext(output_path)[0]  # Remove .pdb/.cif extension
+                if writer is not None:
+                    output_path = os.path.splitext(relative_path)[0]
                 
                 try:
-                    process_pdb_file(input_path, output_path)
+                    params = {"output": output_path, "H": "H", "L": "L"}
+                    if cache is not None:
+                        cached = cache.get("extract_chains_seq", input_path, params)
+                        if cached is not None and (not cached["written"] or writer is not None
+                                                   or os.path.exists(f"{output_path}.fasta")):
+                            count("files.cached")
+                            continue
+                    with file_timer("extract_chains_seq", input_path):
+                        written = process_pdb_file(input_path, output_path, backend=backend, writer=writer)
+                    if cache is not None:
+                        cache.put("extract_chains_seq", input_path, params, {"written": written})
                     print(f"Processed: {input_path}")
                 except Exception as e:
                     print(f"Error processing {input_path}: {str(e)}")
 
+def main_from_store(store_base, output_base="20241106_merged3_seq", H_name='H', L_name='L'):
+    """
+    Same as `main`, but reads the structures from a structure_store built with
+    structure_store.py instead of parsing the PDB files again.
+    """
+    for store in iter_store_batches(store_base):
+        for name, structure in store:
+            output_path = os.path.splitext(os.path.join(output_base, name))[0]
+            try:
+                sequences = sequences_from_arrays(structure, [H_name, L_name])
+                if H_name in sequences and L_name in sequences:
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    with open(f"{output_path}.fasta", 'w') as f:
+                        f.write(f">{os.path.basename(name)}_H\n")
+                        f.write(f"{sequences[H_name]}\n")
+                        f.write(f">{os.path.basename(name)}_L\n")
+                        f.write(f"{sequences[L_name]}\n")
+                print(f"Processed: {name}")
+            except Exception as e:
+                print(f"Error processing {name}: {str(e)}")
+
 if __name__ == "__main__":
     main()
@@ -4,13 +4,13 @@ from Bio.PDB.Polypeptide import PPBuilder
 import pathlib
 
 
-def fasta_to_dict(fasta_file):
+def parse_fasta(lines):
     """
-    Convert a FASTA file to a dictionary where keys are chain names and values are sequences.
-    
+    Parse FASTA lines (e.g. an open file) into a dictionary of header -> sequence.
+
     Args:
-        fasta_file (str): Path to the FASTA file
-        
+        lines (iterable): Lines of FASTA text
+
     Returns:
         dict: Dictionary with chain names as keys and sequences as values
     """
@@ -18,18 +18,17 @@ def fasta_to_dict(fasta_file):
     current_chain = None
     current_sequence = []
     
-    with open(fasta_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:  # Skip empty lines
-                continue
-            if line.startswith('>'):  # Header line
-                if current_chain is not None:  # Save the previous sequence
-                    sequences[current_chain] = ''.join(current_sequence)
-                current_chain = line[1:]  # Remove the '>' character
-                current_sequence = []
-            else:  # Sequence line
-                current_sequence.append(line)
+    for line in lines:
+        line = line.strip()
+        if not line:  # Skip empty lines
+            continue
+        if line.startswith('>'):  # Header line
+            if current_chain is not None:  # Save the previous sequence
+                sequences[current_chain] = ''.join(current_sequence)
+            current_chain = line[1:]  # Remove the '>' character
+            current_sequence = []
+        else:  # Sequence line
+            current_sequence.append(line)
     
     # Don't forget to save the last sequence
     if current_chain is not None:
@@ -38,9 +37,24 @@ def fasta_to_dict(fasta_file):
     return sequences
 
 
+def fasta_to_dict(fasta_file):
+    """
+    Convert a FASTA file to a dictionary where keys are chain names and values are sequences.
+    
+    Args:
+        fasta_file (str): Path to the FASTA file
+        
+    Returns:
+        dict: Dictionary with chain names as keys and sequences as values
+    """
+    with open(fasta_file, 'r') as f:
+        return parse_fasta(f)
+
+
 
-print(fasta_to_dict('copied_results_chains/results/6nca_7re7/codesign_multicdrs_6666666666/6_Ab_0009.pdb_2025_01_28__02_02_46/reference.fasta'))
-# print(fasta_to_dict('results_20250120_chains/6nca_7re7/codesign_multicdrs_6/6_Ab_0057.pdb_2025_01_20__02_08_18/reference.fasta'))
+if __name__ == "__main__":
+    print(fasta_to_dict('copied_results_chains/results/6nca_7re7/codesign_multicdrs_6666666666/6_Ab_0009.pdb_2025_01_28__02_02_46/reference.fasta'))
+    # print(fasta_to_dict('results_20250120_chains/6nca_7re7/codesign_multicdrs_6/6_Ab_0057.pdb_2025_01_20__02_08_18/reference.fasta'))
 
 # def process_pdb_file(input_path, output_base_path):
 #     """Process a single PDB file and save H and L chains."""
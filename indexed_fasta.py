@@ -0,0 +1,195 @@
+import mmap
+import os
+
+
+class FastaRecord:
+    """
+    One sequence of an IndexedFasta. Nothing is read until the sequence is sliced or
+    converted with `str`, and then only the bytes of the requested range.
+    """
+
+    def __init__(self, fasta, name, length, offset, line_bases, line_width):
+        self.fasta = fasta
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.line_bases = line_bases
+        self.line_width = line_width
+
+    def __len__(self):
+        return self.length
+
+    def _position(self, i):
+        # Byte offset of base i, skipping the newline bytes of the preceding lines
+        return self.offset + (i // self.line_bases) * self.line_width + i % self.line_bases
+
+    def __getitem__(self, key) -> str:
+        if isinstance(key, int):
+            key = slice(key, key + 1) if key >= 0 else slice(self.length + key, self.length + key + 1)
+        start, stop, step = key.indices(self.length)
+        if start >= stop:
+            return ""
+        data = self.fasta.mmap[self._position(start):self._position(stop - 1) + 1]
+        if self.line_width != self.line_bases:
+            data = data.replace(b"\r", b"").replace(b"\n", b"")
+        return data[::step].decode()
+
+    def __str__(self):
+        return self[:]
+
+    def view(self) -> memoryview:
+        """Zero-copy bytes of a sequence stored on a single line (as written by the tools here)."""
+        if self.length > self.line_bases:
+            raise ValueError(f"{self.name} spans several lines; use str() or slicing instead")
+        return memoryview(self.fasta.mmap)[self.offset:self.offset + self.length]
+
+    def __repr__(self):
+        return f"FastaRecord({self.name!r}, length={self.length})"
+
+
+def build_fasta_index(fasta_path, index_path=None) -> str:
+    """
+    Write a samtools-style `.fai` index of a FASTA file: one tab-separated line per record
+    with NAME, LENGTH, OFFSET (of the first base), LINEBASES and LINEWIDTH.
+
+    Unlike samtools, NAME is the whole header line (what `fasta_to_dict` uses as key), not
+    only its first word. As with samtools, all lines of a record except the last must have
+    the same length.
+
+    Args:
+        fasta_path (str): FASTA file.
+        index_path (str): Output path. Defaults to `{fasta_path}.fai`.
+
+    Returns:
+        str: Path of the index.
+    """
+    index_path = index_path or f"{fasta_path}.fai"
+    entries = []
+    name = None
+
+    def finish():
+        if name is not None:
+            entries.append(f"{name}\t{length}\t{offset}\t{line_bases or length}\t{line_width or length + 1}\n")
+
+    with open(fasta_path, 'rb') as f:
+        position = 0
+        for line in f:
+            if line.startswith(b'>'):
+                finish()
+                name = line.strip()[1:].decode()
+                length, offset, line_bases, line_width, short_line = 0, position + len(line), 0, 0, False
+            elif name is not None and line.strip():
+                bases = len(line.rstrip(b"\r\n"))
+                if short_line or (line_bases and bases > line_bases):
+                    raise ValueError(f"Record {name} in {fasta_path} has lines of different lengths")
+                if not line_bases:
+                    line_bases, line_width = bases, len(line)
+                elif bases < line_bases:
+                    short_line = True
+                length += bases
+            position += len(line)
+        finish()
+
+    with open(index_path, 'w') as f:
+        f.writelines(entries)
+    return index_path
+
+
+class IndexedFasta:
+    """
+    Random access to the records of a (large) multi-record FASTA file.
+
+    The file is memory-mapped once and its `.fai` index (built with `build_fasta_index` if
+    missing or older than the FASTA) gives the position of every record, so opening the file
+    does not parse the sequences, `fasta[header]` is a dictionary lookup, and the sequences are
+    read lazily from the mapping. Index lines are only split into fields when a record is
+    used, and the header -> line table is built on the first lookup by header.
+
+    Args:
+        fasta_path (str): FASTA file.
+        index_path (str): `.fai` index. Defaults to `{fasta_path}.fai`.
+    """
+
+    def __init__(self, fasta_path, index_path=None):
+        self.path = fasta_path
+        index_path = index_path or f"{fasta_path}.fai"
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(fasta_path):
+            build_fasta_index(fasta_path, index_path)
+
+        self._file = open(fasta_path, 'rb')
+        self.mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(fasta_path) else b""
+        with open(index_path, 'r') as f:
+            self._lines = f.read().splitlines()
+        self._by_name = None
+
+    @staticmethod
+    def _name(line) -> str:
+        return line[:line.index('\t')]
+
+    def _record(self, line) -> FastaRecord:
+        name, length, offset, line_bases, line_width = line.split('\t')
+        return FastaRecord(self, name, int(length), int(offset), int(line_bases), int(line_width))
+
+    def _lookup(self) -> dict:
+        if self._by_name is None:
+            # Later duplicates win, like in fasta_to_dict
+            self._by_name = {self._name(line): line for line in self._lines}
+        return self._by_name
+
+    def __len__(self):
+        return len(self._lookup())
+
+    def __contains__(self, name):
+        return name in self._lookup()
+
+    def __getitem__(self, name) -> FastaRecord:
+        return self._record(self._lookup()[name])
+
+    def __iter__(self):
+        """Record headers, in file order."""
+        return (self._name(line) for line in self._lines)
+
+    def items(self):
+        """Lazily yield (header, FastaRecord) in file order."""
+        for line in self._lines:
+            record = self._record(line)
+            yield record.name, record
+
+    def to_dict(self) -> dict:
+        """All records as strings, the same dictionary `fasta_to_dict` returns."""
+        return {name: str(record) for name, record in self.items()}
+
+    def groups(self, separator='|'):
+        """
+        Group the records by candidate and yield (candidate, {header: FastaRecord}).
+
+        Headers written by bulk_writer's "fasta" layout look like `{candidate}|{header}`, and the
+        candidate is the part before `separator`. Other headers use the `{file}_H` / `{file}_L`
+        convention of extract_chains_seq, and the candidate is the header up to its last '_'.
+        Records of one candidate must be next to each other.
+        """
+        current, records = None, {}
+        for name, record in self.items():
+            if separator in name:
+                candidate, header = name.split(separator, 1)
+            else:
+                candidate, header = name.rsplit('_', 1)[0], name
+            if candidate != current:
+                if current is not None:
+                    yield current, records
+                current, records = candidate, {}
+            records[header] = record
+        if current is not None:
+            yield current, records
+
+    def close(self):
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
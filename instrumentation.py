@@ -0,0 +1,438 @@
+import argparse
+import atexit
+import bisect
+import functools
+import glob
+import heapq
+import json
+import multiprocessing.util
+import os
+import signal
+import threading
+import time
+
+# Upper bounds (in seconds) of the per-file latency histogram buckets; the last bucket is open
+HISTOGRAM_EDGES = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# Environment variables that turn instrumentation on for any script, without code changes
+REPORT_ENV = "PROTEIN_PROFILE_REPORT"  # JSON report written at exit (and on SIGUSR1)
+DUMP_ENV = "PROTEIN_PROFILE_DUMP"      # cProfile (.prof) or pyinstrument (.html / .txt) dump written at exit
+_MAIN_PID_ENV = "PROTEIN_PROFILE_MAIN_PID"  # Set by the process that writes the report; others are workers
+
+# The active Profiler, or None when instrumentation is disabled
+_profiler = None
+
+
+class _FileStats:
+    # Latency histogram and slowest files of one stage
+    __slots__ = ("count", "seconds", "histogram", "slowest")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_EDGES) + 1)
+        self.slowest = []  # Min-heap of (seconds, path)
+
+    def report(self) -> dict:
+        return {
+            "count": self.count,
+            "seconds": self.seconds,
+            "mean": self.seconds / self.count if self.count else None,
+            "histogram": [{"le": edge, "count": n} for edge, n in zip(HISTOGRAM_EDGES + (None,), self.histogram)],
+            "slowest": [{"path": path, "seconds": seconds} for seconds, path in sorted(self.slowest, reverse=True)],
+        }
+
+
+class Profiler:
+    """
+    Timers, counters and per-file latencies of one process.
+
+    Timer names are "{category}.{detail}", e.g. "parse.pdb" or "write.fasta"; the report also
+    sums them per category (parse, search, select, sequence, serialize, write, walk, stage).
+    File latencies are kept per stage (e.g. "screen", "extract_chains_seq").
+
+    Args:
+        slowest (int): Number of slowest files to keep per stage.
+    """
+
+    def __init__(self, slowest=20):
+        self.timers = {}    # name -> [calls, seconds, max seconds]
+        self.counters = {}  # name -> count
+        self.files = {}     # stage -> _FileStats
+        self.slowest = slowest
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._profile = None
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def add_count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_file(self, stage, path, seconds):
+        with self._lock:
+            stats = self.files.get(stage)
+            if stats is None:
+                stats = self.files[stage] = _FileStats()
+            stats.count += 1
+            stats.seconds += seconds
+            stats.histogram[bisect.bisect_left(HISTOGRAM_EDGES, seconds)] += 1
+            if len(stats.slowest) < self.slowest:
+                heapq.heappush(stats.slowest, (seconds, path))
+            elif seconds > stats.slowest[0][0]:
+                heapq.heapreplace(stats.slowest, (seconds, path))
+
+    def report(self) -> dict:
+        """Everything recorded so far, as a JSON-serializable dict (see `merge_reports`)."""
+        with self._lock:
+            timers = {name: {"calls": calls, "seconds": seconds, "mean": seconds / calls, "max": longest}
+                      for name, (calls, seconds, longest) in sorted(self.timers.items())}
+            categories = {}
+            for name, timer in timers.items():
+                category = categories.setdefault(name.split('.')[0], {"calls": 0, "seconds": 0.0})
+                category["calls"] += timer["calls"]
+                category["seconds"] += timer["seconds"]
+            return {
+                "pid": os.getpid(),
+                "wall_seconds": time.perf_counter() - self._started,
+                "categories": categories,
+                "timers": timers,
+                "counters": dict(sorted(self.counters.items())),
+                "files": {stage: stats.report() for stage, stats in sorted(self.files.items())},
+            }
+
+
+class _NullTimer:
+    # Shared no-op context manager returned while instrumentation is disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("profiler", "name", "path", "start")
+
+    def __init__(self, profiler, name, path=None):
+        self.profiler = profiler
+        self.name = name  # Timer name, or the stage of a file timer
+        self.path = path
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if self.path is None:
+            self.profiler.add_time(self.name, seconds)
+        else:
+            self.profiler.add_file(self.name, self.path, seconds)
+        return False
+
+
+def enable(slowest=20, profile=None) -> Profiler:
+    """
+    Start recording in this process (a no-op if already enabled).
+
+    Args:
+        slowest (int): Number of slowest files to keep.
+        profile (str): Also run a profiler over everything: "cprofile" or "pyinstrument"
+            (if installed). Write it with `dump_profile`.
+
+    Returns:
+        Profiler: The active profiler.
+    """
+    global _profiler
+    if _profiler is None:
+        profiler = Profiler(slowest)
+        if profile == "cprofile":
+            import cProfile
+            profiler._profile = cProfile.Profile()
+            profiler._profile.enable()
+        elif profile == "pyinstrument":
+            try:
+                from pyinstrument import Profiler as Pyinstrument
+            except ImportError:
+                raise ImportError("profile='pyinstrument' needs `pip install pyinstrument`")
+            profiler._profile = Pyinstrument()
+            profiler._profile.start()
+        elif profile is not None:
+            raise ValueError(f"Unknown profiler: {profile}")
+        _profiler = profiler
+    return _profiler
+
+
+def disable() -> Profiler:
+    """Stop recording and return the profiler that was active (None if there was none)."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None and profiler._profile is not None:
+        if hasattr(profiler._profile, "disable"):
+            profiler._profile.disable()
+        elif profiler._profile.is_running:
+            profiler._profile.stop()
+    return profiler
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+def timer(name):
+    """Context manager that adds the time spent in its block to timer `name`."""
+    if _profiler is None:
+        return _NULL_TIMER
+    return _Timer(_profiler, name)
+
+
+def file_timer(stage, path):
+    """Context manager that records the time spent in its block as the latency of `path` in `stage`."""
+    if _profiler is None:
+        return _NULL_TIMER
+    return _Timer(_profiler, stage, path)
+
+
+def count(name, n=1):
+    """Add `n` to counter `name`."""
+    if _profiler is not None:
+        _profiler.add_count(name, n)
+
+
+def timed(name):
+    """Decorator: time every call of the function under timer `name`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return fn(*args, **kwargs)
+            with _Timer(_profiler, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report() -> dict:
+    """Report of the active profiler, or None when disabled."""
+    return _profiler.report() if _profiler is not None else None
+
+
+def export_json(path, data=None):
+    """Write `data` (default: the current report) as JSON."""
+    data = report() if data is None else data
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write next to the target and rename, so a report requested mid-run is never half-written
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def dump_profile(path):
+    """
+    Write the profile started with `enable(profile=...)`: a pstats file for cProfile
+    (read it with `python -m pstats` or snakeviz), or HTML/text for pyinstrument.
+    """
+    profile = _profiler._profile if _profiler is not None else None
+    if profile is None:
+        raise ValueError("No profiler is running; use enable(profile='cprofile') or 'pyinstrument'")
+    if hasattr(profile, "dump_stats"):
+        profile.disable()
+        profile.dump_stats(path)
+        profile.enable()
+        return
+    running = profile.is_running
+    if running:
+        profile.stop()
+    with open(path, 'w') as f:
+        f.write(profile.output_html() if path.endswith(".html") else profile.output_text())
+    if running:
+        profile.start()
+
+
+def merge_reports(reports) -> dict:
+    """Combine the reports of several processes (e.g. the main process and its workers) into one."""
+    timers, counters, files = {}, {}, {}
+    wall_seconds = 0.0
+    for part in reports:
+        for name, timer in part["timers"].items():
+            merged = timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max": 0.0})
+            merged["calls"] += timer["calls"]
+            merged["seconds"] += timer["seconds"]
+            merged["max"] = max(merged["max"], timer["max"])
+        for name, n in part["counters"].items():
+            counters[name] = counters.get(name, 0) + n
+        for stage, stats in part["files"].items():
+            merged = files.setdefault(stage, {"count": 0, "seconds": 0.0, "histogram": [dict(bucket, count=0)
+                                                                                      for bucket in stats["histogram"]],
+                                              "slowest": [], "keep": 0})
+            merged["count"] += stats["count"]
+            merged["seconds"] += stats["seconds"]
+            for bucket, other in zip(merged["histogram"], stats["histogram"]):
+                bucket["count"] += other["count"]
+            merged["slowest"].extend(stats["slowest"])
+            merged["keep"] = max(merged["keep"], len(stats["slowest"]))
+        wall_seconds = max(wall_seconds, part["wall_seconds"])
+
+    categories = {}
+    for name, timer in sorted(timers.items()):
+        timer["mean"] = timer["seconds"] / timer["calls"]
+        category = categories.setdefault(name.split('.')[0], {"calls": 0, "seconds": 0.0})
+        category["calls"] += timer["calls"]
+        category["seconds"] += timer["seconds"]
+    for stats in files.values():
+        stats["mean"] = stats["seconds"] / stats["count"] if stats["count"] else None
+        stats["slowest"] = sorted(stats["slowest"], key=lambda x: x["seconds"], reverse=True)[:stats.pop("keep")]
+    return {
+        "processes": sum(part.get("processes", 1) for part in reports),
+        "wall_seconds": wall_seconds,
+        "categories": categories,
+        "timers": dict(sorted(timers.items())),
+        "counters": dict(sorted(counters.items())),
+        "files": dict(sorted(files.items())),
+    }
+
+
+def _write_part(report_path):
+    # Worker processes leave their report next to the main one, merged by _write_main at exit
+    if _profiler is not None:
+        export_json(f"{report_path}.part{os.getpid()}", _profiler.report())
+
+
+def _write_main(report_path, dump_path=None):
+    if _profiler is None or not _is_main_process():
+        return
+    if dump_path is not None:
+        dump_profile(dump_path)
+    parts = glob.glob(f"{glob.escape(report_path)}.part*")
+    reports = [_profiler.report()]
+    for part in parts:
+        with open(part, 'r') as f:
+            reports.append(json.load(f))
+    export_json(report_path, merge_reports(reports))
+    for part in parts:
+        os.remove(part)
+
+
+def _is_main_process() -> bool:
+    return os.environ.get(_MAIN_PID_ENV) == str(os.getpid())
+
+
+def _write_snapshot(report_path):
+    # SIGUSR1 handler; forked workers inherit it but only the main process writes the report
+    if _is_main_process() and _profiler is not None:
+        export_json(report_path, _profiler.report())
+
+
+class _WorkerHook:
+    # multiprocessing.util.register_after_fork needs an object it can hold a weak reference to
+    pass
+
+
+_WORKER_HOOK = _WorkerHook()
+
+
+def _start_worker(_hook=None):
+    # Runs in every multiprocessing child once it starts (fork and spawn): record from scratch
+    # and write the report when the worker exits normally (not when it is terminated)
+    global _profiler
+    _profiler = None
+    enable()
+    multiprocessing.util.Finalize(None, _write_part, args=(os.path.abspath(os.environ[REPORT_ENV]),),
+                                  exitpriority=10)
+
+
+def _forget_after_fork():
+    # A plain os.fork child keeps no copy of the parent's numbers
+    global _profiler
+    _profiler = None
+
+
+def _enable_from_env():
+    report_path = os.environ.get(REPORT_ENV)
+    if not report_path:
+        return
+    report_path = os.path.abspath(report_path)
+    multiprocessing.util.register_after_fork(_WORKER_HOOK, _start_worker)
+    os.register_at_fork(after_in_child=_forget_after_fork)
+    if os.environ.get(_MAIN_PID_ENV) is not None and not _is_main_process():
+        # Imported by a spawned worker
+        enable()
+        return
+
+    os.environ[_MAIN_PID_ENV] = str(os.getpid())
+    dump_path = os.environ.get(DUMP_ENV) or None
+    profile = None
+    if dump_path is not None:
+        profile = "pyinstrument" if dump_path.endswith((".html", ".txt")) else "cprofile"
+    enable(profile=profile)
+    atexit.register(_write_main, report_path, dump_path)
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        # `kill -USR1 <pid>` writes the report so far without stopping the run
+        signal.signal(signal.SIGUSR1, lambda signum, frame: _write_snapshot(report_path))
+
+
+_enable_from_env()
+
+
+def print_report(data, top=10):
+    """Human-readable summary of a report."""
+    print(f"{data.get('processes', 1)} process(es), {data['wall_seconds']:.2f} s wall")
+    for name, category in sorted(data["categories"].items(), key=lambda x: -x[1]["seconds"]):
+        print(f"  {name:<12}{category['seconds']:10.3f} s  {category['calls']:>10} calls")
+    for name, timer in sorted(data["timers"].items(), key=lambda x: -x[1]["seconds"]):
+        print(f"    {name:<28}{timer['seconds']:10.3f} s  mean {timer['mean'] * 1000:8.2f} ms  "
+              f"max {timer['max'] * 1000:8.2f} ms")
+    for name, n in data["counters"].items():
+        print(f"  {name:<28}{n:>10}")
+    for stage, files in data["files"].items():
+        if not files["count"]:
+            continue
+        print(f"  {stage}: {files['count']} files, mean {files['mean'] * 1000:.2f} ms")
+        for bucket in files["histogram"]:
+            if bucket["count"]:
+                label = f"<= {bucket['le'] * 1000:g} ms" if bucket["le"] is not None else "longer"
+                print(f"    {label:<14}{bucket['count']:>8}")
+        for entry in files["slowest"][:top]:
+            print(f"    {entry['seconds'] * 1000:10.2f} ms  {entry['path']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"Summarize instrumentation reports. Set {REPORT_ENV}=report.json (and optionally "
+                    f"{DUMP_ENV}=run.prof) before running any script to record one.")
+    parser.add_argument("reports", nargs="+", help="Report JSON files; several are merged")
+    parser.add_argument("--top", type=int, default=10, help="Slowest files to list")
+    parser.add_argument("--output", default=None, help="Write the merged report to this JSON file")
+    args = parser.parse_args()
+
+    reports = []
+    for path in args.reports:
+        with open(path, 'r') as f:
+            reports.append(json.load(f))
+    merged = reports[0] if len(reports) == 1 else merge_reports(reports)
+    if args.output is not None:
+        export_json(args.output, merged)
+    print_report(merged, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import argparse
+import json
+import os
+import re
+from dataclasses import dataclass
+from multiprocessing import Pool
+import numpy as np
+from instrumentation import file_timer, timer
+from interface_kdtree import find_interfaces
+from structure_arrays import StructureArrays, read_structure_arrays
+
+# Keys of `*_confidences.json` read by default; contact_probs (as large as pae) is skipped
+DEFAULT_KEYS = ("pae", "atom_plddts", "token_chain_ids", "token_res_ids")
+
+# Arrays that hold only numbers, parsed chunk by chunk into NumPy, and their dtype
+_NUMERIC_KEYS = {"pae": np.float16, "contact_probs": np.float16, "atom_plddts": np.float32,
+                 "token_res_ids": np.int32}
+
+_WHITESPACE = b" \t\r\n"
+_BRACKETS = re.compile(rb"[\[\]]")
+
+# Set once per worker process by _init_worker
+_worker_config = {}
+
+
+class _NumberCollector:
+    # Parses the text of a (nested) number array, fed in pieces, into a flat NumPy array
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.pieces = []
+        self.carry = b""  # A number cut by the end of a chunk
+        self.brackets = 0
+
+    def __call__(self, segment, finished):
+        self.brackets += segment.count(b"[")
+        text = self.carry + segment.translate(None, b"[]")
+        if finished:
+            self.carry = b""
+        else:
+            cut = text.rfind(b",")
+            if cut < 0:
+                self.carry = text
+                return
+            text, self.carry = text[:cut], text[cut + 1:]
+        text = text.strip(b"," + _WHITESPACE)
+        if text:
+            parse_dtype = np.int64 if np.issubdtype(self.dtype, np.integer) else np.float32
+            self.pieces.append(np.fromstring(text.decode(), dtype=parse_dtype, sep=",").astype(self.dtype))
+
+    def array(self) -> np.ndarray:
+        values = np.concatenate(self.pieces) if self.pieces else np.empty(0, dtype=self.dtype)
+        # One bracket for the outer list, plus one per row of a matrix
+        return values.reshape(self.brackets - 1, -1) if self.brackets > 1 else values
+
+
+class _TextCollector:
+    def __init__(self):
+        self.pieces = []
+
+    def __call__(self, segment, finished):
+        self.pieces.append(segment)
+
+    def value(self):
+        return json.loads(b"".join(self.pieces))
+
+
+class _ChunkedObjectReader:
+    # Walks the top-level object of a JSON file whose values are arrays, `chunk_size` bytes at a time
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = b""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.chunk_size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def _next_char(self, skip=_WHITESPACE) -> bytes:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in skip:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def _key(self) -> str:
+        # Keys are short and have no escapes; a refill keeps the buffer from self.pos on
+        while (end := self.buf.find(b'"', self.pos + 1)) < 0:
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+        key = self.buf[self.pos + 1:end].decode()
+        self.pos = end + 1
+        if self._next_char() != b":":
+            raise ValueError(f"Expected ':' after key {key}")
+        self.pos += 1
+        return key
+
+    def _array(self, consume):
+        # Feeds the text of the array at self.pos to consume(segment, finished). Only the
+        # brackets are visited (one per matrix row), so strings in the array must not contain any.
+        depth = 0
+        while True:
+            for match in _BRACKETS.finditer(self.buf, self.pos):
+                depth += 1 if match.group() == b"[" else -1
+                if depth == 0:
+                    consume(self.buf[self.pos:match.end()], True)
+                    self.pos = match.end()
+                    return
+            consume(self.buf[self.pos:], False)
+            self.pos = len(self.buf)
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def _scalar(self):
+        # A top-level value that is not an array; they are short
+        while True:
+            text = self.buf[self.pos:]
+            for end in range(len(text)):
+                if text[end:end + 1] in (b",", b"}") and text[:end].count(b'"') % 2 == 0:
+                    self.pos += end
+                    return json.loads(text[:end])
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON")
+
+    def items(self, keys):
+        """Yield (key, value) of the top-level entries in `keys`; the other values are skipped."""
+        if self._next_char() != b"{":
+            raise ValueError("Expected a JSON object")
+        self.pos += 1
+        while True:
+            c = self._next_char(b"," + _WHITESPACE)
+            if c == b"}":
+                return
+            if c != b'"':
+                raise ValueError(f"Unexpected {c!r} in JSON object")
+            key = self._key()
+            if self._next_char() != b"[":
+                value = self._scalar()
+                if key in keys:
+                    yield key, value
+            elif key not in keys:
+                self._array(lambda segment, finished: None)
+            elif key in _NUMERIC_KEYS:
+                collector = _NumberCollector(keys[key])
+                self._array(collector)
+                yield key, collector.array()
+            else:
+                collector = _TextCollector()
+                self._array(collector)
+                yield key, collector.value()
+
+
+def read_full_confidences(confidences_path, keys=DEFAULT_KEYS, pae_dtype=np.float16, chunk_size=1 << 20) -> dict:
+    """
+    Read the per-token `*_confidences.json` of an AlphaFold3 model without `json.load`.
+
+    The file is read `chunk_size` bytes at a time and the number arrays are parsed straight
+    into NumPy, so the PAE matrix of a large complex never exists as a list of Python floats.
+    Keys that are not requested (by default contact_probs) are skipped without parsing.
+
+    Args:
+        confidences_path (str): `{job}_confidences.json`.
+        keys (tuple): Top-level keys to read, e.g. "pae", "atom_plddts", "token_chain_ids",
+                      "token_res_ids", "atom_chain_ids", "contact_probs".
+        pae_dtype: dtype of the pae and contact_probs matrices (float16 halves their memory).
+        chunk_size (int): Bytes read at a time.
+
+    Returns:
+        dict: key -> np.ndarray for the number arrays (pae and contact_probs as (N, N)),
+              plain lists for the chain ID arrays.
+    """
+    dtypes = {key: pae_dtype if key in ("pae", "contact_probs") else _NUMERIC_KEYS.get(key) for key in keys}
+    with timer("parse.full_confidences"), open(confidences_path, 'rb') as f:
+        return dict(_ChunkedObjectReader(f, chunk_size).items(dtypes))
+
+
+def _mean(values) -> float:
+    return float(np.mean(values, dtype=np.float64)) if values.size else np.nan
+
+
+def interface_scores(confidences, structure: StructureArrays, pairs=(("C", "H"), ("C", "L")), cutoff=5.0) -> dict:
+    """
+    Interface-restricted confidences of one AlphaFold3 model.
+
+    Interface residues are the residues of each chain pair within `cutoff` of the partner
+    chain in the model, as in interface_kdtree.find_interfaces.
+
+    Args:
+        confidences (dict): `read_full_confidences` result with pae, atom_plddts,
+                            token_chain_ids and token_res_ids.
+        structure (StructureArrays): The model, with its atoms in the order of atom_plddts.
+        pairs (tuple): (chain1, chain2) pairs, e.g. antigen against heavy and light chain.
+        cutoff (float): Distance cutoff for the interface (in Ångstroms).
+
+    Returns:
+        dict: For every pair, "n_interface" (interface residues of both chains),
+              "pae_interface" (mean PAE between the interface residues, both directions),
+              "pae_chains" (mean PAE between the whole chains) and "plddt_interface"
+              (mean atom pLDDT of the interface residues). NaN for pairs without interface.
+    """
+    pae = confidences["pae"]
+    plddts = np.asarray(confidences["atom_plddts"], dtype=np.float32)
+    if len(plddts) != len(structure):
+        raise ValueError(f"{len(plddts)} atom pLDDTs for a model of {len(structure)} atoms")
+    token_chains = np.asarray(confidences["token_chain_ids"])
+    tokens = {(chain, str(resi)): i for i, (chain, resi) in
+              enumerate(zip(confidences["token_chain_ids"], np.asarray(confidences["token_res_ids"]).tolist()))}
+
+    scores = {}
+    interfaces = find_interfaces(structure, pairs, cutoff)
+    for (chain1, chain2), interface in interfaces.items():
+        residues1 = interface["chain1_residues"]
+        residues2 = interface["chain2_residues"]
+        tokens1 = [tokens[key] for key in ((chain, resi) for chain, resi, _ in residues1) if key in tokens]
+        tokens2 = [tokens[key] for key in ((chain, resi) for chain, resi, _ in residues2) if key in tokens]
+        chain_tokens1 = np.flatnonzero(token_chains == chain1)
+        chain_tokens2 = np.flatnonzero(token_chains == chain2)
+
+        atoms = np.zeros(len(structure), dtype=bool)
+        for chain, residues in ((chain1, residues1), (chain2, residues2)):
+            atoms |= (structure.chain_ids == chain) & np.isin(structure.resi, [resi for _, resi, _ in residues])
+        scores[(chain1, chain2)] = {
+            "n_interface": len(residues1) + len(residues2),
+            "pae_interface": _mean(np.concatenate([pae[np.ix_(tokens1, tokens2)].ravel(),
+                                                   pae[np.ix_(tokens2, tokens1)].ravel()])),
+            "pae_chains": _mean(np.concatenate([pae[np.ix_(chain_tokens1, chain_tokens2)].ravel(),
+                                                pae[np.ix_(chain_tokens2, chain_tokens1)].ravel()])),
+            "plddt_interface": _mean(plddts[atoms]),
+        }
+    return scores
+
+
+def model_files(folder_path):
+    """Paths of the top-level `*_confidences.json` and `*_model.cif` of one output folder (None if missing)."""
+    confidences_path, model_path = None, None
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith("_confidences.json") and not entry.name.endswith("summary_confidences.json"):
+                confidences_path = entry.path
+            elif entry.name.endswith("_model.cif"):
+                model_path = entry.path
+    return confidences_path, model_path
+
+
+def score_folder(folder_path, pairs=(("C", "H"), ("C", "L")), cutoff=5.0, pae_dtype=np.float16) -> dict:
+    """`interface_scores` of the top-ranked model of an AlphaFold3 output folder."""
+    confidences_path, model_path = model_files(folder_path)
+    if confidences_path is None or model_path is None:
+        raise FileNotFoundError(f"No *_confidences.json or *_model.cif in {folder_path}")
+    confidences = read_full_confidences(confidences_path, pae_dtype=pae_dtype)
+    return interface_scores(confidences, read_structure_arrays(model_path), pairs, cutoff)
+
+
+METRICS = ("n_interface", "pae_interface", "pae_chains", "plddt_interface")
+
+
+@dataclass
+class InterfaceScoreTable:
+    """
+    Interface PAE/pLDDT of every folder of a run, one row per folder and one column per
+    chain pair. Rows of folders that failed are NaN.
+    """
+    folders: np.ndarray          # (N,) str
+    pairs: list                  # [(chain1, chain2)], the columns
+    n_interface: np.ndarray      # (N, P) float32
+    pae_interface: np.ndarray    # (N, P) float32
+    pae_chains: np.ndarray       # (N, P) float32
+    plddt_interface: np.ndarray  # (N, P) float32
+
+    def __len__(self):
+        return len(self.folders)
+
+    @classmethod
+    def from_records(cls, folders, pairs, records) -> "InterfaceScoreTable":
+        """Build from the `interface_scores` dict of every folder (None for failed folders)."""
+        pairs = [tuple(pair) for pair in pairs]
+        columns = {metric: np.full((len(folders), len(pairs)), np.nan, dtype=np.float32) for metric in METRICS}
+        for i, scores in enumerate(records):
+            for j, pair in enumerate(pairs):
+                for metric, column in columns.items():
+                    if scores is not None and pair in scores:
+                        column[i, j] = scores[pair][metric]
+        return cls(np.array(folders, dtype=str), pairs, **columns)
+
+    def column(self, metric, pair) -> np.ndarray:
+        return getattr(self, metric)[:, self.pairs.index(tuple(pair))]
+
+    def best_pae(self) -> np.ndarray:
+        """(N,) lowest interface PAE over the pairs: how well the best-placed chain binds."""
+        values = np.where(np.isnan(self.pae_interface), np.inf, self.pae_interface).min(axis=1, initial=np.inf)
+        return np.where(np.isposinf(values), np.nan, values).astype(np.float32)
+
+    def save(self, path):
+        """Write the table to a compressed `.npz` file."""
+        np.savez_compressed(path, folders=self.folders, pairs=np.array(self.pairs, dtype=str).reshape(-1, 2),
+                            **{metric: getattr(self, metric) for metric in METRICS})
+
+    @classmethod
+    def load(cls, path) -> "InterfaceScoreTable":
+        with np.load(path) as data:
+            return cls(data["folders"], [tuple(pair) for pair in data["pairs"].tolist()],
+                       **{metric: data[metric] for metric in METRICS})
+
+
+def _init_worker(pairs, cutoff, pae_dtype):
+    _worker_config.update(pairs=pairs, cutoff=cutoff, pae_dtype=pae_dtype)
+
+
+def _score_one(folder_path):
+    try:
+        with file_timer("interface_confidences", folder_path):
+            return score_folder(folder_path, **_worker_config), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def score_run(base_path, pairs=(("C", "H"), ("C", "L")), cutoff=5.0, workers=None, chunksize=1,
+              pae_dtype=np.float16) -> InterfaceScoreTable:
+    """
+    Score every AlphaFold3 output folder under `base_path` with a process pool.
+
+    Each worker holds the matrices of one folder at a time and sends back a few numbers, so
+    memory stays bounded by `workers` PAE matrices however large the run is. Folders that
+    fail (e.g. still running) are reported and left as NaN.
+
+    Args:
+        base_path (str): AlphaFold3 output directory.
+        pairs (tuple): (chain1, chain2) pairs to score.
+        cutoff (float): Interface distance cutoff (in Ångstroms).
+        workers (int): Worker processes. Defaults to all CPUs; 1 runs in this process.
+        chunksize (int): Folders handed to a worker at a time.
+        pae_dtype: dtype the PAE matrices are read into.
+
+    Returns:
+        InterfaceScoreTable: One row per folder, sorted by folder name.
+    """
+    pairs = [tuple(pair) for pair in pairs]
+    folders = sorted(folder for folder in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, folder)))
+    paths = [os.path.join(base_path, folder) for folder in folders]
+    config = (pairs, cutoff, pae_dtype)
+
+    if workers == 1 or len(paths) <= 1:
+        _init_worker(*config)
+        results = map(_score_one, paths)
+        records = _collect(paths, results)
+    else:
+        with Pool(workers, initializer=_init_worker, initargs=config) as pool:
+            records = _collect(paths, pool.imap(_score_one, paths, chunksize=chunksize))
+            pool.close()
+            pool.join()
+    return InterfaceScoreTable.from_records(folders, pairs, records)
+
+
+def _collect(paths, results) -> list:
+    records = []
+    for path, (scores, error) in zip(paths, results):
+        if error is not None:
+            print(f"Error processing {path}: {error}")
+        records.append(scores)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interface PAE and pLDDT of every AlphaFold3 model of a run.")
+    parser.add_argument("base_path", nargs="?", default="af_output/")
+    parser.add_argument("--pair", nargs=2, action="append", metavar=("CHAIN1", "CHAIN2"),
+                        help="Chain pair to score; repeat for several (default: C H and C L)")
+    parser.add_argument("--cutoff", type=float, default=5.0, help="Interface distance cutoff in Ångstroms")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument("--float32", action="store_true", help="Read PAE as float32 instead of float16")
+    parser.add_argument("--output", default=None, help="Write the table to this .npz file")
+    parser.add_argument("--top-k", type=int, default=20, help="Print the folders with the lowest interface PAE")
+    args = parser.parse_args()
+
+    pairs = [tuple(pair) for pair in args.pair] if args.pair else [("C", "H"), ("C", "L")]
+    table = score_run(args.base_path, pairs, args.cutoff, args.workers,
+                      pae_dtype=np.float32 if args.float32 else np.float16)
+    if args.output is not None:
+        table.save(args.output)
+
+    best = table.best_pae()
+    order = np.argsort(np.where(np.isnan(best), np.inf, best), kind="stable")[:args.top_k]
+    report = {
+        "folders": len(table),
+        "scored": int((~np.isnan(table.pae_chains).all(axis=1)).sum()),
+        "top": [{"folder": str(table.folders[i]), "best_pae_interface": float(best[i]),
+                 **{f"{metric}:{chain1}-{chain2}": float(table.column(metric, (chain1, chain2))[i])
+                    for metric in METRICS[1:] for chain1, chain2 in pairs}}
+                for i in order],
+    }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
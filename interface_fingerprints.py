@@ -0,0 +1,164 @@
+import argparse
+import json
+from dataclasses import dataclass
+import numpy as np
+from scipy import sparse
+from interface_kdtree import parse_residue_id
+
+
+def _position_key(position):
+    chain, resi = position
+    return chain, parse_residue_id(resi), resi
+
+
+@dataclass
+class InterfaceFingerprints:
+    """
+    Residue contact fingerprints of many designs.
+
+    Each design is a bit vector over antigen x antibody residue positions: bit
+    `a * len(antibody_residues) + b` is set if antigen residue `a` contacts antibody residue `b`.
+    The vectors are kept as the rows of a sparse boolean matrix, since an interface only sets
+    a few dozen of the bits.
+    """
+    names: list
+    antigen_residues: list   # [(chain, resi)], positions of the rows of the contact map
+    antibody_residues: list  # [(chain, resi)], positions of the columns of the contact map
+    matrix: sparse.csr_matrix  # (n_designs, n_antigen * n_antibody) bool
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_contacts(cls, names, contacts) -> "InterfaceFingerprints":
+        """
+        Build the fingerprints from the residue contact pairs of every design.
+
+        Args:
+            names (list): Design names.
+            contacts (list): For every design, ((chain1, resi1), (chain2, resi2)) pairs as
+                returned by interface_kdtree.find_contact_pairs, antigen residue first.
+        """
+        antigen = sorted({tuple(pair[0]) for design in contacts for pair in design}, key=_position_key)
+        antibody = sorted({tuple(pair[1]) for design in contacts for pair in design}, key=_position_key)
+        antigen_index = {position: i for i, position in enumerate(antigen)}
+        antibody_index = {position: i for i, position in enumerate(antibody)}
+
+        indptr = [0]
+        indices = []
+        for design in contacts:
+            bits = sorted({antigen_index[tuple(a)] * len(antibody) + antibody_index[tuple(b)] for a, b in design})
+            indices.extend(bits)
+            indptr.append(len(indices))
+        indices = np.asarray(indices, dtype=np.int64)
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=bool), indices, np.asarray(indptr, dtype=np.int64)),
+                                   shape=(len(contacts), len(antigen) * len(antibody)))
+        return cls(list(names), antigen, antibody, matrix)
+
+    def save(self, path):
+        """Write the fingerprints to a compressed `.npz` file."""
+        np.savez_compressed(path, indptr=self.matrix.indptr, indices=self.matrix.indices,
+                            shape=np.asarray(self.matrix.shape),
+                            meta=np.asarray(json.dumps({"names": self.names,
+                                                        "antigen_residues": self.antigen_residues,
+                                                        "antibody_residues": self.antibody_residues})))
+
+    @classmethod
+    def load(cls, path) -> "InterfaceFingerprints":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            indices = data["indices"]
+            matrix = sparse.csr_matrix((np.ones(len(indices), dtype=bool), indices, data["indptr"]),
+                                       shape=tuple(data["shape"]))
+        return cls(meta["names"], [tuple(p) for p in meta["antigen_residues"]],
+                   [tuple(p) for p in meta["antibody_residues"]], matrix)
+
+    def to_bits(self) -> np.ndarray:
+        """Dense fingerprints packed 8 bits per byte, shape (n_designs, ceil(n_bits / 8))."""
+        return np.packbits(self.matrix.toarray(), axis=1)
+
+    def contact_map(self, i) -> np.ndarray:
+        """Design `i` as an (n_antigen, n_antibody) boolean contact map."""
+        return self.matrix[i].toarray().reshape(len(self.antigen_residues), len(self.antibody_residues))
+
+    def similarity(self, rows=None) -> np.ndarray:
+        """
+        Tanimoto (Jaccard) similarity of the designs in `rows` against all designs.
+
+        Intersections come from one sparse matrix product, so thousands of designs are
+        compared at once. Two designs without any contact have similarity 0.
+
+        Args:
+            rows (slice or array): Designs to compare. Defaults to all of them.
+
+        Returns:
+            np.ndarray: (len(rows), n_designs) float32 similarities.
+        """
+        counts = np.asarray(self.matrix.sum(axis=1)).ravel()
+        x = self.matrix.astype(np.float32)
+        block = x if rows is None else x[rows]
+        block_counts = counts if rows is None else counts[rows]
+        intersection = (block @ x.T).toarray()
+        union = block_counts[:, None] + counts[None, :] - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.where(union > 0, intersection / union, 0.0)
+        return similarity.astype(np.float32)
+
+    def cluster(self, threshold=0.6, block_size=2048):
+        """
+        Butina clustering: repeatedly take the design with the most unassigned neighbors
+        (similarity >= `threshold`) as a representative and assign its neighbors to it.
+
+        Similarities are computed `block_size` rows at a time, so the full N x N matrix is
+        never held in memory.
+
+        Returns:
+            tuple: (labels, representatives). labels[i] is the cluster of design i and
+                   representatives[k] is the index of the representative of cluster k;
+                   clusters are ordered by size, largest first.
+        """
+        n = len(self)
+        neighbors = []
+        for start in range(0, n, block_size):
+            similarity = self.similarity(slice(start, min(start + block_size, n)))
+            neighbors.extend(np.nonzero(row >= threshold)[0] for row in similarity)
+
+        labels = np.full(n, -1, dtype=np.int64)
+        representatives = []
+        for i in sorted(range(n), key=lambda i: -len(neighbors[i])):
+            if labels[i] != -1:
+                continue
+            members = neighbors[i][labels[neighbors[i]] == -1]
+            labels[members] = len(representatives)
+            labels[i] = len(representatives)
+            representatives.append(i)
+
+        # Renumber so that cluster 0 is the largest; ties keep the order they were picked in
+        order = np.argsort(-np.bincount(labels, minlength=len(representatives)), kind='stable')
+        renumber = np.empty_like(order)
+        renumber[order] = np.arange(len(order))
+        return renumber[labels], [representatives[k] for k in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster designs by their interface contact fingerprints.")
+    parser.add_argument("fingerprints", help="Fingerprint .npz written by screen_parallel.py --fingerprints")
+    parser.add_argument("--threshold", type=float, default=0.6, help="Tanimoto similarity for the same cluster")
+    parser.add_argument("--output", default=None, help="Write the design -> cluster table to this JSON file")
+    args = parser.parse_args()
+
+    fingerprints = InterfaceFingerprints.load(args.fingerprints)
+    labels, representatives = fingerprints.cluster(args.threshold)
+    print(f"{len(fingerprints)} designs, {len(representatives)} clusters at Tanimoto >= {args.threshold}")
+    sizes = np.bincount(labels, minlength=len(representatives))
+    for k, i in enumerate(representatives):
+        print(f"{sizes[k]}\t{fingerprints.names[i]}")
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({"representatives": [fingerprints.names[i] for i in representatives],
+                       "clusters": {name: int(label) for name, label in zip(fingerprints.names, labels)}}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
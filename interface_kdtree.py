@@ -0,0 +1,268 @@
+import os
+import re
+import numpy as np
+from scipy.spatial import cKDTree
+from instrumentation import timed, timer
+from structure_arrays import StructureArrays, read_structure_arrays
+
+
+def parse_residue_id(residue):
+    # This function will extract numeric and alphanumeric parts for proper sorting
+    match = re.match(r'(\d+)([A-Za-z]*)', residue)
+    if match:
+        return int(match.group(1)), match.group(2)
+    else:
+        return 0, ""  # Default in case of missing match
+
+
+def _sorted_residues(structure: StructureArrays, atom_indices) -> list:
+    residues = set(zip(structure.chain_ids[atom_indices].tolist(),
+                       structure.resi[atom_indices].tolist(),
+                       structure.resn[atom_indices].tolist()))
+    return sorted(residues, key=lambda x: parse_residue_id(x[1]))
+
+
+def _check_chains(structure: StructureArrays, chain_pairs):
+    present = set(structure.chain_ids.tolist())
+    for chain1, chain2 in chain_pairs:
+        if chain1 not in present or chain2 not in present:
+            raise ValueError(f"One or both chain selections ({chain1}, {chain2}) do not exist.")
+
+
+class NeighborList:
+    """
+    All inter-chain atom pairs of a structure within `max_cutoff`, sorted by distance.
+
+    The neighbor search runs once; the interface at any cutoff up to `max_cutoff` is then
+    a prefix of the sorted pair list, so a cutoff sweep costs about one search.
+
+    Args:
+        structure (StructureArrays): Parsed structure.
+        chain_pairs (list): List of (chain1, chain2) tuples, e.g. [("C", "H"), ("C", "L")].
+        max_cutoff (float): Largest cutoff that will be asked for (in Ångstroms).
+    """
+
+    def __init__(self, structure: StructureArrays, chain_pairs, max_cutoff=5.0):
+        self.structure = structure
+        self.chain_pairs = [tuple(pair) for pair in chain_pairs]
+        self.max_cutoff = max_cutoff
+        self.wanted = sorted({chain for pair in self.chain_pairs for chain in pair})
+        _check_chains(structure, self.chain_pairs)
+
+        with timer("search.kdtree"):
+            atom_indices = np.nonzero(np.isin(structure.chain_ids, self.wanted))[0]
+            chain_codes = np.searchsorted(self.wanted, structure.chain_ids[atom_indices])
+
+            # All atom pairs closer than the cutoff, keeping only the ones between different chains
+            coords = structure.coords[atom_indices].astype(np.float64)
+            pairs = cKDTree(coords).query_pairs(max_cutoff, output_type='ndarray')
+            between = chain_codes[pairs[:, 0]] != chain_codes[pairs[:, 1]]
+            pairs = pairs[between]
+            distances = np.linalg.norm(coords[pairs[:, 0]] - coords[pairs[:, 1]], axis=1)
+            order = np.argsort(distances, kind='stable')
+        self.distances = distances[order]
+        self.atom_i = atom_indices[pairs[order, 0]]
+        self.atom_j = atom_indices[pairs[order, 1]]
+        self.code_i = chain_codes[pairs[order, 0]]
+        self.code_j = chain_codes[pairs[order, 1]]
+
+    @timed("search.residues")
+    def interfaces(self, cutoff=None) -> dict:
+        """Same result as `find_interfaces(structure, chain_pairs, cutoff)`, by slicing."""
+        if cutoff is None:
+            cutoff = self.max_cutoff
+        if cutoff > self.max_cutoff:
+            raise ValueError(f"Cutoff {cutoff} is larger than the neighbor list cutoff {self.max_cutoff}")
+        n = np.searchsorted(self.distances, cutoff, side='right')
+        atom_i, atom_j = self.atom_i[:n], self.atom_j[:n]
+        code_i, code_j = self.code_i[:n], self.code_j[:n]
+
+        results = {}
+        for chain1, chain2 in self.chain_pairs:
+            code1 = self.wanted.index(chain1)
+            code2 = self.wanted.index(chain2)
+            forward = (code_i == code1) & (code_j == code2)
+            backward = (code_i == code2) & (code_j == code1)
+            atoms1 = np.concatenate([atom_i[forward], atom_j[backward]])
+            atoms2 = np.concatenate([atom_j[forward], atom_i[backward]])
+            results[(chain1, chain2)] = {
+                "chain1_residues": _sorted_residues(self.structure, atoms1),
+                "chain2_residues": _sorted_residues(self.structure, atoms2)
+            }
+        return results
+
+    def sweep(self, cutoffs) -> dict:
+        """Map every cutoff in `cutoffs` to its `interfaces(cutoff)` result."""
+        return {cutoff: self.interfaces(cutoff) for cutoff in cutoffs}
+
+
+def find_interfaces(structure: StructureArrays, chain_pairs, cutoff=5.0) -> dict:
+    """
+    Identifies interface residues for several chain pairs with one neighbor search.
+
+    A residue is at the interface if any of its atoms lies within `cutoff` of an atom
+    of the partner chain, which is what `byres (chain X within cutoff of chain Y)` selects.
+
+    Args:
+        structure (StructureArrays): Parsed structure.
+        chain_pairs (list): List of (chain1, chain2) tuples, e.g. [("C", "H"), ("C", "L")].
+        cutoff (float): Distance cutoff for defining the interface (in Ångstroms).
+
+    Returns:
+        dict: Maps each (chain1, chain2) pair to a dictionary with "chain1_residues" and
+              "chain2_residues", in the same format as `find_interface_residues`.
+    """
+    return NeighborList(structure, chain_pairs, cutoff).interfaces(cutoff)
+
+
+# (path, mtime_ns, chain_pairs) -> NeighborList, least recently used first
+_neighbor_lists = {}
+_MAX_NEIGHBOR_LISTS = 64
+
+
+def _cached_neighbor_list(pdb_filename, chain_pairs, max_cutoff) -> NeighborList:
+    key = (pdb_filename, os.stat(pdb_filename).st_mtime_ns, chain_pairs)
+    neighbors = _neighbor_lists.pop(key, None)
+    if neighbors is None or neighbors.max_cutoff < max_cutoff:
+        neighbors = NeighborList(read_structure_arrays(pdb_filename), chain_pairs, max_cutoff)
+    _neighbor_lists[key] = neighbors
+    if len(_neighbor_lists) > _MAX_NEIGHBOR_LISTS:
+        del _neighbor_lists[next(iter(_neighbor_lists))]
+    return neighbors
+
+
+def sweep_interfaces(pdb_filename, chain_pairs, cutoffs=(4.0, 5.0, 6.0, 8.0)) -> dict:
+    """
+    Interface residues of every chain pair at every cutoff in `cutoffs`.
+
+    The file is parsed and searched once at the largest cutoff. The NeighborList is kept in
+    an in-process cache keyed by path and modification time, so later sweeps of the same
+    structure with cutoffs up to that maximum do not touch the file again.
+
+    Args:
+        pdb_filename (str): PDB or mmCIF file.
+        chain_pairs (list): List of (chain1, chain2) tuples, e.g. [("C", "H"), ("C", "L")].
+        cutoffs (iterable): Distance cutoffs (in Ångstroms).
+
+    Returns:
+        dict: {cutoff: {(chain1, chain2): {"chain1_residues": ..., "chain2_residues": ...}}}
+    """
+    chain_pairs = tuple(tuple(pair) for pair in chain_pairs)
+    neighbors = _cached_neighbor_list(pdb_filename, chain_pairs, max(cutoffs))
+    return neighbors.sweep(cutoffs)
+
+
+@timed("search.contacts")
+def find_contact_pairs(structure: StructureArrays, chain_pairs, cutoff=5.0) -> list:
+    """
+    Residue-level contact map: every residue pair with any two atoms within `cutoff`.
+
+    Returns:
+        list: Sorted, unique ((chain1, resi1), (chain2, resi2)) tuples for all chain pairs.
+    """
+    chain_pairs = [tuple(pair) for pair in chain_pairs]
+    _check_chains(structure, chain_pairs)
+    contacts = set()
+    for chain1, chain2 in chain_pairs:
+        index1 = np.nonzero(structure.chain_ids == chain1)[0]
+        index2 = np.nonzero(structure.chain_ids == chain2)[0]
+        pairs = cKDTree(structure.coords[index1]).sparse_distance_matrix(
+            cKDTree(structure.coords[index2]), cutoff, output_type='ndarray')
+        contacts.update(((chain1, resi1), (chain2, resi2)) for resi1, resi2 in zip(
+            structure.resi[index1[pairs['i']]].tolist(), structure.resi[index2[pairs['j']]].tolist()))
+    return sorted(contacts, key=lambda x: (x[0][0], parse_residue_id(x[0][1]), x[1][0], parse_residue_id(x[1][1])))
+
+
+# Tiers of `contact_tier`, cheapest first
+TIERS = ("bbox", "centroid", "atoms")
+
+# Atoms of chain1 tested against chain2's tree per batch in the last tier
+_CONTACT_BATCH = 256
+
+
+def _residue_spheres(coords, resi):
+    # Centroid of each residue and the radius of the sphere around it that holds all its atoms
+    _, inverse = np.unique(resi, return_inverse=True)
+    counts = np.bincount(inverse)
+    centroids = np.zeros((len(counts), 3))
+    np.add.at(centroids, inverse, coords)
+    centroids /= counts[:, None]
+    radii = np.zeros(len(counts))
+    np.maximum.at(radii, inverse, np.linalg.norm(coords - centroids[inverse], axis=1))
+    return centroids, radii, inverse
+
+
+def contact_tier(structure: StructureArrays, chain1, chain2, cutoff=5.0):
+    """
+    Decide whether any atom of `chain1` lies within `cutoff` of an atom of `chain2`,
+    doing as little work as possible.
+
+    Three tiers are tried in order, and each can only reject pairs that really have no contact:
+    "bbox" compares the chain bounding boxes padded by the cutoff; "centroid" compares residue
+    centroids, using each residue's radius as the margin; "atoms" searches the atoms of the
+    residues that survived, and stops at the first contact.
+
+    Returns:
+        str: The tier that rejected the pair, or None if the chains are in contact.
+    """
+    mask1 = structure.chain_ids == chain1
+    mask2 = structure.chain_ids == chain2
+    coords1 = structure.coords[mask1].astype(np.float64)
+    coords2 = structure.coords[mask2].astype(np.float64)
+
+    if np.any(coords1.min(axis=0) - cutoff > coords2.max(axis=0)) or \
+            np.any(coords2.min(axis=0) - cutoff > coords1.max(axis=0)):
+        return "bbox"
+
+    centroids1, radii1, residue1 = _residue_spheres(coords1, structure.resi[mask1])
+    centroids2, radii2, residue2 = _residue_spheres(coords2, structure.resi[mask2])
+    close = cKDTree(centroids1).sparse_distance_matrix(
+        cKDTree(centroids2), cutoff + radii1.max() + radii2.max(), output_type='ndarray')
+    close = close[close['v'] <= radii1[close['i']] + radii2[close['j']] + cutoff]
+    if len(close) == 0:
+        return "centroid"
+
+    atoms1 = coords1[np.isin(residue1, close['i'])]
+    tree2 = cKDTree(coords2[np.isin(residue2, close['j'])])
+    for start in range(0, len(atoms1), _CONTACT_BATCH):
+        distances, _ = tree2.query(atoms1[start:start + _CONTACT_BATCH], k=1, distance_upper_bound=cutoff + 1e-6)
+        if np.any(distances <= cutoff):
+            return None
+    return "atoms"
+
+
+@timed("search.tiered")
+def screen_contacts_tiered(structure: StructureArrays, chain_pairs, cutoff=5.0):
+    """
+    Yes/no version of `find_interfaces`: is any chain pair in contact?
+
+    Pairs are checked with `contact_tier` and the search stops at the first pair in contact.
+
+    Returns:
+        tuple: (hit, tier). `tier` is None for a hit; otherwise it is the most expensive tier
+               needed to reject all pairs (one of TIERS).
+    """
+    chain_pairs = [tuple(pair) for pair in chain_pairs]
+    _check_chains(structure, chain_pairs)
+    worst = 0
+    for chain1, chain2 in chain_pairs:
+        tier = contact_tier(structure, chain1, chain2, cutoff)
+        if tier is None:
+            return True, None
+        worst = max(worst, TIERS.index(tier))
+    return False, TIERS[worst]
+
+
+def screen_structure(pdb_filename, chain_pairs, cutoff=5.0) -> dict:
+    """Parse `pdb_filename` (PDB or mmCIF) once and run `find_interfaces` on it."""
+    return find_interfaces(read_structure_arrays(pdb_filename), chain_pairs, cutoff)
+
+
+def find_interface_residues_kdtree(pdb_filename, chain1, chain2, cutoff=5.0):
+    """
+    Drop-in replacement for `interface_residues.find_interface_residues` that does not need PyMOL.
+
+    Returns:
+        dict: A dictionary containing residues from both chains at the interface.
+    """
+    return screen_structure(pdb_filename, [(chain1, chain2)], cutoff)[(chain1, chain2)]
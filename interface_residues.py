@@ -1,6 +1,6 @@
-from pymol import cmd
-import re
 import os
+from instrumentation import file_timer, timer
+from interface_kdtree import parse_residue_id, screen_structure
 
 def find_interface_residues(pdb_filename, chain1, chain2, cutoff=5.0):
     """
@@ -14,7 +14,13 @@ def find_interface_residues(pdb_filename, chain1, chain2, cutoff=5.0):
     Returns:
         dict: A dictionary containing residues from both chains at the interface.
     """
-    cmd.load(pdb_filename)
+    try:
+        from pymol import cmd
+    except ImportError:
+        raise ImportError("engine='pymol' needs PyMOL; the default 'kdtree' engine does not")
+
+    with timer("parse.pymol"):
+        cmd.load(pdb_filename)
     # print("chains:", cmd.get_chains())
     # for chain in ['A', 'B', 'C', 'D', 'E']:
     #     seq = cmd.get_fastastr(f'chain {chain}')
@@ -30,21 +36,14 @@ def find_interface_residues(pdb_filename, chain1, chain2, cutoff=5.0):
         raise ValueError(f"One or both chain selections ({chain1}, {chain2}) do not exist.")
     
     # Identify atoms within the cutoff distance
-    cmd.select("interface_atoms1", f"byres ({selection1} within {cutoff} of {selection2})")
-    cmd.select("interface_atoms2", f"byres ({selection2} within {cutoff} of {selection1})")
+    with timer("select.pymol"):
+        cmd.select("interface_atoms1", f"byres ({selection1} within {cutoff} of {selection2})")
+        cmd.select("interface_atoms2", f"byres ({selection2} within {cutoff} of {selection1})")
     
     # Extract residues from the interface selections
-    interface_residues1 = cmd.get_model("interface_atoms1")
-    interface_residues2 = cmd.get_model("interface_atoms2")
-    
-    # Helper function to handle sorting of residues
-    def parse_residue_id(residue):
-        # This function will extract numeric and alphanumeric parts for proper sorting
-        match = re.match(r'(\d+)([A-Za-z]*)', residue)
-        if match:
-            return int(match.group(1)), match.group(2)
-        else:
-            return 0, ""  # Default in case of missing match
+    with timer("select.pymol_get_model"):
+        interface_residues1 = cmd.get_model("interface_atoms1")
+        interface_residues2 = cmd.get_model("interface_atoms2")
     
     # Parse residue information
     residues1 = {(res.chain, res.resi, res.resn) for res in interface_residues1.atom}
@@ -63,6 +62,27 @@ def find_interface_residues(pdb_filename, chain1, chain2, cutoff=5.0):
     }
 
 
+def find_interface_residues_pairs(pdb_filename, chain_pairs, cutoff=5.0, engine="kdtree"):
+    """
+    Identifies interface residues for several chain pairs of one structure.
+
+    Parameters:
+        pdb_filename (str): Path to the structure.
+        chain_pairs (list): List of (chain1, chain2) tuples.
+        cutoff (float): Distance cutoff for defining the interface (in Ångstroms).
+        engine (str): "kdtree" parses the file once and answers every pair from one
+            neighbor search; "pymol" calls `find_interface_residues` once per pair.
+
+    Returns:
+        dict: Maps each (chain1, chain2) pair to the result of `find_interface_residues`.
+    """
+    if engine == "kdtree":
+        return screen_structure(pdb_filename, chain_pairs, cutoff)
+    elif engine == "pymol":
+        return {(chain1, chain2): find_interface_residues(pdb_filename, chain1, chain2, cutoff)
+                for chain1, chain2 in chain_pairs}
+    raise ValueError(f"Unknown engine: {engine}")
+
 
 # Example Usage
 if __name__ == "__main__":
@@ -96,12 +116,16 @@ if __name__ == "__main__":
     chain3_id = "L"
     chain3_name = 'L'
     cutoff_distance = 5.0
+    engine = "kdtree"  # or "pymol"
     
     output_paths = []
     for i, pdb_path in enumerate(pdb_paths):
         # print(f"**** {i + 1} ****")
 
-        result = find_interface_residues(pdb_path, chain1_id, chain2_id, cutoff_distance)
+        with file_timer("interface_residues", pdb_path):
+            results = find_interface_residues_pairs(
+                pdb_path, [(chain1_id, chain2_id), (chain1_id, chain3_id)], cutoff_distance, engine)
+        result = results[(chain1_id, chain2_id)]
 
         if result["chain1_residues"]:
             print(f"path: {pdb_path}")
@@ -117,7 +141,7 @@ if __name__ == "__main__":
                 # print(f"Chain {chain} Residue {resn} ({resi})")
                 print(f"{resn} ({resi})")
 
-        result = find_interface_residues(pdb_path, chain1_id, chain3_id, cutoff_distance)
+        result = results[(chain1_id, chain3_id)]
 
         if result["chain1_residues"]:
             print(f"path: {pdb_path}")
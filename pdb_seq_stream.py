@@ -0,0 +1,170 @@
+import math
+import numpy as np
+
+# The 20 standard amino acids accepted by PPBuilder
+THREE_TO_ONE = {
+    "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C",
+    "GLN": "Q", "GLU": "E", "GLY": "G", "HIS": "H", "ILE": "I",
+    "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P",
+    "SER": "S", "THR": "T", "TRP": "W", "TYR": "Y", "VAL": "V",
+}
+
+# PPBuilder's maximum C--N peptide bond length
+MAX_PEPTIDE_BOND = 1.8
+
+
+class _ChainState:
+    """Running state of one chain: the previous residue and the peptides built so far."""
+
+    def __init__(self):
+        self.prev = None  # (residue key, resname, {altloc: C xyz})
+        self.current = None  # (residue key, resname, {altloc: N xyz}, {altloc: C xyz})
+        self.prev_in_peptide = False
+        self.pieces = []
+
+    def add_atom(self, key, resname, atom_name, altloc, xyz):
+        if self.current is None or self.current[0] != key:
+            self.finish_residue()
+            self.current = (key, resname, {}, {})
+        if atom_name == "N":
+            self.current[2].setdefault(altloc, xyz)
+        elif atom_name == "C":
+            self.current[3].setdefault(altloc, xyz)
+
+    def finish_residue(self):
+        if self.current is None:
+            return
+        key, resname, n_atoms, c_atoms = self.current
+        self.current = None
+        accepted = resname in THREE_TO_ONE
+        if self.prev is not None and accepted and _is_connected(self.prev[2], n_atoms):
+            if not self.prev_in_peptide:
+                self.pieces.append(THREE_TO_ONE[self.prev[1]])
+            self.pieces.append(THREE_TO_ONE[resname])
+            self.prev_in_peptide = True
+        else:
+            self.prev_in_peptide = False
+        # Like PPBuilder, an unwanted residue still becomes the previous residue and breaks the peptide
+        self.prev = (key, resname, c_atoms) if accepted else None
+
+    def sequence(self) -> str:
+        self.finish_residue()
+        return "".join(self.pieces)
+
+
+def _is_connected(c_atoms, n_atoms) -> bool:
+    # Same rule as PPBuilder: some C/N altloc pair with matching or blank altlocs within the bond length
+    for n_altloc, n_xyz in n_atoms.items():
+        for c_altloc, c_xyz in c_atoms.items():
+            if n_altloc == c_altloc or n_altloc == " " or c_altloc == " ":
+                if math.dist(n_xyz, c_xyz) < MAX_PEPTIDE_BOND:
+                    return True
+    return False
+
+
+def _hetero_flag(record, resname):
+    if record == "ATOM  ":
+        return " "
+    if resname in ("HOH", "WAT"):
+        return "W"
+    return "H_" + resname
+
+
+def _seqres_sequences(seqres, chain_ids) -> dict:
+    return {chain_id: "".join(THREE_TO_ONE.get(resname, "X") for resname in resnames)
+            for chain_id, resnames in seqres.items()
+            if chain_ids is None or chain_id in chain_ids}
+
+
+def iter_chain_sequences(pdb_filename, chain_ids=None, source="atoms"):
+    """
+    Read chain sequences from a PDB file in one pass, without building a Bio.PDB structure.
+
+    With source="atoms" the sequence is built from the backbone N/CA/C records of the first
+    model and is the same as joining the peptides from PPBuilder: only the 20 standard amino
+    acids are kept, and a residue that is not peptide-bonded to either neighbour is dropped.
+    With source="seqres" the SEQRES records are used for the chains that have them, and the
+    remaining chains fall back to the atom records.
+
+    Args:
+        pdb_filename (str): Path to the PDB file.
+        chain_ids (iterable): Only return these chains. Defaults to all chains.
+        source (str): "atoms" or "seqres".
+
+    Yields:
+        tuple: (chain_id, sequence) for every chain with a non-empty sequence,
+               in the order the chains appear in the file.
+    """
+    if source not in ("atoms", "seqres"):
+        raise ValueError(f"Unknown sequence source: {source}")
+    if chain_ids is not None:
+        chain_ids = set(chain_ids)
+
+    seqres = {}
+    states = {}
+    with open(pdb_filename, 'r') as f:
+        for line in f:
+            record = line[:6]
+            if record == "ATOM  " or record == "HETATM":
+                atom_name = line[12:16].strip()
+                if atom_name != "N" and atom_name != "CA" and atom_name != "C":
+                    continue
+                chain_id = line[21]
+                if chain_ids is not None and chain_id.strip() not in chain_ids:
+                    continue
+                if source == "seqres" and chain_id in seqres:
+                    continue
+                resname = line[17:20].strip()
+                key = (_hetero_flag(record, resname), line[22:26], line[26])
+                xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+                state = states.get(chain_id)
+                if state is None:
+                    state = states[chain_id] = _ChainState()
+                state.add_atom(key, resname, atom_name, line[16], xyz)
+            elif record == "SEQRES" and source == "seqres":
+                seqres.setdefault(line[11], []).extend(line[19:].split())
+            elif record == "ENDMDL":
+                break
+
+    from_seqres = _seqres_sequences(seqres, chain_ids) if source == "seqres" else {}
+    for chain_id in dict.fromkeys(list(seqres if source == "seqres" else ()) + list(states)):
+        if chain_id in from_seqres:
+            sequence = from_seqres[chain_id]
+        else:
+            sequence = states[chain_id].sequence()
+        if sequence:
+            yield chain_id.strip(), sequence
+
+
+def read_chain_sequences(pdb_filename, chain_ids=None, source="atoms") -> dict:
+    """Return `iter_chain_sequences` as a {chain_id: sequence} dictionary."""
+    return dict(iter_chain_sequences(pdb_filename, chain_ids, source))
+
+
+def sequences_from_arrays(structure, chain_ids=None) -> dict:
+    """
+    Same as `read_chain_sequences(..., source="atoms")`, but for an already loaded
+    structure_arrays.StructureArrays (e.g. from a structure_store.StructureStore).
+    """
+    backbone = np.isin(structure.atom_names, ("N", "CA", "C"))
+    if chain_ids is not None:
+        backbone &= np.isin(structure.chain_ids, list(chain_ids))
+    index = np.nonzero(backbone)[0]
+
+    states = {}
+    for chain_id, resn, resi, hetero, atom_name, altloc, xyz in zip(
+            structure.chain_ids[index].tolist(), structure.resn[index].tolist(), structure.resi[index].tolist(),
+            structure.hetero[index].tolist(), structure.atom_names[index].tolist(),
+            structure.altlocs[index].tolist(), structure.coords[index].astype(float).tolist()):
+        key = (_hetero_flag("HETATM" if hetero else "ATOM  ", resn), resi)
+        state = states.get(chain_id)
+        if state is None:
+            state = states[chain_id] = _ChainState()
+        state.add_atom(key, resn, atom_name, altloc or " ", tuple(xyz))
+
+    sequences = {}
+    for chain_id, state in states.items():
+        sequence = state.sequence()
+        if sequence:
+            sequences[chain_id] = sequence
+    return sequences
@@ -0,0 +1,385 @@
+import argparse
+import json
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from typing import Callable
+
+from convert_to_alphafold_input import ABCChains, convert_to_alphafold_input_one_fasta, load_precomputed_msas
+from design_watcher import DEFAULT_CHECKPOINT_PATH, DesignWatcher, WatchCheckpoint
+from instrumentation import timer
+from screen_parallel import iter_structure_files
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of the pipeline, applied to every candidate.
+
+    `fn` takes a candidate dict and returns the updated dict, or None to drop the candidate
+    (e.g. a design that does not touch the antigen). It must be a picklable top-level
+    function (or a functools.partial of one) when `workers > 0`.
+
+    Args:
+        name (str): Stage name, used in `after` and in the results.
+        fn (callable): Candidate -> candidate or None.
+        workers (int): Worker processes for this stage; 0 runs it in a thread of the runner.
+        after (list): Names of the stages whose output feeds this stage. Empty for the stages
+            that read the input candidates.
+    """
+    name: str
+    fn: Callable
+    workers: int = 1
+    after: list = field(default_factory=list)
+
+
+@dataclass
+class StageResult:
+    stage: str
+    item: dict
+    error: str = None
+    dropped: bool = False  # The stage returned None for the item (report_drops=True only)
+
+
+def _init_stage_worker():
+    # Ctrl-C goes to the whole process group; the runner stops the pools itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call_stage(fn, item, name=None):
+    try:
+        with timer(f"stage.{name}"):
+            return fn(item), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+class Pipeline:
+    """
+    Streams candidates through a DAG of stages.
+
+    Every stage has a bounded input queue and its own worker pool, so a candidate moves to
+    the next stage as soon as it is done instead of waiting for the whole tree. A stage sends
+    its output to every stage that lists it in `after`; the output of stages nobody depends on
+    (the sinks) and every error are yielded by `run`.
+
+    Args:
+        stages (list): Stage objects. Must form a DAG.
+        queue_size (int): Capacity of each stage's input queue and of its in-flight window.
+        report_drops (bool): Also yield the candidates a stage dropped, with `dropped=True`, so
+            every input of a linear pipeline comes out exactly once.
+    """
+
+    def __init__(self, stages, queue_size=64, report_drops=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.queue_size = queue_size
+        self.report_drops = report_drops
+        for stage in stages:
+            for parent in stage.after:
+                if parent not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {parent}")
+        self._check_acyclic()
+        self.children = {name: [child.name for child in stages if name in child.after] for name in self.stages}
+
+    def _check_acyclic(self):
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stages form a cycle through {name}")
+            visiting.add(name)
+            for parent in self.stages[name].after:
+                visit(parent)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def run(self, items):
+        """
+        Feed `items` (candidate dicts) to the source stages and yield StageResult objects
+        for sink outputs and errors as they happen.
+        """
+        inputs = {name: queue.Queue(self.queue_size) for name in self.stages}
+        results = queue.Queue()
+        executors = {name: ProcessPoolExecutor(stage.workers, initializer=_init_stage_worker)
+                     for name, stage in self.stages.items() if stage.workers > 0}
+        threads = []
+
+        for name, stage in self.stages.items():
+            in_flight = queue.Queue(max(self.queue_size, stage.workers * 2))
+            n_parents = max(len(stage.after), 1)
+            threads.append(threading.Thread(target=self._submit, daemon=True,
+                                            args=(stage, executors.get(name), inputs[name], in_flight, n_parents)))
+            threads.append(threading.Thread(target=self._collect, daemon=True,
+                                            args=(stage, in_flight, inputs, results)))
+        for thread in threads:
+            thread.start()
+
+        def feed():
+            sources = [name for name, stage in self.stages.items() if not stage.after]
+            for item in items:
+                for name in sources:
+                    inputs[name].put(item)
+            for name in sources:
+                inputs[name].put(_DONE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        try:
+            n_finished = 0
+            while n_finished < len(self.stages):
+                result = results.get()
+                if result is _DONE:
+                    n_finished += 1
+                else:
+                    yield result
+        finally:
+            for executor in executors.values():
+                executor.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _submit(stage, executor, inputs, in_flight, n_parents):
+        n_done = 0
+        while n_done < n_parents:
+            item = inputs.get()
+            if item is _DONE:
+                n_done += 1
+                continue
+            if executor is None:
+                future = Future()
+                future.set_result(_call_stage(stage.fn, item, stage.name))
+            else:
+                try:
+                    future = executor.submit(_call_stage, stage.fn, item, stage.name)
+                except Exception as e:
+                    # The pool is broken (a worker died); the item fails instead of the stage
+                    future = Future()
+                    future.set_exception(e)
+            # Blocks when the stage already has a full window of candidates in flight
+            in_flight.put((item, future))
+        in_flight.put(_DONE)
+
+    def _collect(self, stage, in_flight, inputs, results):
+        children = self.children[stage.name]
+        try:
+            while True:
+                entry = in_flight.get()
+                if entry is _DONE:
+                    break
+                item, future = entry
+                try:
+                    output, error = future.result()
+                except Exception as e:
+                    # e.g. BrokenProcessPool after a worker died; the items still in flight fail the same way
+                    output, error = None, f"{type(e).__name__}: {e}"
+                if error is not None:
+                    results.put(StageResult(stage.name, item, error))
+                elif output is None:
+                    if self.report_drops:
+                        results.put(StageResult(stage.name, item, dropped=True))
+                else:
+                    if children:
+                        for child in children:
+                            inputs[child].put(output)
+                    else:
+                        results.put(StageResult(stage.name, output))
+        finally:
+            for child in children:
+                inputs[child].put(_DONE)
+            results.put(_DONE)
+
+
+def screen_candidate(item, chain_pairs, cutoff=5.0, report_dir=None):
+    """Keep the candidate if chain1 touches any partner chain; adds "interfaces"."""
+    from interface_kdtree import find_interfaces, screen_contacts_tiered
+    from structure_arrays import read_structure_arrays
+    structure = read_structure_arrays(item["path"])
+    # Designs that miss the antigen are dropped by the cheap tiers before the full search
+    hit, _ = screen_contacts_tiered(structure, chain_pairs, cutoff)
+    if not hit:
+        return None
+    interfaces = find_interfaces(structure, chain_pairs, cutoff)
+    item = dict(item, interfaces=[[chain1, chain2, result] for (chain1, chain2), result in interfaces.items()])
+    if report_dir is not None:
+        output_path = os.path.join(report_dir, os.path.splitext(item["name"])[0] + ".interface.json")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(item["interfaces"], f)
+    return item
+
+
+def extract_candidate_sequences(item, H_name='H', L_name='L', fasta_dir=None):
+    """Adds the "H" and "L" sequences; drops the candidate if either chain is missing."""
+    from extract_chains_seq import read_sequences
+    sequences = read_sequences(item["path"], [H_name, L_name], backend="stream")
+    if H_name not in sequences or L_name not in sequences:
+        return None
+    item = dict(item, H=sequences[H_name], L=sequences[L_name])
+    if fasta_dir is not None:
+        output_path = os.path.join(fasta_dir, os.path.splitext(item["name"])[0] + ".fasta")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as f:
+            f.write(f">{os.path.basename(item['path'])}_H\n{item['H']}\n")
+            f.write(f">{os.path.basename(item['path'])}_L\n{item['L']}\n")
+    return item
+
+
+@lru_cache(maxsize=None)
+def _precomputed_msas(precomputed_path) -> dict:
+    # The MSA JSON is large; each process reads it once, not once per candidate
+    return load_precomputed_msas(precomputed_path)
+
+
+def write_af3_job(item, output_base, chainA, chainB, chainC, copies=1, precomputed_path=None):
+    """Writes the AlphaFold3 input JSON of the candidate; adds "af3_input"."""
+    # Named after the whole flattened path, like the deduplicated runs of convert_folder: DiffAb run
+    # directories contain a '.' (`<input>.pdb_<timestamp>`), so cutting at the first '.' would give
+    # every sample of a run the same job name
+    job_name = os.path.join(os.path.basename(output_base), os.path.splitext(item["name"])[0]).replace('/', '__')
+    output_path = os.path.join(output_base, job_name + ".json")
+    precomputed = _precomputed_msas(precomputed_path) if precomputed_path is not None else None
+    chains = ABCChains(name=job_name, chainA=chainA, chainB=chainB, chainC=chainC)
+    convert_to_alphafold_input_one_fasta(output_path, chains, item["H"], item["L"], copies, precomputed)
+    return dict(item, af3_input=output_path)
+
+
+def iter_candidates(input_base, extensions=(".pdb", ".cif")):
+    """Candidate dicts for every structure under `input_base`, found lazily while walking."""
+    for path in iter_structure_files(input_base, extensions):
+        yield {"path": path, "name": os.path.relpath(path, input_base)}
+
+
+def iter_watched_candidates(input_base, watcher):
+    """Candidate dicts for every file a design_watcher.DesignWatcher reports as completely written."""
+    for path, st in watcher:
+        yield {"path": path, "name": os.path.relpath(path, input_base), "size": st.st_size,
+               "mtime_ns": st.st_mtime_ns}
+
+
+def build_design_pipeline(af3_output_base, chainA, chainB, chainC, antigen="C", H_name='H', L_name='L',
+                          cutoff=5.0, copies=1, precomputed_path=None, report_dir=None, fasta_dir=None,
+                          screen_workers=4, sequence_workers=2, json_workers=0, queue_size=64,
+                          report_drops=False) -> Pipeline:
+    """
+    The DiffAb -> AlphaFold3 part of the workflow as a Pipeline:
+    screen (antigen vs H and L) -> H/L sequence extraction -> AF3 input JSON.
+
+    Only the AF3 JSON is written by default; `report_dir` and `fasta_dir` also write the
+    interface residues and the FASTA of every candidate that passes the screen.
+    """
+    chain_pairs = [(antigen, H_name), (antigen, L_name)]
+    return Pipeline([
+        Stage("screen", partial(screen_candidate, chain_pairs=chain_pairs, cutoff=cutoff, report_dir=report_dir),
+              workers=screen_workers),
+        Stage("sequences", partial(extract_candidate_sequences, H_name=H_name, L_name=L_name, fasta_dir=fasta_dir),
+              workers=sequence_workers, after=["screen"]),
+        Stage("af3_json", partial(write_af3_job, output_base=af3_output_base, chainA=chainA, chainB=chainB,
+                                  chainC=chainC, copies=copies, precomputed_path=precomputed_path),
+              workers=json_workers, after=["sequences"]),
+    ], queue_size=queue_size, report_drops=report_drops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream DiffAb designs through screen -> sequences -> AF3 input.")
+    parser.add_argument("input_base", help="DiffAb results tree")
+    parser.add_argument("output_base", help="Directory for the AlphaFold3 input JSON files")
+    parser.add_argument("--config", default=None,
+                        help="JSON file with chainA, chainB, chainC (and optionally any other option below, "
+                             "e.g. \"screen_workers\": 8); options on the command line take precedence")
+    parser.add_argument("--chainA")
+    parser.add_argument("--chainB")
+    parser.add_argument("--chainC")
+    parser.add_argument("--antigen", default="C")
+    parser.add_argument("--heavy", default="H", help="Heavy chain ID in the DiffAb designs")
+    parser.add_argument("--light", default="L", help="Light chain ID in the DiffAb designs")
+    parser.add_argument("--cutoff", type=float, default=5.0)
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--precomputed", default=None, help="AF3 *_data.json with the A/B/C MSAs and templates")
+    parser.add_argument("--report-dir", default=None, help="Also write the interface residues of every hit")
+    parser.add_argument("--fasta-dir", default=None, help="Also write the H/L FASTA of every hit")
+    parser.add_argument("--screen-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sequence-workers", type=int, default=2)
+    parser.add_argument("--json-workers", type=int, default=0)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep watching input_base and process designs as soon as DiffAb has written them")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH,
+                        help="With --watch, SQLite record of the finished files, so restarts resume")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="With --watch, seconds a file must stay unchanged before it is read")
+    parser.add_argument("--poll", action="store_true", help="With --watch, walk the tree instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="With --watch, stop after this many seconds without a new design")
+    parser.add_argument("--retry-errors", action="store_true", help="With --watch, retry files that failed before")
+    args = parser.parse_args()
+
+    if args.config is not None:
+        with open(args.config, 'r') as f:
+            config = {key.replace('-', '_'): value for key, value in json.load(f).items()}
+        unknown = sorted(key for key in config if key not in vars(args) or key == "config")
+        if unknown:
+            parser.error(f"Unknown options in {args.config}: {', '.join(unknown)}")
+        # Config values become the defaults, so the command line still wins
+        parser.set_defaults(**config)
+        args = parser.parse_args()
+    if not (args.chainA and args.chainB and args.chainC):
+        parser.error("chainA, chainB and chainC are required (on the command line or in --config)")
+
+    pipeline = build_design_pipeline(
+        args.output_base, args.chainA, args.chainB, args.chainC, antigen=args.antigen,
+        H_name=args.heavy, L_name=args.light, cutoff=args.cutoff,
+        copies=args.copies, precomputed_path=args.precomputed, report_dir=args.report_dir,
+        fasta_dir=args.fasta_dir, screen_workers=args.screen_workers, sequence_workers=args.sequence_workers,
+        json_workers=args.json_workers, queue_size=args.queue_size, report_drops=args.watch)
+
+    checkpoint = None
+    if args.watch:
+        checkpoint = WatchCheckpoint(args.checkpoint)
+        watcher = DesignWatcher(args.input_base, settle=args.settle, poll_interval=args.poll_interval,
+                                mode="poll" if args.poll else "auto", idle_timeout=args.idle_timeout,
+                                skip=lambda path, st: checkpoint.is_done(path, st, args.retry_errors))
+        items = iter_watched_candidates(args.input_base, watcher)
+    else:
+        items = iter_candidates(args.input_base)
+
+    n_jobs, n_errors, n_dropped = 0, 0, 0
+    try:
+        for result in pipeline.run(items):
+            if result.error is not None:
+                n_errors += 1
+                print(f"Error in {result.stage} for {result.item['path']}: {result.error}")
+                status, detail = "error", f"{result.stage}: {result.error}"
+            elif result.dropped:
+                n_dropped += 1
+                status, detail = "dropped", result.stage
+            else:
+                n_jobs += 1
+                print(f"AF3 input: {result.item['af3_input']}")
+                status, detail = "af3_job", result.item["af3_input"]
+            if checkpoint is not None:
+                checkpoint.mark(result.item["path"], result.item["size"], result.item["mtime_ns"], status, detail)
+    except KeyboardInterrupt:
+        print("Interrupted; designs still in flight are processed again on the next run")
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    if args.watch:
+        print(f"{n_jobs} AF3 jobs written, {n_dropped} designs screened out, {n_errors} errors")
+    else:
+        print(f"{n_jobs} AF3 jobs written, {n_errors} errors")
+
+
+if __name__ == "__main__":
+    main()
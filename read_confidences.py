@@ -1,7 +1,14 @@
 import os
 import json
+import re
+import sqlite3
+from convert_to_alphafold_input import load_manifest, sanitised_job_name
+from instrumentation import count, file_timer, timer
 
-def read_high_confidences(base_path: str) -> dict:
+# Added by AlphaFold3 to an output folder name when the folder already exists
+_TIMESTAMP_SUFFIX = re.compile(r"_\d{8}_\d{6}$")
+
+def read_high_confidences(base_path: str, manifest_path: str = None) -> dict:
     """
     Reads JSON files from subfolders and checks if entries at indexes [2][3] and [2][4]
     of the "my_key" matrix are both greater than 0.7.
@@ -10,6 +17,9 @@ def read_high_confidences(base_path: str) -> dict:
 
     Args:
         base_path (str): The path to the base folder containing subfolders.
+        manifest_path (str): Optional dedup manifest from convert_to_alphafold_input.convert_folder.
+            Each result is then also reported under the output folder name of every
+            duplicate candidate that was not folded.
 
     Returns:
         dict: A dictionary where keys are folder names and values are tuples containing the pair of numbers
@@ -18,57 +28,281 @@ def read_high_confidences(base_path: str) -> dict:
     result = {}
 
     # Iterate through subfolders
-    for subfolder in os.listdir(base_path):
+    with timer("walk.listdir"):
+        subfolders = os.listdir(base_path)
+    for subfolder in subfolders:
         subfolder_path = os.path.join(base_path, subfolder)
 
         # Check if it's a directory
         if os.path.isdir(subfolder_path):
             summary_values = None
             additional_data = None
+            count("folders.read")
+            with file_timer("read_confidences", subfolder_path):
+                # Find the JSON files
+                with timer("walk.listdir"):
+                    file_names = os.listdir(subfolder_path)
+                for file_name in file_names:
+                    json_path = os.path.join(subfolder_path, file_name)
+
+                    if file_name.endswith("summary_confidences.json"):
+                        try:
+                            # Read and parse the JSON file
+                            with timer("parse.summary_json"), open(json_path, 'r') as json_file:
+                                data = json.load(json_file)
+                                matrix = data.get("chain_pair_iptm", [])
+
+                                # Ensure the matrix has valid dimensions
+                                if len(matrix) > 2 and len(matrix[2]) > 4:
+                                    value_23 = matrix[2][3]
+                                    value_24 = matrix[2][4]
 
-            # Find the JSON files
-            for file_name in os.listdir(subfolder_path):
-                json_path = os.path.join(subfolder_path, file_name)
-
-                if file_name.endswith("summary_confidences.json"):
-                    try:
-                        # Read and parse the JSON file
-                        with open(json_path, 'r') as json_file:
-                            data = json.load(json_file)
-                            matrix = data.get("chain_pair_iptm", [])
-
-                            # Ensure the matrix has valid dimensions
-                            if len(matrix) > 2 and len(matrix[2]) > 4:
-                                value_23 = matrix[2][3]
-                                value_24 = matrix[2][4]
-
-                                # Check if both values are greater than 0.7
-                                if value_23 >= 0.8 or value_24 >= 0.8:
-                                    summary_values = (value_23, value_24)
-                    except (json.JSONDecodeError, KeyError, IOError) as e:
-                        print(f"Error reading file {json_path}: {e}")
-
-                elif file_name.endswith("data.json"):
-                    try:
-                        with open(json_path, 'r') as json_file:
-                            additional_data = json.load(json_file)
-                            additional_data = additional_data["sequences"]
-                            # assert False
-                            # print(additional_data[0]["protein"]["sequence"])
-                            # assert False
-
-                            additional_data = {data["protein"]["id"]: data["protein"]["sequence"] for data in additional_data}
-                            # print(additional_data)
-                    except (json.JSONDecodeError, IOError) as e:
-                        print(f"Error reading file {json_path}: {e}")
-                    except TypeError as e:
-                        print(f"Unexpected error reading file {json_path}")
+                                    # Check if both values are greater than 0.7
+                                    if value_23 >= 0.8 or value_24 >= 0.8:
+                                        summary_values = (value_23, value_24)
+                        except (json.JSONDecodeError, KeyError, IOError) as e:
+                            print(f"Error reading file {json_path}: {e}")
+
+                    elif file_name.endswith("data.json"):
+                        try:
+                            with timer("parse.data_json"), open(json_path, 'r') as json_file:
+                                additional_data = json.load(json_file)
+                                additional_data = additional_data["sequences"]
+                                # assert False
+                                # print(additional_data[0]["protein"]["sequence"])
+                                # assert False
+
+                                additional_data = {data["protein"]["id"]: data["protein"]["sequence"] for data in additional_data}
+                                # print(additional_data)
+                        except (json.JSONDecodeError, IOError) as e:
+                            print(f"Error reading file {json_path}: {e}")
+                        except TypeError as e:
+                            print(f"Unexpected error reading file {json_path}")
 
             if summary_values is not None:
+                count("folders.selected")
                 result[subfolder] = (*summary_values, additional_data)
 
+    if manifest_path is not None:
+        result = fan_out_aliases(result, load_manifest(manifest_path))
+
     return result
 
-# Example usage
-base_path = "af_output/"
-print(json.dumps(read_high_confidences(base_path), indent=4))
+
+def fan_out_aliases(result: dict, manifest: dict) -> dict:
+    """
+    Copy each result of a deduplicated job to the folder names of its aliases.
+
+    AlphaFold3 names an output folder after the sanitised job name, optionally followed by
+    a `_YYYYMMDD_HHMMSS` timestamp suffix; the alias keeps the same suffix.
+    """
+    canonical_names = {}
+    for job, info in manifest["jobs"].items():
+        name = sanitised_job_name(job)
+        if name in canonical_names:
+            raise ValueError(f"Two jobs of the manifest share the AlphaFold3 name {name}")
+        canonical_names[name] = [sanitised_job_name(alias) for alias in info["aliases"]]
+    fanned_out = {}
+    for subfolder, value in result.items():
+        fanned_out[subfolder] = value
+        job, suffix = subfolder, ""
+        match = _TIMESTAMP_SUFFIX.search(subfolder)
+        if job not in canonical_names and match is not None:
+            job, suffix = subfolder[:match.start()], match.group()
+        for alias in canonical_names.get(job, []):
+            fanned_out.setdefault(alias + suffix, value)
+    return fanned_out
+
+
+def expand_chain_ids(sequences) -> list:
+    """Chain IDs of an AlphaFold3 "sequences" list, in the order of the chain_pair_* matrices."""
+    chain_ids = []
+    for entry in sequences:
+        for value in entry.values():
+            ids = value["id"]
+            chain_ids.extend(ids if isinstance(ids, list) else [ids])
+    return chain_ids
+
+
+def _chain_sequences(sequences) -> dict:
+    ret = {}
+    for entry in sequences:
+        for value in entry.values():
+            ids = value["id"]
+            for chain_id in (ids if isinstance(ids, list) else [ids]):
+                ret[chain_id] = value.get("sequence")
+    return ret
+
+
+def top_level_json_files(subfolder_path):
+    """Paths of the summary confidences and data.json of one output folder (None if missing)."""
+    # The per-seed/per-sample copies live in subdirectories and are not needed here
+    summary_path, data_path = None, None
+    with os.scandir(subfolder_path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            if entry.name.endswith("summary_confidences.json"):
+                summary_path = entry.path
+            elif entry.name.endswith("data.json"):
+                data_path = entry.path
+    return summary_path, data_path
+
+
+class ConfidenceIndex:
+    """
+    Incremental SQLite index of AlphaFold3 output folders.
+
+    `update` reads the summary confidences and `data.json` only for folders that are new or
+    whose mtime changed. It stores chain_pair_iptm per named chain pair, ptm, ranking_score
+    and the chain sequences. Threshold queries then run against the index instead of the JSON.
+    One index can hold several output roots; folders are keyed by (absolute base_path, folder).
+
+    Args:
+        index_path (str): SQLite database file.
+    """
+
+    def __init__(self, index_path="af_output_index.sqlite"):
+        self.index_path = index_path
+        self.conn = sqlite3.connect(index_path)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(chain_pairs)")]
+        if columns and "base_path" not in columns:
+            # Index written before folders were keyed by base_path; it is rebuilt by the next update
+            self.conn.executescript("DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS chain_pairs;")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                folder TEXT, base_path TEXT, mtime_ns INTEGER,
+                ptm REAL, iptm REAL, ranking_score REAL, chain_ids TEXT, sequences TEXT,
+                chain_pair_iptm TEXT, chain_pair_pae_min TEXT,
+                PRIMARY KEY (base_path, folder));
+            CREATE TABLE IF NOT EXISTS chain_pairs (
+                base_path TEXT, folder TEXT, chain1 TEXT, chain2 TEXT, iptm REAL,
+                PRIMARY KEY (base_path, folder, chain1, chain2));
+            CREATE INDEX IF NOT EXISTS chain_pairs_iptm ON chain_pairs (chain1, chain2, iptm);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def update(self, base_path: str) -> int:
+        """
+        Ingest new or changed output folders under `base_path` and drop deleted ones.
+
+        Folders without a summary confidences file yet (still running) are skipped and
+        picked up by a later update.
+
+        Returns:
+            int: Number of folders (re)ingested.
+        """
+        root = os.path.abspath(base_path)
+        known = dict(self.conn.execute("SELECT folder, mtime_ns FROM folders WHERE base_path = ?", (root,)))
+        seen = set()
+        ingested = 0
+        with os.scandir(base_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                seen.add(entry.name)
+                mtime_ns = entry.stat().st_mtime_ns
+                if known.get(entry.name) == mtime_ns:
+                    continue
+                try:
+                    with file_timer("confidence_index", entry.path):
+                        if self._ingest(root, entry.name, entry.path, mtime_ns):
+                            ingested += 1
+                except (json.JSONDecodeError, KeyError, TypeError, IOError) as e:
+                    print(f"Error reading folder {entry.path}: {e}")
+
+        for folder in set(known) - seen:
+            self._delete(root, folder)
+        self.conn.commit()
+        return ingested
+
+    def _delete(self, root, folder):
+        self.conn.execute("DELETE FROM folders WHERE base_path = ? AND folder = ?", (root, folder))
+        self.conn.execute("DELETE FROM chain_pairs WHERE base_path = ? AND folder = ?", (root, folder))
+
+    def _ingest(self, root, folder, folder_path, mtime_ns) -> bool:
+        summary_path, data_path = top_level_json_files(folder_path)
+        if summary_path is None or data_path is None:
+            return False
+        with timer("parse.summary_json"), open(summary_path, 'r') as f:
+            summary = json.load(f)
+        with timer("parse.data_json"), open(data_path, 'r') as f:
+            sequences = json.load(f)["sequences"]
+
+        chain_ids = expand_chain_ids(sequences)
+        matrix = summary.get("chain_pair_iptm") or []
+        with timer("write.sqlite"):
+            self._delete(root, folder)
+            self.conn.execute("INSERT INTO folders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                folder, root, mtime_ns, summary.get("ptm"), summary.get("iptm"), summary.get("ranking_score"),
+                json.dumps(chain_ids), json.dumps(_chain_sequences(sequences)),
+                json.dumps(matrix), json.dumps(summary.get("chain_pair_pae_min"))))
+            self.conn.executemany("INSERT INTO chain_pairs VALUES (?, ?, ?, ?, ?)", [
+                (root, folder, chain1, chain2, matrix[i][j])
+                for i, chain1 in enumerate(chain_ids[:len(matrix)])
+                for j, chain2 in enumerate(chain_ids[:len(matrix[i])])
+                if i != j and matrix[i][j] is not None])
+        return True
+
+    def query(self, pairs=(("C", "L"), ("C", "H")), min_iptm=0.8, require_all=False, base_path=None) -> dict:
+        """
+        Folders where the ipTM of any (or, with require_all, every) chain pair is >= min_iptm.
+
+        Args:
+            base_path (str): Only query the folders of this output root. Pass it when the index
+                holds several roots, since the result is keyed by folder name only.
+
+        Returns:
+            dict: Same format as `read_high_confidences`: folder -> (*ipTM of each pair,
+                  {chain_id: sequence}).
+        """
+        pairs = [tuple(pair) for pair in pairs]
+        where = " OR ".join("(chain1 = ? AND chain2 = ?)" for _ in pairs)
+        args = [chain for pair in pairs for chain in pair]
+        roots = [] if base_path is None else [os.path.abspath(base_path)]
+        root_filter = "" if base_path is None else "AND base_path = ?"
+        having = f"HAVING COUNT(*) = {len(pairs)}" if require_all else ""
+        rows = self.conn.execute(f"""
+            SELECT folders.base_path, folders.folder, folders.sequences FROM folders
+            WHERE (base_path, folder) IN (
+                SELECT base_path, folder FROM chain_pairs WHERE ({where}) AND iptm >= ? {root_filter}
+                GROUP BY base_path, folder {having})
+            ORDER BY folders.base_path, folders.folder""",
+            args + [min_iptm] + roots).fetchall()
+
+        result = {}
+        for root, folder, sequences in rows:
+            values = dict(((chain1, chain2), iptm) for chain1, chain2, iptm in self.conn.execute(
+                f"SELECT chain1, chain2, iptm FROM chain_pairs WHERE base_path = ? AND folder = ? AND ({where})",
+                [root, folder] + args))
+            result[folder] = (*(values.get(pair) for pair in pairs), json.loads(sequences))
+        return result
+
+
+def read_high_confidences_indexed(base_path: str, index_path: str = "af_output_index.sqlite",
+                                  min_iptm=0.8, manifest_path: str = None) -> dict:
+    """
+    Indexed version of `read_high_confidences`: only new or changed folders are read, and the
+    (C, L) / (C, H) ipTM threshold is applied in SQLite.
+    """
+    with ConfidenceIndex(index_path) as index:
+        index.update(base_path)
+        result = index.query(min_iptm=min_iptm, base_path=base_path)
+    if manifest_path is not None:
+        result = fan_out_aliases(result, load_manifest(manifest_path))
+    return result
+
+
+if __name__ == "__main__":
+    # Example usage
+    base_path = "af_output/"
+    print(json.dumps(read_high_confidences(base_path), indent=4))
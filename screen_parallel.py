@@ -0,0 +1,356 @@
+import argparse
+import os
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from instrumentation import file_timer
+from stage_cache import StageCache
+
+# Set once per worker process by _init_worker
+_worker_config = {}
+
+
+@dataclass
+class ScreenResult:
+    path: str
+    interfaces: dict = field(default_factory=dict)  # (chain1, chain2) -> find_interface_residues result
+    error: str = None
+    rejected_at: str = None  # Tier that eliminated the structure (engine="tiered" only)
+    contact: bool = None  # Yes/no answer when residues were not listed (yes_no=True)
+    contacts: list = None  # Residue contact pairs of a hit (fingerprints=True)
+
+    @property
+    def is_hit(self) -> bool:
+        """True if chain1 touches any of its partner chains."""
+        if self.contact is not None:
+            return self.contact
+        return any(result["chain1_residues"] for result in self.interfaces.values())
+
+    def interfaces_to_json(self) -> list:
+        return [[chain1, chain2, result] for (chain1, chain2), result in self.interfaces.items()]
+
+    @staticmethod
+    def interfaces_from_json(data) -> dict:
+        return {(chain1, chain2): {key: [tuple(residue) for residue in residues] for key, residues in result.items()}
+                for chain1, chain2, result in data}
+
+
+def iter_structure_files(input_base, extensions=(".pdb", ".cif")):
+    """Yield all structure files under `input_base` recursively, in a stable order, while walking."""
+    for root, dirs, files in os.walk(input_base):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(tuple(extensions)):
+                yield os.path.join(root, file)
+
+
+def find_structure_files(input_base, extensions=(".pdb", ".cif")) -> list:
+    """Find all structure files under `input_base` recursively, in a stable order."""
+    return list(iter_structure_files(input_base, extensions))
+
+
+def _screen_arrays(path, structure, chain_pairs, cutoff, tiered=False, yes_no=False,
+                   fingerprints=False) -> ScreenResult:
+    from interface_kdtree import find_contact_pairs, find_interfaces, screen_contacts_tiered
+    if tiered:
+        hit, tier = screen_contacts_tiered(structure, chain_pairs, cutoff)
+        if not hit:
+            return ScreenResult(path=path, rejected_at=tier, contact=False)
+    if tiered and yes_no:
+        result = ScreenResult(path=path, contact=True)
+    else:
+        result = ScreenResult(path=path, interfaces=find_interfaces(structure, chain_pairs, cutoff))
+    if fingerprints and result.is_hit:
+        result.contacts = find_contact_pairs(structure, chain_pairs, cutoff)
+    return result
+
+
+def _init_worker(chain_pairs, cutoff, engine, yes_no=False, fingerprints=False):
+    # Each worker process imports its own engine, so PyMOL's global session is never shared
+    if engine == "pymol":
+        from interface_residues import find_interface_residues_pairs
+        screen = lambda path: ScreenResult(
+            path=path, interfaces=find_interface_residues_pairs(path, chain_pairs, cutoff, engine="pymol"))
+    else:
+        from structure_arrays import read_structure_arrays
+        screen = lambda path: _screen_arrays(path, read_structure_arrays(path), chain_pairs, cutoff,
+                                             engine == "tiered", yes_no, fingerprints)
+    _worker_config["screen"] = screen
+
+
+def _screen_one(path) -> ScreenResult:
+    try:
+        with file_timer("screen", path):
+            return _worker_config["screen"](path)
+    except Exception as e:
+        return ScreenResult(path=path, error=f"{type(e).__name__}: {e}")
+
+
+def screen_files(paths, chain_pairs, cutoff=5.0, engine="kdtree", workers=None, chunksize=16, ordered=True,
+                 yes_no=False, fingerprints=False):
+    """
+    Screen structures in a process pool and yield a ScreenResult per file as it finishes.
+
+    A file that cannot be parsed or lacks one of the chains yields a ScreenResult with
+    `error` set instead of stopping the run.
+
+    Args:
+        paths (list): Structure files to screen.
+        chain_pairs (list): List of (chain1, chain2) tuples, e.g. [("C", "H"), ("C", "L")].
+        cutoff (float): Distance cutoff for defining the interface (in Ångstroms).
+        engine (str): "kdtree", "pymol" or "tiered". "tiered" first rejects structures with the
+            cheap tiers of interface_kdtree.contact_tier (ScreenResult.rejected_at says which one)
+            and only lists the interface residues of the hits.
+        workers (int): Number of worker processes. Defaults to the number of CPUs.
+            With 1, files are screened in the current process.
+        chunksize (int): Number of files sent to a worker at a time.
+        ordered (bool): Yield results in the order of `paths`. Otherwise yield them as
+            soon as any worker finishes.
+        yes_no (bool): With engine="tiered", stop at the first contact and only report
+            ScreenResult.contact instead of listing the interface residues.
+        fingerprints (bool): Also store the residue contact pairs of every hit in
+            ScreenResult.contacts, for interface_fingerprints. Not available with engine="pymol".
+
+    Yields:
+        ScreenResult: One per input path.
+    """
+    chain_pairs = [tuple(pair) for pair in chain_pairs]
+    if workers == 1:
+        _init_worker(chain_pairs, cutoff, engine, yes_no, fingerprints)
+        for path in paths:
+            yield _screen_one(path)
+        return
+
+    with Pool(processes=workers, initializer=_init_worker,
+              initargs=(chain_pairs, cutoff, engine, yes_no, fingerprints)) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(_screen_one, paths, chunksize=chunksize)
+        # Let the workers exit normally (instead of being terminated) so their exit hooks run
+        pool.close()
+        pool.join()
+
+
+def _screen_store_item(item) -> ScreenResult:
+    from structure_store import StructureStore
+    store_dir, i = item
+    stores = _worker_config.setdefault("stores", {})
+    if store_dir not in stores:
+        stores[store_dir] = StructureStore(store_dir)
+    store = stores[store_dir]
+    name = store.names[i]
+    try:
+        with file_timer("screen", name):
+            return _screen_arrays(name, store[i], _worker_config["chain_pairs"], _worker_config["cutoff"],
+                                  _worker_config["tiered"], _worker_config["yes_no"], _worker_config["fingerprints"])
+    except Exception as e:
+        return ScreenResult(path=name, error=f"{type(e).__name__}: {e}")
+
+
+def _init_store_worker(chain_pairs, cutoff, tiered=False, yes_no=False, fingerprints=False):
+    _worker_config["chain_pairs"] = chain_pairs
+    _worker_config["cutoff"] = cutoff
+    _worker_config["tiered"] = tiered
+    _worker_config["yes_no"] = yes_no
+    _worker_config["fingerprints"] = fingerprints
+
+
+def screen_store(store_base, chain_pairs, cutoff=5.0, workers=None, chunksize=64, ordered=True,
+                 tiered=False, yes_no=False, fingerprints=False):
+    """
+    Like `screen_files`, but reads the structures from a structure_store built with
+    `structure_store.py` instead of parsing PDB text. Each worker memory-maps the batches
+    itself. ScreenResult.path is the structure name in the store. `tiered`, `yes_no` and
+    `fingerprints` work like engine="tiered", `yes_no` and `fingerprints` of `screen_files`.
+    """
+    from structure_store import iter_store_batches
+    chain_pairs = [tuple(pair) for pair in chain_pairs]
+    items = [(store.store_dir, i) for store in iter_store_batches(store_base) for i in range(len(store))]
+    if workers == 1:
+        _init_store_worker(chain_pairs, cutoff, tiered, yes_no, fingerprints)
+        for item in items:
+            yield _screen_store_item(item)
+        return
+
+    with Pool(processes=workers, initializer=_init_store_worker,
+              initargs=(chain_pairs, cutoff, tiered, yes_no, fingerprints)) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(_screen_store_item, items, chunksize=chunksize)
+        pool.close()
+        pool.join()
+
+
+def _init_sweep_worker(chain_pairs, cutoffs):
+    _worker_config["chain_pairs"] = chain_pairs
+    _worker_config["cutoffs"] = cutoffs
+
+
+def _sweep_one(path) -> dict:
+    from interface_kdtree import sweep_interfaces
+    try:
+        with file_timer("sweep", path):
+            sweep = sweep_interfaces(path, _worker_config["chain_pairs"], _worker_config["cutoffs"])
+        return {cutoff: ScreenResult(path=path, interfaces=interfaces) for cutoff, interfaces in sweep.items()}
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        return {cutoff: ScreenResult(path=path, error=error) for cutoff in _worker_config["cutoffs"]}
+
+
+def sweep_files(paths, chain_pairs, cutoffs=(4.0, 5.0, 6.0, 8.0), workers=None, chunksize=16, ordered=True):
+    """
+    Screen structures at several cutoffs with one neighbor search per file
+    (interface_kdtree.sweep_interfaces).
+
+    Yields:
+        dict: {cutoff: ScreenResult} for every input path.
+    """
+    chain_pairs = tuple(tuple(pair) for pair in chain_pairs)
+    cutoffs = tuple(sorted(cutoffs))
+    if workers == 1:
+        _init_sweep_worker(chain_pairs, cutoffs)
+        for path in paths:
+            yield _sweep_one(path)
+        return
+
+    with Pool(processes=workers, initializer=_init_sweep_worker, initargs=(chain_pairs, cutoffs)) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        yield from imap(_sweep_one, paths, chunksize=chunksize)
+        pool.close()
+        pool.join()
+
+
+def screen_files_cached(paths, chain_pairs, cutoff=5.0, cache=None, **kwargs):
+    """
+    Like `screen_files`, but reuses results from a stage_cache.StageCache.
+
+    Files whose content, chain pairs and cutoff match a cached entry are yielded first
+    without being parsed; the remaining files are screened and stored in the cache.
+    Failed files are not cached so they are retried on the next run. Yes/no and fingerprint
+    runs bypass the cache, since it only stores the residue lists.
+    """
+    if cache is None or kwargs.get("yes_no") or kwargs.get("fingerprints"):
+        yield from screen_files(paths, chain_pairs, cutoff, **kwargs)
+        return
+
+    params = {"chain_pairs": [list(pair) for pair in chain_pairs], "cutoff": cutoff}
+    todo = []
+    for path in paths:
+        cached = cache.get("interface_screen", path, params)
+        if cached is None:
+            todo.append(path)
+        else:
+            yield ScreenResult(path=path, interfaces=ScreenResult.interfaces_from_json(cached))
+
+    for result in screen_files(todo, chain_pairs, cutoff, **kwargs):
+        if result.error is None:
+            cache.put("interface_screen", result.path, params, result.interfaces_to_json())
+        yield result
+
+
+def print_result(result: ScreenResult):
+    """Print the interface residues of a hit in the format of interface_residues.py."""
+    for (chain1, chain2), interface in result.interfaces.items():
+        if interface["chain1_residues"]:
+            print(f"path: {result.path}")
+            print(f"Interface residues for Chain {chain1}:")
+            for chain, resi, resn in interface["chain1_residues"]:
+                print(f"{resn} ({resi})")
+            print(f"\nInterface residues for Chain {chain2}:")
+            for chain, resi, resn in interface["chain2_residues"]:
+                print(f"{resn} ({resi})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen DiffAb results for chains that contact the antigen.")
+    parser.add_argument("input_base", nargs="?", default="results")
+    parser.add_argument("--antigen", default="C", help="Antigen chain ID")
+    parser.add_argument("--partners", nargs="+", default=["H", "L"], help="Chain IDs to test against the antigen")
+    parser.add_argument("--cutoff", type=float, default=5.0)
+    parser.add_argument("--engine", choices=["kdtree", "pymol", "tiered"], default="kdtree",
+                        help="tiered: bounding box -> residue centroid -> atom prefilter before the full search")
+    parser.add_argument("--yes-no", action="store_true",
+                        help="With --engine tiered, only report whether the chains touch, not the residues")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--unordered", action="store_true", help="Print results as soon as they are ready")
+    parser.add_argument("--quiet", action="store_true", help="Only print paths of hits")
+    parser.add_argument("--cache", default=None, help="SQLite stage cache; unchanged files are not screened again")
+    parser.add_argument("--extensions", nargs="+", default=[".pdb", ".cif"], help="Structure file extensions")
+    parser.add_argument("--fingerprints", default=None,
+                        help="Write the interface contact fingerprints of the hits to this .npz file")
+    parser.add_argument("--sweep", nargs="+", type=float, default=None,
+                        help="Count the hits at each of these cutoffs with one neighbor search per file")
+    parser.add_argument("--store", action="store_true",
+                        help="input_base is a structure store built with structure_store.py")
+    args = parser.parse_args()
+
+    chain_pairs = [(args.antigen, partner) for partner in args.partners]
+    if args.fingerprints and args.engine == "pymol":
+        parser.error("--fingerprints needs the kdtree or tiered engine")
+    if args.yes_no and args.engine != "tiered":
+        parser.error("--yes-no needs the tiered engine")
+    if args.store and args.engine == "pymol":
+        parser.error("--store needs the kdtree or tiered engine")
+    if args.sweep:
+        pdb_paths = find_structure_files(args.input_base, args.extensions)
+        hits = {cutoff: [] for cutoff in sorted(args.sweep)}
+        for sweep in sweep_files(pdb_paths, chain_pairs, args.sweep, args.workers, args.chunksize,
+                                 ordered=not args.unordered):
+            for cutoff, result in sweep.items():
+                if result.error is not None:
+                    print(f"Error processing {result.path}: {result.error}")
+                    break
+                if result.is_hit:
+                    hits[cutoff].append(result.path)
+        for cutoff, paths in hits.items():
+            print(f"cutoff {cutoff}: {len(paths)} hits of {len(pdb_paths)} files")
+            if not args.quiet:
+                print(paths)
+        return
+
+    cache = StageCache(args.cache) if args.cache else None
+
+    if args.store:
+        results = screen_store(args.input_base, chain_pairs, args.cutoff, args.workers, args.chunksize,
+                               ordered=not args.unordered, tiered=args.engine == "tiered", yes_no=args.yes_no,
+                               fingerprints=bool(args.fingerprints))
+    else:
+        pdb_paths = find_structure_files(args.input_base, args.extensions)
+        results = screen_files_cached(pdb_paths, chain_pairs, args.cutoff, cache, engine=args.engine,
+                                      workers=args.workers, chunksize=args.chunksize, ordered=not args.unordered,
+                                      yes_no=args.yes_no, fingerprints=bool(args.fingerprints))
+
+    output_paths = []
+    n_errors = 0
+    n_files = 0
+    eliminated = {}
+    contacts = {}
+    for result in results:
+        n_files += 1
+        if result.rejected_at is not None:
+            eliminated[result.rejected_at] = eliminated.get(result.rejected_at, 0) + 1
+        if result.error is not None:
+            n_errors += 1
+            print(f"Error processing {result.path}: {result.error}")
+        elif result.is_hit:
+            output_paths.append(result.path)
+            if result.contacts is not None:
+                contacts[result.path] = result.contacts
+            if args.quiet or result.contact is not None:
+                print(result.path)
+            else:
+                print_result(result)
+
+    if cache is not None:
+        cache.close()
+    if args.fingerprints:
+        from interface_fingerprints import InterfaceFingerprints
+        InterfaceFingerprints.from_contacts(list(contacts), list(contacts.values())).save(args.fingerprints)
+
+    print(f"{len(output_paths)} hits, {n_errors} errors, {n_files} files")
+    if args.engine == "tiered":
+        from interface_kdtree import TIERS
+        print("Eliminated by tier: " + ", ".join(f"{tier}={eliminated.get(tier, 0)}" for tier in TIERS))
+    print(output_paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = ".pipeline_cache.sqlite"
+
+
+def file_sha256(path, block_size=1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class StageCache:
+    """
+    Persistent SQLite cache of per-file stage results.
+
+    An entry is keyed by the stage name, the SHA-256 of the input file content and the
+    stage parameters (chain IDs, cutoff, copies, output path, ...), so a file is processed
+    again only if its content or the parameters change. Content hashes are remembered by
+    (path, size, mtime) so unchanged files are not read again on a re-run.
+
+    Args:
+        path (str): SQLite database file.
+        max_entries (int): Keep at most this many entries; the least recently used go first.
+        max_age_days (float): Drop entries not used for this many days.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=None, max_age_days=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.conn = sqlite3.connect(path)
+        self._uncommitted = 0
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT);
+            CREATE TABLE IF NOT EXISTS results (
+                stage TEXT, sha256 TEXT, params TEXT, result TEXT, last_used REAL,
+                PRIMARY KEY (stage, sha256, params));
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.evict()
+        self.conn.commit()
+        self.conn.close()
+
+    def content_hash(self, path) -> str:
+        st = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?",
+                                (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        sha256 = file_sha256(path)
+        self.conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                          (path, st.st_size, st.st_mtime_ns, sha256))
+        return sha256
+
+    @staticmethod
+    def _params_key(params) -> str:
+        return json.dumps(params, sort_keys=True)
+
+    def get(self, stage, input_path, params):
+        """Return the cached result of `stage` for this input and parameters, or None."""
+        key = (stage, self.content_hash(input_path), self._params_key(params))
+        row = self.conn.execute("SELECT result FROM results WHERE stage = ? AND sha256 = ? AND params = ?",
+                                key).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE results SET last_used = ? WHERE stage = ? AND sha256 = ? AND params = ?",
+                          (time.time(), *key))
+        return json.loads(row[0])
+
+    def put(self, stage, input_path, params, result):
+        """Store a JSON-serializable `result` of `stage` for this input and parameters."""
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                          (stage, self.content_hash(input_path), self._params_key(params),
+                           json.dumps(result), time.time()))
+        # Commit in batches so a long run survives an interruption without one fsync per file
+        self._uncommitted += 1
+        if self._uncommitted >= 100:
+            self.conn.commit()
+            self._uncommitted = 0
+
+    def invalidate(self, stage=None):
+        """Delete all results, or only the results of one stage."""
+        if stage is None:
+            self.conn.execute("DELETE FROM results")
+            self.conn.execute("DELETE FROM file_hashes")
+        else:
+            self.conn.execute("DELETE FROM results WHERE stage = ?", (stage,))
+        self.conn.commit()
+
+    def evict(self, max_entries=None, max_age_days=None) -> int:
+        """Drop entries older than max_age_days and beyond max_entries. Returns the number dropped."""
+        max_entries = self.max_entries if max_entries is None else max_entries
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        dropped = 0
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 86400
+            dropped += self.conn.execute("DELETE FROM results WHERE last_used < ?", (cutoff,)).rowcount
+        if max_entries is not None:
+            dropped += self.conn.execute("""
+                DELETE FROM results WHERE rowid NOT IN (
+                    SELECT rowid FROM results ORDER BY last_used DESC LIMIT ?)""", (max_entries,)).rowcount
+        self.conn.commit()
+        return dropped
+
+    def stats(self) -> dict:
+        rows = self.conn.execute("SELECT stage, COUNT(*) FROM results GROUP BY stage").fetchall()
+        return {
+            "path": self.path,
+            "bytes": os.path.getsize(self.path),
+            "entries": dict(rows),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clean the pipeline stage cache.")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--invalidate", action="store_true", help="Delete cached results")
+    parser.add_argument("--stage", default=None, help="Only invalidate this stage")
+    parser.add_argument("--max-entries", type=int, default=None)
+    parser.add_argument("--max-age-days", type=float, default=None)
+    args = parser.parse_args()
+
+    with StageCache(args.cache) as cache:
+        if args.invalidate:
+            cache.invalidate(args.stage)
+        if args.max_entries is not None or args.max_age_days is not None:
+            print(f"Evicted {cache.evict(args.max_entries, args.max_age_days)} entries")
+        print(json.dumps(cache.stats(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
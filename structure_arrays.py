@@ -0,0 +1,290 @@
+from dataclasses import dataclass
+import numpy as np
+from instrumentation import timed
+
+
+@dataclass
+class StructureArrays:
+    """
+    Column arrays for every atom of one structure (first model only).
+
+    Residue ids are kept as strings with the insertion code appended
+    (e.g. "100A"), the same way PyMOL reports `resi`.
+    """
+    coords: np.ndarray      # (N, 3) float32
+    atom_names: np.ndarray  # (N,) str
+    resn: np.ndarray        # (N,) str
+    resi: np.ndarray        # (N,) str
+    chain_ids: np.ndarray   # (N,) str
+    elements: np.ndarray    # (N,) str
+    hetero: np.ndarray      # (N,) bool, True for HETATM records
+    altlocs: np.ndarray     # (N,) str, "" if the atom has no alternate location
+
+    def __len__(self):
+        return len(self.coords)
+
+    def chains(self) -> list:
+        """Chain IDs in the order they first appear in the file."""
+        _, first = np.unique(self.chain_ids, return_index=True)
+        return [str(self.chain_ids[i]) for i in sorted(first)]
+
+    def chain_mask(self, chain_id: str) -> np.ndarray:
+        return self.chain_ids == chain_id
+
+    def select(self, mask) -> "StructureArrays":
+        """Return a new StructureArrays holding only the atoms in `mask`."""
+        return StructureArrays(
+            coords=self.coords[mask],
+            atom_names=self.atom_names[mask],
+            resn=self.resn[mask],
+            resi=self.resi[mask],
+            chain_ids=self.chain_ids[mask],
+            elements=self.elements[mask],
+            hetero=self.hetero[mask],
+            altlocs=self.altlocs[mask],
+        )
+
+
+def _from_columns(coords, atom_names, resn, resi, chain_ids, elements, hetero, altlocs) -> StructureArrays:
+    return StructureArrays(
+        coords=np.asarray(coords, dtype=np.float32).reshape(-1, 3),
+        atom_names=np.asarray(atom_names, dtype=str),
+        resn=np.asarray(resn, dtype=str),
+        resi=np.asarray(resi, dtype=str),
+        chain_ids=np.asarray(chain_ids, dtype=str),
+        elements=np.asarray(elements, dtype=str),
+        hetero=np.asarray(hetero, dtype=bool),
+        altlocs=np.asarray(altlocs, dtype=str),
+    )
+
+
+@timed("parse.pdb")
+def read_pdb_arrays(pdb_filename) -> StructureArrays:
+    """
+    Parse the ATOM/HETATM records of a PDB file into column arrays.
+
+    Only the first MODEL is read. Alternate locations are all kept, like PyMOL does.
+
+    Args:
+        pdb_filename (str): Path to the PDB file.
+
+    Returns:
+        StructureArrays: Per-atom coordinates and identifiers.
+    """
+    coords = []
+    atom_names, resn, resi, chain_ids, elements, hetero, altlocs = [], [], [], [], [], [], []
+
+    with open(pdb_filename, 'r') as f:
+        for line in f:
+            record = line[:6]
+            if record == "ATOM  " or record == "HETATM":
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+                atom_names.append(line[12:16].strip())
+                resn.append(line[17:20].strip())
+                resi.append(line[22:26].strip() + line[26:27].strip())
+                chain_ids.append(line[21:22].strip())
+                elements.append(line[76:78].strip())
+                hetero.append(record == "HETATM")
+                altlocs.append(line[16:17].strip())
+            elif record == "ENDMDL":
+                break
+
+    return _from_columns(coords, atom_names, resn, resi, chain_ids, elements, hetero, altlocs)
+
+
+def _split_cif_row(line) -> list:
+    # Fast path: most _atom_site rows have no quoted values
+    if '"' not in line and "'" not in line:
+        return line.split()
+    tokens = []
+    i, n = 0, len(line)
+    while i < n:
+        c = line[i]
+        if c.isspace():
+            i += 1
+        elif c == '"' or c == "'":
+            # A quoted value ends at the same quote followed by whitespace or end of line
+            j = i + 1
+            while True:
+                j = line.find(c, j)
+                if j == -1 or j + 1 >= n or line[j + 1].isspace():
+                    break
+                j += 1
+            if j == -1:
+                j = n
+            tokens.append(line[i + 1:j])
+            i = j + 1
+        else:
+            j = i
+            while j < n and not line[j].isspace():
+                j += 1
+            tokens.append(line[i:j])
+            i = j
+    return tokens
+
+
+def _cif_value(value) -> str:
+    return "" if value in ("?", ".") else value
+
+
+def _iter_atom_site_rows(lines):
+    """Yield (column index, row values) for every row of the `_atom_site` loop."""
+    in_loop = False
+    columns = []
+    index = None
+    pending = []
+    for line in lines:
+        if index is None:
+            if line.startswith("loop_"):
+                in_loop = True
+                columns = []
+                continue
+            if not in_loop:
+                continue
+            if line.startswith("_atom_site."):
+                columns.append(line.strip()[len("_atom_site."):])
+                continue
+            if not columns:
+                in_loop = False  # Some other loop
+                continue
+            index = {name: i for i, name in enumerate(columns)}
+        elif not line.strip() or line.startswith(('#', 'loop_', '_', 'data_')):
+            return
+
+        # A row may in principle be wrapped over several lines
+        pending.extend(_split_cif_row(line))
+        while len(pending) >= len(columns):
+            yield index, pending[:len(columns)]
+            pending = pending[len(columns):]
+
+
+@timed("parse.cif")
+def read_cif_arrays(cif_filename) -> StructureArrays:
+    """
+    Parse the `_atom_site` loop of an mmCIF file (e.g. an AlphaFold3 model) into column arrays.
+
+    The file is streamed line by line and only the `_atom_site` loop is tokenized. Chains and
+    residue numbers use the author fields (auth_asym_id, auth_seq_id + insertion code), like
+    PyMOL and the PDB files written by obabel. Only the first model is read.
+
+    Args:
+        cif_filename (str): Path to the mmCIF file.
+
+    Returns:
+        StructureArrays: Per-atom coordinates and identifiers.
+    """
+    coords = []
+    atom_names, resn, resi, chain_ids, elements, hetero, altlocs = [], [], [], [], [], [], []
+
+    columns = None
+    first_model = None
+    with open(cif_filename, 'r') as f:
+        for index, row in _iter_atom_site_rows(f):
+            if columns is None:
+                pick = lambda *names: next((index[name] for name in names if name in index), None)
+                columns = (index["Cartn_x"], index["Cartn_y"], index["Cartn_z"],
+                           pick("auth_atom_id", "label_atom_id"), pick("auth_comp_id", "label_comp_id"),
+                           pick("auth_seq_id", "label_seq_id"), pick("pdbx_PDB_ins_code"),
+                           pick("auth_asym_id", "label_asym_id"), pick("type_symbol"), pick("group_PDB"),
+                           pick("label_alt_id"), pick("pdbx_PDB_model_num"))
+            (x_col, y_col, z_col, atom_col, resn_col, resi_col, icode_col, chain_col,
+             element_col, group_col, alt_col, model_col) = columns
+
+            if model_col is not None:
+                if first_model is None:
+                    first_model = row[model_col]
+                elif row[model_col] != first_model:
+                    break
+            coords.append((float(row[x_col]), float(row[y_col]), float(row[z_col])))
+            atom_names.append(row[atom_col])
+            resn.append(row[resn_col])
+            resi.append(_cif_value(row[resi_col]) + (_cif_value(row[icode_col]) if icode_col is not None else ""))
+            chain_ids.append(row[chain_col])
+            elements.append(_cif_value(row[element_col]) if element_col is not None else "")
+            hetero.append(group_col is not None and row[group_col] == "HETATM")
+            altlocs.append(_cif_value(row[alt_col]) if alt_col is not None else "")
+
+    return _from_columns(coords, atom_names, resn, resi, chain_ids, elements, hetero, altlocs)
+
+
+def read_structure_arrays(filename) -> StructureArrays:
+    """Parse a PDB or mmCIF file (chosen by extension) into column arrays."""
+    if filename.endswith((".cif", ".mmcif")):
+        return read_cif_arrays(filename)
+    return read_pdb_arrays(filename)
+
+
+def _split_resi(resi):
+    # "100A" -> ("100", "A")
+    digits = resi.lstrip('-0123456789')
+    return resi[:len(resi) - len(digits)], digits
+
+
+@timed("write.pdb")
+def write_pdb_arrays(structure: StructureArrays, pdb_filename, b_factors=None):
+    """
+    Write column arrays as ATOM/HETATM records, with a TER record after every chain.
+
+    Args:
+        structure (StructureArrays): Atoms to write, in order.
+        pdb_filename (str): Output PDB file.
+        b_factors (np.ndarray): Optional per-atom B-factors (e.g. pLDDT). Defaults to 0.
+    """
+    lines = []
+    serial = 0
+    b_factors = [0.0] * len(structure) if b_factors is None else np.asarray(b_factors).tolist()
+    chain_ids = structure.chain_ids.tolist()
+    rows = zip(structure.coords.tolist(), structure.atom_names.tolist(), structure.resn.tolist(),
+               structure.resi.tolist(), chain_ids, structure.elements.tolist(), structure.hetero.tolist(),
+               structure.altlocs.tolist(), b_factors)
+    for i, ((x, y, z), name, resn, resi, chain, element, hetero, altloc, b_factor) in enumerate(rows):
+        serial += 1
+        number, icode = _split_resi(resi)
+        lines.append(
+            f"{'HETATM' if hetero else 'ATOM  '}{serial:>5} {name if len(name) == 4 else ' ' + name:<4}"
+            f"{altloc:1}{resn:>3} {chain:1}{number:>4}{icode:1}   {x:8.3f}{y:8.3f}{z:8.3f}"
+            f"{1.0:6.2f}{b_factor:6.2f}          {element:>2}  \n")
+        if i + 1 == len(chain_ids) or chain_ids[i + 1] != chain:
+            serial += 1
+            lines.append(f"TER   {serial:>5}      {resn:>3} {chain:1}{number:>4}{icode:1}\n")
+    lines.append("END\n")
+    with open(pdb_filename, 'w') as f:
+        f.writelines(lines)
+
+
+@timed("write.cif")
+def write_cif_arrays(structure: StructureArrays, cif_filename, name="structure", b_factors=None):
+    """
+    Write column arrays as the `_atom_site` loop of an mmCIF file, with the columns of an
+    AlphaFold3 model. Entities are numbered per chain and label_seq_id counts the residues
+    of each chain from 1.
+
+    Args:
+        structure (StructureArrays): Atoms to write, in order.
+        cif_filename (str): Output mmCIF file.
+        name (str): Data block name.
+        b_factors (np.ndarray): Optional per-atom B-factors (e.g. pLDDT). Defaults to 0.
+    """
+    columns = ["group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id",
+               "label_asym_id", "label_entity_id", "label_seq_id", "pdbx_PDB_ins_code", "Cartn_x", "Cartn_y",
+               "Cartn_z", "occupancy", "B_iso_or_equiv", "auth_seq_id", "auth_asym_id", "pdbx_PDB_model_num"]
+    lines = [f"data_{name}\n", "#\n", "loop_\n"] + [f"_atom_site.{column}\n" for column in columns]
+    entities = {}
+    previous = None
+    seq_id = 0
+    b_factors = [0.0] * len(structure) if b_factors is None else np.asarray(b_factors).tolist()
+    rows = zip(structure.coords.tolist(), structure.atom_names.tolist(), structure.resn.tolist(),
+               structure.resi.tolist(), structure.chain_ids.tolist(), structure.elements.tolist(),
+               structure.hetero.tolist(), structure.altlocs.tolist(), b_factors)
+    for i, ((x, y, z), atom_name, resn, resi, chain, element, hetero, altloc, b_factor) in enumerate(rows):
+        entity = entities.setdefault(chain, len(entities) + 1)
+        if (chain, resi) != previous:
+            seq_id = 1 if previous is None or previous[0] != chain else seq_id + 1
+            previous = (chain, resi)
+        number, icode = _split_resi(resi)
+        lines.append(
+            f"{'HETATM' if hetero else 'ATOM'} {i + 1} {element or '?'} {atom_name} {altloc or '.'} {resn} {chain} "
+            f"{entity} {seq_id} {icode or '?'} {x:.3f} {y:.3f} {z:.3f} 1.00 {b_factor:.2f} {number} {chain} 1\n")
+    lines.append("#\n")
+    with open(cif_filename, 'w') as f:
+        f.writelines(lines)
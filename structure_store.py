@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import numpy as np
+from structure_arrays import StructureArrays, read_structure_arrays
+
+# Per-atom columns of StructureArrays, each stored as one .npy file per batch
+COLUMNS = ("coords", "atom_names", "resn", "resi", "chain_ids", "elements", "hetero", "altlocs")
+
+
+class StructureStore:
+    """
+    Read-only, memory-mapped columnar store of many structures (one batch directory).
+
+    A batch directory holds one `.npy` file per StructureArrays column with the atoms of all
+    structures concatenated, `offsets.npy` with the first atom of every structure, and
+    `names.json` with the structure names. Arrays are opened with `mmap_mode='r'`, so opening
+    a store reads nothing and `store[i]` returns views into the mapped files.
+
+    Args:
+        store_dir (str): Batch directory written by `write_structure_store`.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "names.json"), 'r') as f:
+            self.names = json.load(f)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self.offsets = np.load(os.path.join(store_dir, "offsets.npy"))
+        self.columns = {column: np.load(os.path.join(store_dir, f"{column}.npy"), mmap_mode='r')
+                        for column in COLUMNS}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, key) -> StructureArrays:
+        """The structure at position `key`, or with name `key`, as zero-copy views."""
+        i = self._index[key] if isinstance(key, str) else key
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return StructureArrays(**{column: array[start:end] for column, array in self.columns.items()})
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        for i, name in enumerate(self.names):
+            yield name, self[i]
+
+
+def write_structure_store(store_dir, paths, names=None, reader=read_structure_arrays) -> list:
+    """
+    Parse `paths` once and write them as one batch of a StructureStore.
+
+    Files that fail to parse are reported and left out.
+
+    Args:
+        store_dir (str): Output batch directory.
+        paths (list): Structure files.
+        names (list): Name of each structure in the store. Defaults to the paths.
+        reader (callable): Parser returning StructureArrays.
+
+    Returns:
+        list: Names of the structures written.
+    """
+    names = list(paths) if names is None else list(names)
+    parsed, written = [], []
+    for path, name in zip(paths, names):
+        try:
+            parsed.append(reader(path))
+            written.append(name)
+        except Exception as e:
+            print(f"Error processing {path}: {str(e)}")
+
+    os.makedirs(store_dir, exist_ok=True)
+    offsets = np.zeros(len(parsed) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(structure) for structure in parsed])
+    for column in COLUMNS:
+        arrays = [getattr(structure, column) for structure in parsed]
+        if column == "coords":
+            stacked = np.concatenate(arrays) if arrays else np.empty((0, 3), dtype=np.float32)
+        elif column == "hetero":
+            stacked = np.concatenate(arrays) if arrays else np.empty(0, dtype=bool)
+        else:
+            stacked = np.concatenate(arrays).astype(str) if arrays else np.empty(0, dtype=str)
+        np.save(os.path.join(store_dir, f"{column}.npy"), stacked)
+    np.save(os.path.join(store_dir, "offsets.npy"), offsets)
+    with open(os.path.join(store_dir, "names.json"), 'w') as f:
+        json.dump(written, f)
+    return written
+
+
+def build_store(input_base, store_base, batch_size=1000, extensions=(".pdb", ".cif"),
+                reader=read_structure_arrays) -> int:
+    """
+    Convert every structure under `input_base` into StructureStore batches
+    `store_base/batch_0000`, `store_base/batch_0001`, ... of at most `batch_size` structures.
+    Structures are named by their path relative to `input_base`.
+
+    Returns:
+        int: Number of structures written.
+    """
+    paths = []
+    for root, dirs, files in os.walk(input_base):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(tuple(extensions)):
+                paths.append(os.path.join(root, file))
+
+    n_written = 0
+    for batch, start in enumerate(range(0, len(paths), batch_size)):
+        batch_paths = paths[start:start + batch_size]
+        names = [os.path.relpath(path, input_base) for path in batch_paths]
+        n_written += len(write_structure_store(os.path.join(store_base, f"batch_{batch:04d}"),
+                                               batch_paths, names, reader))
+    return n_written
+
+
+def iter_store_batches(store_base):
+    """Open every batch directory under `store_base` (or `store_base` itself if it is a batch)."""
+    if os.path.exists(os.path.join(store_base, "names.json")):
+        yield StructureStore(store_base)
+        return
+    for batch in sorted(os.listdir(store_base)):
+        batch_dir = os.path.join(store_base, batch)
+        if os.path.exists(os.path.join(batch_dir, "names.json")):
+            yield StructureStore(batch_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a tree of structures into a memory-mapped StructureStore.")
+    parser.add_argument("input_base")
+    parser.add_argument("store_base")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    n_written = build_store(args.input_base, args.store_base, args.batch_size)
+    print(f"Stored {n_written} structures in {args.store_base}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+import argparse
+import json
+import os
+import re
+import numpy as np
+from scipy.spatial import cKDTree
+from pdb_seq_stream import THREE_TO_ONE
+from screen_parallel import ScreenResult, iter_structure_files
+from structure_arrays import _cif_value, _split_cif_row
+
+# Suffix of the chain index written next to each structure file
+INDEX_SUFFIX = ".chains.json"
+
+# Colors for different chains; chains with identical sequences get the same color
+COLOR_LIST = ["cyan", "yellow", "magenta", "green", "blue", "red", "orange", "purple", "pink", "lime"]
+
+# _atom_site columns the viewer needs, with their fallbacks
+_CIF_COLUMNS = {
+    "group": ("group_PDB",),
+    "atom": ("auth_atom_id", "label_atom_id"),
+    "resn": ("auth_comp_id", "label_comp_id"),
+    "resi": ("auth_seq_id", "label_seq_id"),
+    "icode": ("pdbx_PDB_ins_code",),
+    "chain": ("auth_asym_id", "label_asym_id"),
+    "x": ("Cartn_x",),
+    "y": ("Cartn_y",),
+    "z": ("Cartn_z",),
+    "model": ("pdbx_PDB_model_num",),
+}
+
+
+def _pdb_atom(line):
+    # (record, chain, resi, resn, atom name) of an ATOM/HETATM line
+    return (line[:6], line[21:22].strip(), line[22:26].strip() + line[26:27].strip(), line[17:20].strip(),
+            line[12:16].strip())
+
+
+def _cif_atom(tokens, columns):
+    get = lambda name: _cif_value(tokens[columns[name]]) if columns.get(name) is not None else ""
+    return get("group"), get("chain"), get("resi") + get("icode"), get("resn"), get("atom")
+
+
+def build_chain_index(structure_path, index_path=None) -> str:
+    """
+    Write the chain index of a PDB or mmCIF file: the residues, atom count, sequence and byte
+    ranges of the atom records of every chain (and, for mmCIF, of the `_atom_site` header).
+
+    The file is streamed once. With the index, chains can be listed without reading the
+    structure and a chain is read with a few seeks instead of parsing the whole file. Only the
+    first model is indexed, and mmCIF rows must be on one line each (as AlphaFold3 writes them).
+
+    Args:
+        structure_path (str): PDB or mmCIF file.
+        index_path (str): Output path. Defaults to `{structure_path}.chains.json`.
+
+    Returns:
+        str: Path of the index.
+    """
+    index_path = index_path or f"{structure_path}{INDEX_SUFFIX}"
+    cif = structure_path.endswith((".cif", ".mmcif"))
+    header, columns, names = [], None, None
+    loop_start = None
+    chains = {}
+    last_residue = {}
+
+    with open(structure_path, 'r', newline='') as f:
+        position = 0
+        for line in f:
+            start = position
+            position += len(line.encode())
+            if cif:
+                if columns is None:
+                    if line.startswith("data_") and not header:
+                        header.append([start, position - start])
+                    elif line.startswith("loop_"):
+                        loop_start, names = start, []
+                    elif names is not None and line.startswith("_atom_site."):
+                        names.append(line.strip()[len("_atom_site."):])
+                    elif names:
+                        header.append([loop_start, start - loop_start])
+                        index = {name: i for i, name in enumerate(names)}
+                        columns = {key: next((index[name] for name in options if name in index), None)
+                                   for key, options in _CIF_COLUMNS.items()}
+                        columns["count"] = len(names)
+                        model = None
+                    else:
+                        names = None
+                    if columns is None:
+                        continue
+                if not line.strip() or line.startswith(('#', 'loop_', '_', 'data_')):
+                    break
+                tokens = _split_cif_row(line)
+                if len(tokens) != columns["count"]:
+                    raise ValueError(f"{structure_path}: _atom_site rows spanning several lines are not supported")
+                if columns["model"] is not None:
+                    model = model or tokens[columns["model"]]
+                    if tokens[columns["model"]] != model:
+                        break
+                record, chain, resi, resn, atom = _cif_atom(tokens, columns)
+            else:
+                if line.startswith("ENDMDL"):
+                    break
+                if not line.startswith(("ATOM  ", "HETATM")):
+                    continue
+                record, chain, resi, resn, atom = _pdb_atom(line)
+
+            entry = chains.get(chain)
+            if entry is None:
+                entry = chains[chain] = {"residues": 0, "atoms": 0, "sequence": [], "spans": []}
+            entry["atoms"] += 1
+            spans = entry["spans"]
+            if spans and spans[-1][0] + spans[-1][1] == start:
+                spans[-1][1] += position - start
+            else:
+                spans.append([start, position - start])
+            if last_residue.get(chain) != resi:
+                last_residue[chain] = resi
+                entry["residues"] += 1
+                if record.startswith("ATOM"):
+                    entry["sequence"].append(THREE_TO_ONE.get(resn, "X"))
+
+    for entry in chains.values():
+        entry["sequence"] = "".join(entry["sequence"])
+    index = {"format": "cif" if cif else "pdb", "header": header, "columns": columns, "chains": chains}
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    return index_path
+
+
+def load_chain_index(structure_path, index_path=None) -> dict:
+    """The chain index of `structure_path`, built first if missing or older than the file."""
+    index_path = index_path or f"{structure_path}{INDEX_SUFFIX}"
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(structure_path):
+        build_chain_index(structure_path, index_path)
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+def list_chains(structure_path, index=None) -> dict:
+    """
+    Chain information of a structure from its index, without parsing the structure.
+
+    Returns:
+        dict: {chain: {"length": residues, "atoms": atoms, "sequence": one-letter sequence}}
+    """
+    index = index or load_chain_index(structure_path)
+    return {chain: {"length": entry["residues"], "atoms": entry["atoms"], "sequence": entry["sequence"]}
+            for chain, entry in index["chains"].items()}
+
+
+def assign_colors(chain_info) -> dict:
+    """Assign a color to every chain, giving chains with identical sequences (copies) the same color."""
+    unique_sequences = {}
+    chain_colors = {}
+    for chain_id, info in chain_info.items():
+        sequence = info["sequence"]
+        if sequence not in unique_sequences:
+            unique_sequences[sequence] = COLOR_LIST[len(unique_sequences) % len(COLOR_LIST)]
+        chain_colors[chain_id] = unique_sequences[sequence]
+    return chain_colors
+
+
+def read_chains_text(structure_path, chains=None, index=None) -> str:
+    """
+    Read only the atom records of `chains` (default: all), as a PDB or mmCIF model text.
+
+    Args:
+        structure_path (str): PDB or mmCIF file.
+        chains (list): Chain IDs to read.
+        index (dict): Chain index, loaded with `load_chain_index` if not given.
+
+    Returns:
+        str: Model text in the format of the file, e.g. for `py3Dmol.view.addModel`.
+    """
+    index = index or load_chain_index(structure_path)
+    chains = list(index["chains"]) if chains is None else chains
+    missing = [chain for chain in chains if chain not in index["chains"]]
+    if missing:
+        raise ValueError(f"Chains {', '.join(missing)} do not exist in {structure_path}")
+    spans = sorted(span for chain in chains for span in index["chains"][chain]["spans"])
+    with open(structure_path, 'rb') as f:
+        parts = []
+        for offset, length in index["header"] + spans:
+            f.seek(offset)
+            parts.append(f.read(length))
+    return b"".join(parts).decode() + ("#\n" if index["format"] == "cif" else "END\n")
+
+
+def interface_residue_keys(interfaces) -> set:
+    """
+    (chain, resi) of all interface residues of a screen result.
+
+    Args:
+        interfaces: ScreenResult.interfaces, or its JSON form written by screen_candidate
+                    (`[[chain1, chain2, result], ...]`).
+    """
+    results = interfaces.values() if isinstance(interfaces, dict) else (result for _, _, result in interfaces)
+    return {(residue[0], residue[1]) for result in results for residues in result.values() for residue in residues}
+
+
+def lod_model_text(structure_path, chains=None, detail=None, radius=8.0, index=None) -> str:
+    """
+    Model text of `chains` with full atoms only near the residues in `detail` and a CA trace
+    everywhere else, so large complexes stay light in the viewer.
+
+    A residue keeps all its atoms if it is in `detail` or its CA lies within `radius` of an atom
+    of a `detail` residue. Without `detail` all atoms are kept.
+
+    Args:
+        structure_path (str): PDB or mmCIF file.
+        chains (list): Chain IDs to read (default: all).
+        detail (set): (chain, resi) of the residues to show in full, e.g. `interface_residue_keys`.
+        radius (float): Distance (in Ångstroms) around `detail` that is also shown in full.
+        index (dict): Chain index, loaded with `load_chain_index` if not given.
+
+    Returns:
+        str: Model text in the format of the file.
+    """
+    index = index or load_chain_index(structure_path)
+    text = read_chains_text(structure_path, chains, index)
+    if not detail:
+        return text
+
+    cif = index["format"] == "cif"
+    columns = index["columns"]
+    n_header = sum(length for _, length in index["header"])
+    header, lines = text[:n_header], text[n_header:].splitlines(keepends=True)[:-1]
+    keys, atom_names, coords = [], [], []
+    for line in lines:
+        if cif:
+            tokens = _split_cif_row(line)
+            _, chain, resi, _, atom = _cif_atom(tokens, columns)
+            xyz = (tokens[columns["x"]], tokens[columns["y"]], tokens[columns["z"]])
+        else:
+            _, chain, resi, _, atom = _pdb_atom(line)
+            xyz = (line[30:38], line[38:46], line[46:54])
+        keys.append((chain, resi))
+        atom_names.append(atom)
+        coords.append(xyz)
+    coords = np.array(coords, dtype=float).reshape(-1, 3)
+
+    detail = {tuple(key[:2]) for key in detail}
+    full = set(detail)
+    detail_atoms = np.array([key in detail for key in keys], dtype=bool)
+    if detail_atoms.any():
+        ca = [i for i, atom in enumerate(atom_names) if atom == "CA"]
+        distances, _ = cKDTree(coords[detail_atoms]).query(coords[ca], distance_upper_bound=radius)
+        full.update(keys[i] for i, distance in zip(ca, distances) if np.isfinite(distance))
+
+    kept = [line for line, key, atom in zip(lines, keys, atom_names) if atom == "CA" or key in full]
+    return header + "".join(kept) + ("#\n" if cif else "END\n")
+
+
+def show_structure(model_text, fmt="pdb", chain_colors=None, highlight=(), width=800, height=600, html_path=None):
+    """
+    Render a model with py3Dmol: chains as colored cartoons, `highlight` residues as orange sticks.
+
+    With `html_path` the viewer is written to that HTML file and only an IFrame pointing to it
+    is displayed, so the model is not stored in the notebook. Otherwise it is shown inline.
+
+    Args:
+        model_text (str): PDB or mmCIF text, e.g. from `lod_model_text`.
+        fmt (str): "pdb" or "cif".
+        chain_colors (dict): {chain: color}; see `assign_colors`.
+        highlight (set): (chain, resi) of the residues to highlight.
+        html_path (str): HTML file for the viewer, relative to the notebook directory.
+
+    Returns:
+        py3Dmol.view: The viewer.
+    """
+    try:
+        import py3Dmol
+    except ImportError:
+        raise ImportError("show_structure needs `pip install py3Dmol`")
+
+    view = py3Dmol.view(width=width, height=height)
+    view.addModel(model_text, fmt)
+    for chain_id, color in (chain_colors or {}).items():
+        view.setStyle({'chain': chain_id}, {'cartoon': {'color': color}})
+    by_chain = {}
+    for chain_id, resi in highlight:
+        by_chain.setdefault(chain_id, []).append(int(re.match(r'-?\d+', resi).group()))
+    for chain_id, residues in by_chain.items():
+        view.setStyle({'chain': chain_id, 'resi': residues},
+                      {'cartoon': {'color': 'orange'}, 'stick': {'colorscheme': 'orangeCarbon'}})
+    view.zoomTo({'chain': list(by_chain)} if by_chain else {})
+
+    if html_path is None:
+        view.show()
+        return view
+    from IPython.display import IFrame, display
+    os.makedirs(os.path.dirname(html_path) or ".", exist_ok=True)
+    with open(html_path, 'w') as f:
+        view.write_html(f)
+    display(IFrame(html_path, width=width + 20, height=height + 20))
+    return view
+
+
+def _candidate(item):
+    # (path, interfaces) of a ScreenResult, a pipeline candidate dict or a plain path
+    if isinstance(item, ScreenResult):
+        return item.path, item.interfaces
+    if isinstance(item, dict):
+        return item["path"], item.get("interfaces", {})
+    if isinstance(item, str):
+        return item, {}
+    return tuple(item)
+
+
+class CandidatePager:
+    """
+    Page through screened candidates in a notebook, one structure at a time.
+
+    Each candidate is drawn with `lod_model_text`: full atoms around its interface residues and
+    a CA trace elsewhere. Chain indices and model texts are kept in memory (the last
+    `cache_size` models), so going back and forth does not read the files again. Viewers are
+    written to `html_dir` and shown in an IFrame instead of being embedded in the notebook.
+
+    Args:
+        candidates (iterable): ScreenResults, pipeline candidate dicts with "path" and
+                               "interfaces", (path, interfaces) pairs or paths.
+        chains (list): Chains to show (default: all chains of each structure).
+        radius (float): Full-atom radius around the interface; see `lod_model_text`.
+        page_size (int): Candidates listed per page by `page`.
+        html_dir (str): Directory for the viewer HTML files. None embeds them in the notebook.
+        cache_size (int): Model texts kept in memory.
+    """
+
+    def __init__(self, candidates, chains=None, radius=8.0, page_size=20, html_dir="viewer_html", cache_size=32,
+                 width=800, height=600):
+        self.candidates = [_candidate(item) for item in candidates]
+        self.chains = chains
+        self.radius = radius
+        self.page_size = page_size
+        self.html_dir = html_dir
+        self.cache_size = cache_size
+        self.width = width
+        self.height = height
+        self.position = 0
+        self._indices = {}
+        self._models = {}  # (path, mtime_ns) -> (model text, highlight), least recently used first
+
+    @classmethod
+    def from_reports(cls, report_dir, input_base, extensions=(".pdb", ".cif"), **kwargs) -> "CandidatePager":
+        """Candidates from the `.interface.json` files written by pipeline.py --report-dir."""
+        candidates = []
+        for path in iter_structure_files(input_base, extensions):
+            name = os.path.splitext(os.path.relpath(path, input_base))[0]
+            report_path = os.path.join(report_dir, name + ".interface.json")
+            if os.path.exists(report_path):
+                with open(report_path, 'r') as f:
+                    candidates.append((path, json.load(f)))
+        return cls(candidates, **kwargs)
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def index(self, path) -> dict:
+        if path not in self._indices:
+            self._indices[path] = load_chain_index(path)
+        return self._indices[path]
+
+    def _model(self, path, interfaces):
+        key = (path, os.stat(path).st_mtime_ns)
+        model = self._models.pop(key, None)
+        if model is None:
+            highlight = interface_residue_keys(interfaces)
+            model = (lod_model_text(path, self.chains, highlight, self.radius, self.index(path)), highlight)
+        self._models[key] = model
+        if len(self._models) > self.cache_size:
+            del self._models[next(iter(self._models))]
+        return model
+
+    def page(self, number=None) -> list:
+        """Print one page of candidates with their interface sizes; returns their positions."""
+        number = self.position // self.page_size if number is None else number
+        positions = list(range(number * self.page_size, min((number + 1) * self.page_size, len(self))))
+        for i in positions:
+            path, interfaces = self.candidates[i]
+            residues = interface_residue_keys(interfaces)
+            chains = sorted({chain for chain, _ in residues})
+            print(f"{i:>5}  {len(residues):>4} interface residues ({', '.join(chains) or '-'})  {path}")
+        return positions
+
+    def show(self, position=None):
+        """Render candidate `position` (default: the current one)."""
+        if position is not None:
+            self.position = max(0, min(position, len(self) - 1))
+        path, interfaces = self.candidates[self.position]
+        model_text, highlight = self._model(path, interfaces)
+        index = self.index(path)
+        chain_colors = assign_colors(list_chains(path, index))
+        if self.chains is not None:
+            chain_colors = {chain: color for chain, color in chain_colors.items() if chain in self.chains}
+        print(f"{self.position + 1}/{len(self)}  {path}")
+        html_path = None
+        if self.html_dir is not None:
+            html_path = os.path.join(self.html_dir, f"candidate_{self.position:05d}.html")
+        return show_structure(model_text, index["format"], chain_colors, highlight, self.width, self.height,
+                              html_path)
+
+    def next(self):
+        return self.show(self.position + 1)
+
+    def previous(self):
+        return self.show(self.position - 1)
+
+    def widget(self):
+        """Previous/next buttons around the viewer (needs ipywidgets)."""
+        try:
+            import ipywidgets
+        except ImportError:
+            raise ImportError("CandidatePager.widget needs `pip install ipywidgets`")
+        from IPython.display import display
+
+        output = ipywidgets.Output()
+        previous = ipywidgets.Button(description="Previous")
+        following = ipywidgets.Button(description="Next")
+
+        def render(step):
+            output.clear_output(wait=True)
+            with output:
+                self.show(self.position + step)
+
+        previous.on_click(lambda _: render(-1))
+        following.on_click(lambda _: render(1))
+        display(ipywidgets.VBox([ipywidgets.HBox([previous, following]), output]))
+        render(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build chain indices of structure files and list their chains.")
+    parser.add_argument("inputs", nargs="+", help="Structure files or directories")
+    parser.add_argument("--extensions", nargs="+", default=[".pdb", ".cif"], help="Structure file extensions")
+    parser.add_argument("--quiet", action="store_true", help="Only build the indices")
+    args = parser.parse_args()
+
+    for input_path in args.inputs:
+        paths = iter_structure_files(input_path, args.extensions) if os.path.isdir(input_path) else [input_path]
+        for path in paths:
+            try:
+                chain_info = list_chains(path)
+            except Exception as e:
+                print(f"Error processing {path}: {str(e)}")
+                continue
+            if args.quiet:
+                continue
+            print(path)
+            for chain, info in chain_info.items():
+                print(f"Chain {chain}:")
+                print(f"  Length: {info['length']}")
+                print(f"  Sequence: {info['sequence']}")
+
+
+if __name__ == "__main__":
+    main()
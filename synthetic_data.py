@@ -0,0 +1,363 @@
+import argparse
+import json
+import math
+import os
+from dataclasses import dataclass, field
+import numpy as np
+from pdb_seq_stream import THREE_TO_ONE
+from structure_arrays import StructureArrays, _from_columns, write_cif_arrays, write_pdb_arrays
+
+# Residues per chain of results/model.pdb (its chains D and E are the heavy and light chains)
+MODEL_CHAIN_LENGTHS = {"A": 276, "B": 100, "C": 9, "H": 212, "L": 211}
+
+# CDR residue ranges (1-based, inclusive) that differ between designs of one target
+CDRS = {"H": [(26, 32), (52, 56), (95, 102)], "L": [(24, 34), (50, 56), (89, 97)]}
+
+ONE_TO_THREE = {one: three for three, one in THREE_TO_ONE.items()}
+
+# Side-chain heavy atoms of each residue after N, CA, C, O
+SIDE_CHAINS = {
+    "ALA": ["CB"], "ARG": ["CB", "CG", "CD", "NE", "CZ", "NH1", "NH2"], "ASN": ["CB", "CG", "OD1", "ND2"],
+    "ASP": ["CB", "CG", "OD1", "OD2"], "CYS": ["CB", "SG"], "GLN": ["CB", "CG", "CD", "OE1", "NE2"],
+    "GLU": ["CB", "CG", "CD", "OE1", "OE2"], "GLY": [], "HIS": ["CB", "CG", "ND1", "CD2", "CE1", "NE2"],
+    "ILE": ["CB", "CG1", "CG2", "CD1"], "LEU": ["CB", "CG", "CD1", "CD2"], "LYS": ["CB", "CG", "CD", "CE", "NZ"],
+    "MET": ["CB", "CG", "SD", "CE"], "PHE": ["CB", "CG", "CD1", "CD2", "CE1", "CE2", "CZ"], "PRO": ["CB", "CG", "CD"],
+    "SER": ["CB", "OG"], "THR": ["CB", "OG1", "CG2"],
+    "TRP": ["CB", "CG", "CD1", "CD2", "NE1", "CE2", "CE3", "CZ2", "CZ3", "CH2"],
+    "TYR": ["CB", "CG", "CD1", "CD2", "CE1", "CE2", "CZ", "OH"], "VAL": ["CB", "CG1", "CG2"],
+}
+
+_AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+_CA_STEP = 3.8      # CA-CA distance of consecutive residues
+_CONTACT_GAP = 4.5  # CA-CA distance between touching chains
+_MISS_SHIFT = 60.0  # How far the antibody of a non-binding design is moved away
+
+# (seed, scale, chain lengths, target) -> _Target
+_TARGETS = {}
+
+
+@dataclass
+class SyntheticConfig:
+    """
+    Shape of the synthetic complexes: antigen chains A, B and C and antibody chains H and L.
+
+    Every design of a target shares the antigen and the antibody framework; the CDRs differ in
+    sequence and move more than the rest. A design is a "hit" (H/L touch C) with probability
+    `hit_fraction`; otherwise the antibody is moved far away. An AlphaFold3 job passes the
+    ipTM >= 0.8 filter of read_confidences with probability `high_confidence_fraction`.
+
+    Args:
+        chain_lengths (dict): Residues per chain, by default those of results/model.pdb.
+        scale (float): Multiplies every chain length, to benchmark larger assemblies.
+        hit_fraction (float): Fraction of designs whose antibody contacts chain C.
+        high_confidence_fraction (float): Fraction of AlphaFold3 jobs with a high C-H or C-L ipTM.
+        designs_per_folder (int): Designs per DiffAb-like output folder.
+        targets (int): Number of distinct antigen/antibody targets the designs cycle through.
+        seed (int): Seed of every random choice; the same config always gives the same files.
+    """
+    chain_lengths: dict = field(default_factory=lambda: dict(MODEL_CHAIN_LENGTHS))
+    scale: float = 1.0
+    hit_fraction: float = 0.5
+    high_confidence_fraction: float = 0.3
+    designs_per_folder: int = 100
+    targets: int = 1
+    seed: int = 0
+
+    def lengths(self) -> dict:
+        return {chain: max(1, round(n * self.scale)) for chain, n in self.chain_lengths.items()}
+
+    def rng(self, *key):
+        return np.random.default_rng([self.seed, *key])
+
+
+def _globule(n, rng, jitter=0.2):
+    """CA trace of n residues filling a cube of 3.8 Å cells in a serpentine, so neighbors stay bonded."""
+    k = max(1, math.ceil(round(n ** (1 / 3), 9)))
+    cells = []
+    row = 0
+    for z in range(k):
+        for y in (range(k) if z % 2 == 0 else range(k - 1, -1, -1)):
+            cells.extend((x, y, z) for x in (range(k) if row % 2 == 0 else range(k - 1, -1, -1)))
+            row += 1
+    return np.array(cells[:n], dtype=float) * _CA_STEP + rng.normal(0, jitter, (n, 3))
+
+
+def _residue_numbers(chain, n) -> list:
+    # Antibody chains get Chothia-like insertion codes in CDR3, like DiffAb outputs
+    numbers = [str(i) for i in range(1, n + 1)]
+    if chain == "H" and n > 110:
+        numbers = numbers[:100] + ["100A", "100B", "100C"] + [str(i) for i in range(101, n - 2)]
+    return numbers
+
+
+def _template(three):
+    # Atom names and their offsets from CA along (to N, to C, side, normal)
+    names = ["N", "CA", "C", "O"] + SIDE_CHAINS[three]
+    offsets = [(1, 0, 0, 0), (0, 0, 0, 0), (0, 1, 0, 0), (0, 1, -1.23, 0)]
+    offsets += [(0, 0, 1.53 + 1.2 * j, 0.9 * (j % 2)) for j in range(len(SIDE_CHAINS[three]))]
+    return names, np.array(offsets)
+
+
+_TEMPLATES = {three: _template(three) for three in SIDE_CHAINS}
+
+
+def _build_atoms(chain, ca, sequence, numbers):
+    """Backbone and side-chain atoms around a CA trace, with C(i)-N(i+1) within peptide bond length."""
+    n = len(ca)
+    steps = np.diff(ca, axis=0) if n > 1 else np.array([[_CA_STEP, 0, 0]])
+    lengths = np.linalg.norm(steps, axis=1, keepdims=True)
+    directions = np.vstack([steps / lengths, steps[-1:] / lengths[-1:]])
+    # C(i) and N(i+1) sit on either side of the midpoint of CA(i)-CA(i+1), 1.33 Å apart
+    bond = np.vstack([steps * (0.5 - 0.665 / lengths), 1.3 * directions[-1:]])
+    to_n = -np.vstack([1.3 * directions[:1], bond[:-1]])
+    reference = np.where(np.abs(directions[:, :1]) < 0.9, [[1.0, 0, 0]], [[0, 1.0, 0]])
+    sides = np.cross(directions, reference)
+    sides /= np.linalg.norm(sides, axis=1, keepdims=True)
+    sides[1::2] *= -1
+    normals = np.cross(directions, sides)
+    frames = np.stack([to_n, bond, sides, normals], axis=1)
+
+    residues = [ONE_TO_THREE[one] for one in sequence]
+    templates = [_TEMPLATES[three] for three in residues]
+    counts = np.array([len(names) for names, _ in templates])
+    residue = np.repeat(np.arange(n), counts)
+    offsets = np.concatenate([offsets for _, offsets in templates])
+    coords = ca[residue] + np.einsum('ak,akx->ax', offsets, frames[residue])
+    names = [name for template_names, _ in templates for name in template_names]
+
+    # Terminal oxygen of the last residue
+    coords = np.vstack([coords, ca[-1] + 1.3 * directions[-1] + 1.1 * normals[-1]])
+    names.append("OXT")
+    residue = np.append(residue, n - 1)
+    return (coords, names, np.array(residues)[residue], np.array(numbers)[residue],
+            [chain] * len(names), [name[0] for name in names])
+
+
+class _Target:
+    """Antigen and parent antibody shared by all designs of one target."""
+
+    def __init__(self, config: SyntheticConfig, target: int):
+        rng = config.rng(target, 0)
+        lengths = config.lengths()
+        self.sequences = {chain: "".join(rng.choice(list(_AMINO_ACIDS), n)) for chain, n in lengths.items()}
+        traces = {chain: _globule(n, rng) for chain, n in lengths.items()}
+
+        for trace in traces.values():
+            trace -= trace.min(axis=0)
+        extent = {chain: trace.max(axis=0) for chain, trace in traces.items()}
+
+        # A at the origin, B beside it, C on top of A, then H and L side by side on top of C
+        traces["B"] += [-extent["B"][0] - _CONTACT_GAP - _CA_STEP, 0, 0]
+        traces["C"] += [(extent["A"][0] - extent["C"][0]) / 2, (extent["A"][1] - extent["C"][1]) / 2,
+                        extent["A"][2] + _CONTACT_GAP]
+        center_c = traces["C"].mean(axis=0)
+        top = traces["C"][:, 2].max() + _CONTACT_GAP
+        traces["H"] += [center_c[0] - extent["H"][0] - _CA_STEP / 2, center_c[1] - extent["H"][1] / 2, top]
+        traces["L"] += [center_c[0] + _CA_STEP / 2, center_c[1] - extent["L"][1] / 2, top]
+        self.traces = traces
+        self.numbers = {chain: _residue_numbers(chain, n) for chain, n in lengths.items()}
+
+    def cdr_mask(self, chain) -> np.ndarray:
+        mask = np.zeros(len(self.traces[chain]), dtype=bool)
+        for start, end in CDRS.get(chain, []):
+            mask[start - 1:end] = True
+        return mask
+
+
+def synthetic_design(config: SyntheticConfig, index: int, chain_order=("A", "B", "C", "H", "L")):
+    """
+    Build design number `index` (deterministic for a given config).
+
+    Returns:
+        tuple: (StructureArrays, hit, {chain_id: sequence}). `hit` tells whether H/L contact C.
+    """
+    target_id = index % config.targets
+    key = (config.seed, config.scale, tuple(sorted(config.chain_lengths.items())), target_id)
+    if key not in _TARGETS:
+        _TARGETS[key] = _Target(config, target_id)
+    target = _TARGETS[key]
+
+    rng = config.rng(target_id, 1, index)
+    hit = bool(rng.random() < config.hit_fraction)
+    columns = [[] for _ in range(6)]
+    sequences = {}
+    for chain in chain_order:
+        sequence = list(target.sequences[chain])
+        trace = target.traces[chain] + rng.normal(0, 0.15, target.traces[chain].shape)
+        if chain in CDRS:
+            cdr = target.cdr_mask(chain)
+            for i in np.nonzero(cdr)[0]:
+                sequence[i] = _AMINO_ACIDS[rng.integers(len(_AMINO_ACIDS))]
+            trace[cdr] += rng.normal(0, 0.8, (cdr.sum(), 3))
+            if not hit:
+                trace[:, 2] += _MISS_SHIFT
+        sequences[chain] = "".join(sequence)
+        for column, values in zip(columns, _build_atoms(chain, trace, sequences[chain], target.numbers[chain])):
+            column.append(values)
+
+    coords, names, resn, resi, chain_ids, elements = (np.concatenate(column) for column in columns)
+    n = len(names)
+    structure = _from_columns(coords, names, resn, resi, chain_ids, elements, np.zeros(n, dtype=bool), [""] * n)
+    return structure, hit, sequences
+
+
+def generate_designs(output_base, n_designs, config: SyntheticConfig = None, fmt="pdb") -> list:
+    """
+    Write `n_designs` DiffAb-like complexes as
+    `{output_base}/target_{t}/codesign_multicdrs_6/design_{folder:04d}/{index:04d}.{fmt}`.
+
+    Args:
+        output_base (str): Output directory.
+        n_designs (int): Number of structure files.
+        config (SyntheticConfig): Shape of the complexes. Defaults to SyntheticConfig().
+        fmt (str): "pdb" or "cif".
+
+    Returns:
+        list: (path, hit) for every file, in index order.
+    """
+    config = config or SyntheticConfig()
+    written = []
+    for index in range(n_designs):
+        structure, hit, _ = synthetic_design(config, index)
+        folder = os.path.join(output_base, f"target_{index % config.targets}", "codesign_multicdrs_6",
+                              f"design_{index // config.designs_per_folder:04d}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{index:04d}.{fmt}")
+        if fmt == "cif":
+            write_cif_arrays(structure, path, name=f"design_{index:04d}")
+        else:
+            write_pdb_arrays(structure, path)
+        written.append((path, hit))
+    return written
+
+
+def _confidences(config: SyntheticConfig, index, structure: StructureArrays, chain_order):
+    rng = config.rng(index % config.targets, 2, index)
+    k = len(chain_order)
+    high = bool(rng.random() < config.high_confidence_fraction)
+    # ipTM of C-L and C-H: at least one >= 0.8 for high-confidence jobs, both below otherwise
+    if high:
+        best, other = rng.uniform(0.80, 0.95), rng.uniform(0.40, 0.90)
+    else:
+        best, other = rng.uniform(0.20, 0.79), rng.uniform(0.20, 0.79)
+    c_l, c_h = (best, other) if rng.random() < 0.5 else (other, best)
+
+    iptm = np.round(rng.uniform(0.3, 0.9, (k, k)), 2)
+    iptm = np.round((iptm + iptm.T) / 2, 2)
+    chain_ptm = np.round(rng.uniform(0.6, 0.95, k), 2)
+    np.fill_diagonal(iptm, chain_ptm)
+    c, l, h = (chain_order.index(chain) for chain in ("C", "L", "H"))
+    iptm[c, l] = iptm[l, c] = round(c_l, 2)
+    iptm[c, h] = iptm[h, c] = round(c_h, 2)
+    pae_min = np.round(rng.uniform(0.8, 12.0, (k, k)), 2)
+    np.fill_diagonal(pae_min, 0.76)
+    ptm = round(float(rng.uniform(0.6, 0.9)), 2)
+    overall_iptm = round(float(iptm[np.triu_indices(k, 1)].mean()), 2)
+
+    summary = {
+        "chain_iptm": np.round(iptm.mean(axis=1), 2).tolist(),
+        "chain_pair_iptm": iptm.tolist(),
+        "chain_pair_pae_min": pae_min.tolist(),
+        "chain_ptm": chain_ptm.tolist(),
+        "fraction_disordered": round(float(rng.uniform(0, 0.1)), 2),
+        "has_clash": 0.0,
+        "iptm": overall_iptm,
+        "num_recycles": 10.0,
+        "ptm": ptm,
+        "ranking_score": round(0.8 * overall_iptm + 0.2 * ptm, 2),
+    }
+    plddt = np.round(rng.uniform(50, 95, len(structure)), 2)
+    return summary, plddt, high
+
+
+def _full_confidences(config: SyntheticConfig, index, structure: StructureArrays, plddt) -> dict:
+    # Per-token arrays of the `*_confidences.json` next to the summary; one token per residue
+    rng = config.rng(index % config.targets, 3, index)
+    ca = structure.atom_names == "CA"
+    token_chain_ids = structure.chain_ids[ca].tolist()
+    n = len(token_chain_ids)
+    pae = np.round(rng.uniform(0.5, 30.0, (n, n)), 2)
+    contact_probs = np.round(rng.uniform(0, 1, (n, n)) ** 8, 2)
+    return {
+        "atom_chain_ids": structure.chain_ids.tolist(),
+        "atom_plddts": plddt.tolist(),
+        "contact_probs": contact_probs.tolist(),
+        "pae": pae.tolist(),
+        "token_chain_ids": token_chain_ids,
+        "token_res_ids": [int(resi.rstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZ")) for resi in structure.resi[ca].tolist()],
+    }
+
+
+def generate_af3_outputs(output_base, n_jobs, config: SyntheticConfig = None, full_confidences=False) -> dict:
+    """
+    Write `n_jobs` AlphaFold3 output folders `{output_base}/{job}/` with `{job}_model.cif`,
+    `{job}_summary_confidences.json` and `{job}_data.json` (and `{job}_confidences.json` with
+    the per-token PAE and contact matrices if `full_confidences`). Chains are in the order
+    convert_to_alphafold_input writes them: A, B, C, L, H.
+
+    Returns:
+        dict: The jobs that read_confidences.read_high_confidences should select, in the
+              format of selected_chains/*.json: {job: [C-L ipTM, C-H ipTM, {chain_id: sequence}]}.
+    """
+    config = config or SyntheticConfig()
+    chain_order = ("A", "B", "C", "L", "H")
+    expected = {}
+    for index in range(n_jobs):
+        job = f"synthetic_af_input__target_{index % config.targets}__{index:05d}"
+        folder = os.path.join(output_base, job)
+        os.makedirs(folder, exist_ok=True)
+        structure, _, sequences = synthetic_design(config, index, chain_order)
+        summary, plddt, high = _confidences(config, index, structure, chain_order)
+
+        write_cif_arrays(structure, os.path.join(folder, f"{job}_model.cif"), name=job, b_factors=plddt)
+        with open(os.path.join(folder, f"{job}_summary_confidences.json"), 'w') as f:
+            json.dump(summary, f, indent=1)
+        data = {
+            "dialect": "alphafold3",
+            "version": 1,
+            "name": job,
+            "sequences": [{"protein": {"id": chain, "sequence": sequences[chain]}} for chain in chain_order],
+            "modelSeeds": [1],
+        }
+        with open(os.path.join(folder, f"{job}_data.json"), 'w') as f:
+            json.dump(data, f, indent=1)
+        if full_confidences:
+            with open(os.path.join(folder, f"{job}_confidences.json"), 'w') as f:
+                # json.dump would write the large matrices in many small chunks
+                f.write(json.dumps(_full_confidences(config, index, structure, plddt)))
+
+        if high:
+            matrix = summary["chain_pair_iptm"]
+            expected[job] = [matrix[2][3], matrix[2][4], {chain: sequences[chain] for chain in chain_order}]
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic DiffAb designs and AlphaFold3 outputs.")
+    parser.add_argument("output_base")
+    parser.add_argument("--designs", type=int, default=100, help="Number of design structures")
+    parser.add_argument("--format", choices=["pdb", "cif"], default="pdb", help="Format of the designs")
+    parser.add_argument("--af3-jobs", type=int, default=0, help="Number of AlphaFold3 output folders")
+    parser.add_argument("--full-confidences", action="store_true", help="Also write *_confidences.json")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every chain length")
+    parser.add_argument("--hit-fraction", type=float, default=0.5)
+    parser.add_argument("--high-confidence-fraction", type=float, default=0.3)
+    parser.add_argument("--targets", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = SyntheticConfig(scale=args.scale, hit_fraction=args.hit_fraction,
+                             high_confidence_fraction=args.high_confidence_fraction, targets=args.targets,
+                             seed=args.seed)
+    designs = generate_designs(os.path.join(args.output_base, "designs"), args.designs, config, args.format)
+    print(f"{len(designs)} designs, {sum(hit for _, hit in designs)} hits")
+    if args.af3_jobs:
+        expected = generate_af3_outputs(os.path.join(args.output_base, "af_output"), args.af3_jobs, config,
+                                        args.full_confidences)
+        with open(os.path.join(args.output_base, "expected_selected.json"), 'w') as f:
+            json.dump(expected, f, indent=4)
+        print(f"{args.af3_jobs} AlphaFold3 outputs, {len(expected)} with high confidence")
+
+
+if __name__ == "__main__":
+    main()